@@ -1,3 +1,17 @@
 from django.contrib import admin
 
+from .models_watchlist import Watchlist, SeriesWatermark
+
 # Register your models here.
+
+
+@admin.register(Watchlist)
+class WatchlistAdmin(admin.ModelAdmin):
+    list_display = ('email', 'series', 'name', 'created')
+    search_fields = ('email', 'series', 'name')
+
+
+@admin.register(SeriesWatermark)
+class SeriesWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('series', 'last_date', 'last_value', 'checked', 'updated')
+    search_fields = ('series',)
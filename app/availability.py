@@ -0,0 +1,184 @@
+import os
+import logging
+import tempfile
+import threading
+
+import numpy as np
+import datacommons as dc
+from django.conf import settings
+
+from .observations import parse_observations
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class AvailabilityIndex():
+    """
+    Which Data Commons series exist, as a bitmap over (country, stat var, frequency)
+    with the first and last observation date of every series that exists.
+
+    The index is built offline by the build_availability management command and
+    saved to AVAILABILITY_INDEX_PATH, then loaded once per process at startup.
+    Lookups are a dict lookup per axis and an array access. Series outside the
+    index, or every series while no index has been built, count as available so
+    the site keeps working without it.
+    """
+
+    _index = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def build(countries, stat_vars, periods):
+        """
+        Builds the index from bulk get_stat_all calls. `periods` maps each frequency
+        code to its Data Commons observation period.
+        """
+        frequencies = list(periods)
+        frequency_of = {period: i for i, period in enumerate(periods.values())}
+
+        shape = (len(countries), len(stat_vars), len(frequencies))
+        bitmap = np.zeros(shape, dtype=bool)
+        first = np.zeros(shape, dtype=np.int32)
+        last = np.zeros(shape, dtype=np.int32)
+
+        stat_var_pos = {code: i for i, code in enumerate(stat_vars)}
+        batch = settings.DATA_COMMONS_BULK_BATCH
+
+        for start in range(0, len(countries), batch):
+            places = [f"country/{code}" for code in countries[start:start + batch]]
+            with Metrics.upstream('data_commons'):
+                result = dc.get_stat_all(places, stat_vars)
+
+            for c, place in enumerate(places, start):
+                for stat_var, stat in (result.get(place) or {}).items():
+                    if stat_var not in stat_var_pos:
+                        continue
+                    s = stat_var_pos[stat_var]
+
+                    for source in (stat or {}).get('sourceSeries', []):
+                        f = frequency_of.get(source.get('observationPeriod'))
+                        if f is None or not source.get('val'):
+                            continue
+
+                        dates = parse_observations(source['val'])[0]['date']
+                        if dates.empty:
+                            continue
+
+                        lo = int((dates.iloc[0].to_datetime64().astype('datetime64[D]') - _EPOCH).astype(np.int64))
+                        hi = int((dates.iloc[-1].to_datetime64().astype('datetime64[D]') - _EPOCH).astype(np.int64))
+
+                        if bitmap[c, s, f]:
+                            first[c, s, f] = min(first[c, s, f], lo)
+                            last[c, s, f] = max(last[c, s, f], hi)
+                        else:
+                            bitmap[c, s, f] = True
+                            first[c, s, f] = lo
+                            last[c, s, f] = hi
+
+        return {
+            'countries': list(countries),
+            'stat_vars': list(stat_vars),
+            'frequencies': frequencies,
+            'bitmap': bitmap,
+            'first': first,
+            'last': last,
+        }
+
+    @staticmethod
+    def save(index, path=None):
+        """
+        Writes an index built by build(), replacing the previous one atomically.
+        The bitmap is stored bit-packed.
+        """
+        path = path or settings.AVAILABILITY_INDEX_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    countries=np.array(index['countries']),
+                    stat_vars=np.array(index['stat_vars']),
+                    frequencies=np.array(index['frequencies']),
+                    shape=np.array(index['bitmap'].shape),
+                    bitmap=np.packbits(index['bitmap'], axis=None),
+                    first=index['first'],
+                    last=index['last'],
+                )
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def load(path=None):
+        """
+        Loads the saved index into memory. Returns False if there is none.
+        """
+        path = path or settings.AVAILABILITY_INDEX_PATH
+        try:
+            with np.load(path) as saved:
+                shape = tuple(saved['shape'])
+                index = {
+                    'countries': {code: i for i, code in enumerate(saved['countries'].tolist())},
+                    'stat_vars': {code: i for i, code in enumerate(saved['stat_vars'].tolist())},
+                    'frequencies': {code: i for i, code in enumerate(saved['frequencies'].tolist())},
+                    'bitmap': np.unpackbits(saved['bitmap'], count=int(np.prod(shape))).astype(bool).reshape(shape),
+                    'first': saved['first'],
+                    'last': saved['last'],
+                }
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error("Failed to load availability index %s: %s", path, e)
+            return False
+
+        with AvailabilityIndex._lock:
+            AvailabilityIndex._index = index
+        return True
+
+    @staticmethod
+    def _position(country_code, stat_var, frequency):
+        index = AvailabilityIndex._index
+        if index is None:
+            return None, None
+
+        c = index['countries'].get(country_code)
+        s = index['stat_vars'].get(stat_var)
+        if c is None or s is None:
+            return index, None
+
+        if frequency:
+            f = index['frequencies'].get(frequency)
+            return index, None if f is None else (c, s, f)
+        return index, (c, s)
+
+    @staticmethod
+    def available(country_code, stat_var, frequency=''):
+        """
+        Whether a series has data, for one frequency or for any frequency if none
+        is given. Series the index does not cover count as available.
+        """
+        index, position = AvailabilityIndex._position(country_code, stat_var, frequency)
+        if position is None:
+            return True
+        return bool(index['bitmap'][position].any())
+
+    @staticmethod
+    def coverage(country_code, stat_var, frequency):
+        """
+        (first, last) observation dates of a series as datetime64[D], or None if the
+        series has no data or is not in the index.
+        """
+        index, position = AvailabilityIndex._position(country_code, stat_var, frequency)
+        if position is None or len(position) != 3 or not index['bitmap'][position]:
+            return None
+        return (
+            _EPOCH + np.timedelta64(int(index['first'][position]), 'D'),
+            _EPOCH + np.timedelta64(int(index['last'][position]), 'D'),
+        )
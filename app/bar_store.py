@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import threading
+import tempfile
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Aggregation levels kept next to the daily bars, finest first: the pandas
+# resample rule, which labels every bar with the last day of its period, and
+# the matching period frequency.
+LEVELS = {
+    'D': (None, None),
+    'W': ('W-FRI', 'W-FRI'),
+    'M': ('ME', 'M'),
+    'Q': ('QE', 'Q'),
+}
+
+_AGGREGATION = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class BarStore():
+    """
+    Local columnar store holding one full daily OHLCV history per ticker.
+
+    Each ticker is a single .npy file with shape (6, n): row 0 holds the bar
+    dates as days since the epoch and rows 1-5 hold Open, High, Low, Close and
+    Volume. Every row is contiguous on disk, so the file is memory-mapped and
+    the page cache is shared by all worker processes on the host. Files are
+    replaced atomically, so readers never see a half-written history.
+
+    Weekly, monthly and quarterly aggregates are stored the same way in
+    <ticker>.W.npy, <ticker>.M.npy and <ticker>.Q.npy.
+    """
+
+    _handles = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def symbol(ticker):
+        """
+        The ticker as it is stored. Tickers come from the URL, so they are upper
+        cased and anything outside the usual symbol characters is replaced.
+        """
+        return re.sub(r'[^A-Z0-9.\-^=]', '_', str(ticker).upper())
+
+    @staticmethod
+    def path(ticker, level='D'):
+        """
+        Path of the store file for a ticker.
+        """
+        name = BarStore.symbol(ticker)
+        if level != 'D':
+            name = f"{name}.{level}"
+        return os.path.join(settings.BAR_STORE_DIR, f"{name}.npy")
+
+    @staticmethod
+    def load(ticker, level='D'):
+        """
+        Returns the memory-mapped (6, n) array for a ticker, or None if the
+        ticker has never been stored. Mappings are reused until the file is
+        replaced. Aggregate levels missing on disk are built from the daily bars.
+        """
+        path = BarStore.path(ticker, level)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if level == 'D' or BarStore.load(ticker) is None:
+                return None
+            BarStore._write_level(ticker, level, BarStore.frame(ticker))
+            return BarStore.load(ticker, level)
+
+        with BarStore._lock:
+            handle = BarStore._handles.get(path)
+            if handle is not None and handle[0] == mtime:
+                return handle[1]
+
+        bars = np.load(path, mmap_mode='r')
+        with BarStore._lock:
+            BarStore._handles[path] = (mtime, bars)
+        return bars
+
+    @staticmethod
+    def age(ticker):
+        """
+        Seconds since the stored history for a ticker was last written, or
+        None if there is no stored history.
+        """
+        try:
+            return time.time() - os.stat(BarStore.path(ticker)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def write(ticker, data, changed_since=None):
+        """
+        Stores a full daily history. `data` is a DataFrame with a DatetimeIndex
+        and the Open, High, Low, Close and Volume columns.
+
+        The aggregate levels are rebuilt from the daily bars. If `changed_since`
+        is given, only the aggregate bars of the periods from that date on are
+        recomputed and the older ones are kept.
+        """
+        data = data[~data.index.duplicated(keep='last')].sort_index()
+        BarStore._save(BarStore.path(ticker), BarStore._to_array(data))
+
+        for level in LEVELS:
+            if level != 'D':
+                BarStore._write_level(ticker, level, data, changed_since)
+
+    @staticmethod
+    def _write_level(ticker, level, daily, changed_since=None):
+        rule, period = LEVELS[level]
+        stored = None
+
+        if changed_since is not None and os.path.exists(BarStore.path(ticker, level)):
+            # Aggregates of the periods before the one holding changed_since stay valid
+            cutoff = pd.Timestamp(changed_since).to_period(period).start_time
+            stored = BarStore.frame(ticker, level)
+            stored = stored[stored.index < cutoff]
+            daily = daily[daily.index >= cutoff]
+
+        aggregated = daily.resample(rule).agg(_AGGREGATION).dropna(subset=['Close'])
+        if stored is not None:
+            aggregated = pd.concat([stored, aggregated])
+
+        BarStore._save(BarStore.path(ticker, level), BarStore._to_array(aggregated))
+
+    @staticmethod
+    def _to_array(data):
+        bars = np.empty((len(COLUMNS) + 1, len(data)), dtype=np.float64)
+        dates = data.index.values.astype('datetime64[D]')
+        bars[0] = (dates - _EPOCH).astype(np.int64)
+        bars[1:] = data[COLUMNS].to_numpy(dtype=np.float64).T
+        return bars
+
+    @staticmethod
+    def _save(path, bars):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, bars)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _bounds(bars, start_date, end_date, level='D'):
+        end_date = pd.to_datetime(end_date)
+        if level != 'D':
+            # Aggregate bars are labelled with the last day of their period, so the
+            # period holding end_date (e.g. the current month) ends after it
+            end_date = end_date.to_period(LEVELS[level][1]).end_time
+        start = (np.datetime64(pd.to_datetime(start_date).date(), 'D') - _EPOCH).astype(np.int64)
+        end = (np.datetime64(end_date.date(), 'D') - _EPOCH).astype(np.int64)
+
+        lo = np.searchsorted(bars[0], start, side='left')
+        hi = np.searchsorted(bars[0], end, side='right')
+        return lo, hi
+
+    @staticmethod
+    def slice(ticker, start_date, end_date, level='D'):
+        """
+        Returns the bars between start_date and end_date (inclusive) as a
+        DataFrame, using binary search on the date row. Returns None if the
+        ticker has never been stored.
+        """
+        bars = BarStore.load(ticker, level)
+        if bars is None:
+            return None
+
+        lo, hi = BarStore._bounds(bars, start_date, end_date, level)
+        return BarStore._to_frame(np.array(bars[:, lo:hi]))
+
+    @staticmethod
+    def count(ticker, start_date, end_date, level='D'):
+        """
+        Number of stored bars between start_date and end_date, 0 if the ticker has
+        never been stored.
+        """
+        bars = BarStore.load(ticker, level)
+        if bars is None:
+            return 0
+        lo, hi = BarStore._bounds(bars, start_date, end_date, level)
+        return int(hi - lo)
+
+    @staticmethod
+    def pick_level(ticker, start_date, end_date, min_bars):
+        """
+        Coarsest level that still has at least `min_bars` bars between start_date
+        and end_date, falling back to daily bars.
+        """
+        for level in reversed(list(LEVELS)):
+            bars = BarStore.load(ticker, level)
+            if bars is None:
+                continue
+            lo, hi = BarStore._bounds(bars, start_date, end_date, level)
+            if hi - lo >= min_bars:
+                return level
+        return 'D'
+
+    @staticmethod
+    def frame(ticker, level='D'):
+        """
+        Returns the whole stored history as a DataFrame, or None if the ticker
+        has never been stored.
+        """
+        bars = BarStore.load(ticker, level)
+        if bars is None:
+            return None
+        return BarStore._to_frame(np.array(bars))
+
+    @staticmethod
+    def _to_frame(window):
+        index = pd.DatetimeIndex(_EPOCH + window[0].astype('timedelta64[D]'), name='date')
+        return pd.DataFrame(window[1:].T, index=index, columns=COLUMNS)
+
+    @staticmethod
+    def last_date(ticker):
+        """
+        Date of the newest stored bar, or None if there is no stored history.
+        """
+        bars = BarStore.load(ticker)
+        if bars is None or bars.shape[1] == 0:
+            return None
+        return pd.Timestamp(_EPOCH + np.timedelta64(int(bars[0, -1]), 'D'))
@@ -0,0 +1,16 @@
+from .figures import PLOTLY_JS_URL
+from . import exports
+
+
+def plotly(request):
+    """
+    Plotly.js bundle matching the installed plotly package, used by base.html.
+    """
+    return {'plotly_js_url': PLOTLY_JS_URL}
+
+
+def export_formats(request):
+    """
+    Export formats available on this server, used to show the export buttons.
+    """
+    return {'export_formats': [fmt for fmt in exports.FORMATS if exports.available(fmt)]}
@@ -0,0 +1,195 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import DataCommonsData
+from .models_finance import FinanceModel
+from .models_gd import GDIMF, COUNTRIES, TABLES
+from .models_watchlist import Watchlist, SeriesWatermark
+from .quota import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class DigestEngine():
+    """
+    Emails every watchlist owner the new observations of the series they watch.
+
+    All watchlist entries are collected and reduced to the unique series first.
+    Each series is fetched once through the usual data paths (bar store, Data
+    Commons cache, IMF snapshot) and compared with its SeriesWatermark. The
+    digests are then rendered per user and sent in batches over one mail
+    connection. Upstream calls scale with the number of unique series, not
+    with the number of users.
+    """
+
+    @staticmethod
+    def collect():
+        """
+        Maps every watched series to the e-mail addresses watching it.
+        """
+        watchers = defaultdict(list)
+        for email, series, name in Watchlist.objects.values_list('email', 'series', 'name').iterator():
+            watchers[series].append((email, name))
+        return watchers
+
+    @staticmethod
+    def fetch(series):
+        """
+        Observations of a series as a DataFrame with 'date' and 'value' columns,
+        or None if the series could not be fetched.
+        """
+        kind, *parts = series.split(':')
+
+        if kind == Watchlist.TICKER:
+            ticker = parts[0]
+            start_date = (timezone.now() - pd.Timedelta(days=settings.DIGEST_LOOKBACK_DAYS)).date()
+            data = FinanceModel.get_market_data(ticker, start_date, timezone.now().date(), priority=BACKGROUND)
+            if data is None or data.empty:
+                return None
+            close = data['Close'][ticker]
+            return pd.DataFrame({'date': close.index, 'value': close.to_numpy()})
+
+        if kind == Watchlist.DATA_COMMONS:
+            country_code, indicator_code, frequency = parts
+            data = DataCommonsData.get_data_commons_data(country_code, indicator_code, frequency)
+            if data is None or data.empty:
+                return None
+            return data[['date', 'value']]
+
+        if kind == Watchlist.IMF:
+            indicator, country_code = parts
+            snapshot = GDIMF.snapshot()
+            if snapshot is None:
+                return None
+            name = dict(COUNTRIES).get(country_code)
+            column = {i: c for i, _, c in TABLES}.get(indicator)
+            for table in snapshot['tables']:
+                if table['indicator'] == indicator:
+                    rows = table['table'][table['table']['Country'] == name]
+                    if rows.empty:
+                        return None
+                    return pd.DataFrame({'date': [pd.Timestamp(year=snapshot['year'], month=1, day=1)], 'value': [rows[column].iloc[0]]})
+            return None
+
+        logger.warning("Unknown watchlist series %s", series)
+        return None
+
+    @staticmethod
+    def new_observations(data, watermark):
+        """
+        Rows of `data` newer than the watermark. Without a watermark nothing is new:
+        the first run only records where the series stands.
+        """
+        if watermark is None or watermark.last_date is None:
+            return data.iloc[0:0]
+        dates = pd.to_datetime(data['date'])
+        return data[dates > pd.Timestamp(watermark.last_date)]
+
+    @staticmethod
+    def run(send=True):
+        """
+        Checks all watched series and sends the digests. Returns counters of the run.
+        """
+        watchers = DigestEngine.collect()
+        series_list = list(watchers)
+        watermarks = {w.series: w for w in SeriesWatermark.objects.filter(series__in=series_list)}
+
+        with ThreadPoolExecutor(max_workers=settings.DIGEST_WORKERS) as pool:
+            fetched = dict(zip(series_list, pool.map(DigestEngine._fetch_safely, series_list)))
+
+        now = timezone.now()
+        updates = defaultdict(list)
+        created, existing = [], []
+        latest = {}
+        failed = 0
+
+        for series, data in fetched.items():
+            if data is None or data.empty:
+                failed += 1
+                continue
+
+            watermark = watermarks.get(series)
+            new = DigestEngine.new_observations(data, watermark)
+            if watermark is None:
+                watermark = SeriesWatermark(series=series)
+                created.append(watermark)
+            else:
+                existing.append(watermark)
+
+            if not new.empty:
+                for email, name in watchers[series]:
+                    updates[email].append({'series': series, 'name': name or series, 'observations': list(new.itertuples(index=False))})
+
+            latest[series] = (watermark, data.iloc[-1])
+
+        sent, undelivered = DigestEngine.send(updates) if send else (0, set())
+
+        # Series in a digest that could not be sent keep their watermark, so the
+        # next run picks their observations up again
+        held = {item['series'] for email in undelivered for item in updates[email]}
+        for series, (watermark, last) in latest.items():
+            if series not in held and watermark.last_date != pd.Timestamp(last['date']).date():
+                watermark.last_date = pd.Timestamp(last['date']).date()
+                watermark.last_value = float(last['value'])
+                watermark.updated = now
+            watermark.checked = now
+
+        SeriesWatermark.objects.bulk_create(created, batch_size=500)
+        SeriesWatermark.objects.bulk_update(existing, ['last_date', 'last_value', 'checked', 'updated'], batch_size=500)
+
+        return {
+            'entries': sum(len(w) for w in watchers.values()),
+            'series': len(series_list),
+            'failed': failed,
+            'digests': len(updates),
+            'sent': sent,
+            'held': len(held),
+        }
+
+    @staticmethod
+    def _fetch_safely(series):
+        try:
+            return DigestEngine.fetch(series)
+        except Exception as e:
+            logger.error("Failed to fetch watchlist series %s: %s", series, e)
+            return None
+
+    @staticmethod
+    def send(updates):
+        """
+        Renders one digest per address and sends them in batches of
+        DIGEST_BATCH_SIZE over a single mail connection. Returns the number sent
+        and the set of addresses whose batch failed.
+        """
+        messages = [
+            EmailMessage(
+                subject=f"Macronomics: new data for {len(items)} watched series",
+                body=render_to_string('digest_email.txt', {'items': items}),
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                to=[email],
+            )
+            for email, items in updates.items()
+        ]
+
+        if not messages:
+            return 0, set()
+
+        sent = 0
+        undelivered = set()
+        batch_size = settings.DIGEST_BATCH_SIZE
+        with get_connection() as connection:
+            for start in range(0, len(messages), batch_size):
+                batch = messages[start:start + batch_size]
+                try:
+                    sent += connection.send_messages(batch) or 0
+                except Exception as e:
+                    logger.error("Failed to send digest batch %d: %s", start // batch_size, e)
+                    undelivered.update(message.to[0] for message in batch)
+        return sent, undelivered
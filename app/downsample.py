@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .metrics import Metrics
+
+
+def point_budget(width=None):
+    """
+    Number of points to send for a line chart. About two points per pixel of chart
+    width is the most a line can show; without a width the default budget is used.
+    """
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        return settings.CHART_POINT_BUDGET
+    return max(settings.CHART_MIN_POINTS, min(2 * width, settings.CHART_MAX_POINTS))
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and from every bucket in between the point
+    that forms the largest triangle with the point kept from the previous bucket
+    and the average of the next bucket. This preserves peaks and troughs of the
+    line. Runs in O(n): one pass over the buckets, each handled with array ops.
+
+    Returns the indices of the kept points.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket edges for the n - 2 inner points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    # Average of every bucket, used as the third corner of the triangle
+    counts = np.diff(edges)
+    x_sums = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    y_sums = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    x_avg = np.append(x_sums / counts, x[-1])
+    y_avg = np.append(y_sums / counts, y[-1])
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - x_avg[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (y_avg[i + 1] - y[a])
+        )
+        a = lo + int(area.argmax())
+        kept[i + 1] = a
+
+    return kept
+
+
+@Metrics.span('downsample')
+def downsample_series(series, budget):
+    """
+    Downsamples a Series with a DatetimeIndex to at most `budget` points with LTTB.
+    Series within the budget are returned as they are.
+    """
+    if len(series) <= budget:
+        return series
+
+    x = series.index.values.astype('datetime64[s]').astype(np.int64)
+    y = series.to_numpy(dtype=np.float64)
+    return series.iloc[lttb(x, y, budget)]
+
+
+@Metrics.span('downsample')
+def downsample_frame(df, x, y, budget):
+    """
+    Downsamples the rows of a DataFrame with LTTB on its `x` (dates) and `y` columns.
+    """
+    if len(df) <= budget:
+        return df
+
+    dates = pd.to_datetime(df[x], errors='coerce')
+    if dates.isna().any():
+        return df
+
+    keep = lttb(dates.values.astype('datetime64[s]').astype(np.int64), df[y].to_numpy(dtype=np.float64), budget)
+    return df.iloc[keep]
@@ -0,0 +1,160 @@
+import tempfile
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from . import streaming
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Export formats: content type, file extension and whether the file is downloaded
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv', True),
+    'tsv': ('text/tab-separated-values; charset=utf-8', 'tsv', False),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', True),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True),
+}
+
+
+def available(fmt):
+    """
+    Whether an export format can be written here. XLSX needs openpyxl and
+    Parquet needs pyarrow, both optional.
+    """
+    if fmt == 'xlsx':
+        return openpyxl is not None
+    if fmt == 'parquet':
+        return pa is not None
+    return fmt in FORMATS
+
+
+def chunked(df):
+    """
+    Splits a DataFrame into pieces of EXPORT_CHUNK_ROWS rows.
+    """
+    size = settings.EXPORT_CHUNK_ROWS
+    for start in range(0, len(df), size):
+        yield df.iloc[start:start + size]
+
+
+def export_response(request, chunks, fmt, filename):
+    """
+    StreamingHttpResponse writing the DataFrames produced by `chunks` one after
+    another in the given format. The chunks must all have the same columns. Only
+    one chunk plus the writer's buffer is held in memory at a time, so exports of
+    long multi-ticker histories do not build the whole file first. Each piece is
+    sent as it is written, under WSGI as well as ASGI (see streaming.content).
+
+    TSV is served inline for the "copy to Excel" button, the other formats as
+    attachments.
+    """
+    content_type, extension, attachment = FORMATS[fmt]
+    writer = {'csv': _csv, 'tsv': _tsv, 'xlsx': _xlsx, 'parquet': _parquet}[fmt]
+
+    response = StreamingHttpResponse(streaming.content(request, writer(chunks)), content_type=content_type)
+    disposition = 'attachment' if attachment else 'inline'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}.{extension}"'
+    return response
+
+
+def _csv(chunks, sep=','):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header, sep=sep, date_format='%Y-%m-%d')
+        header = False
+
+
+def _tsv(chunks):
+    return _csv(chunks, sep='\t')
+
+
+def _xlsx(chunks):
+    # Write-only workbooks keep the rows in a temporary file instead of in memory,
+    # but an xlsx file is a zip archive that can only be read back once it is closed
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    header = True
+
+    for chunk in chunks:
+        if header:
+            sheet.append([str(c) for c in chunk.columns])
+            header = False
+        for row in chunk.itertuples(index=False):
+            sheet.append([_cell(v) for v in row])
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            block = f.read(settings.EXPORT_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def _cell(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class _Sink():
+    # File-like object collecting what the Parquet writer writes until it is taken
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _parquet(chunks):
+    # Every chunk becomes one row group, which is sent as soon as it is written
+    sink = _Sink()
+    writer = None
+
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+
+    if writer is not None:
+        writer.close()
+    yield sink.take()
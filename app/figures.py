@@ -0,0 +1,87 @@
+import re
+import json
+import base64
+import hashlib
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs_version
+
+from .metrics import Metrics
+
+
+PLOTLY_JS_URL = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+DEFAULT_CONFIG = {
+    'displaylogo': False,
+    'modeBarButtonsToAdd': ['downloadImage']
+}
+
+_ARRAY_KEYS = ('x', 'y', 'open', 'high', 'low', 'close', 'values')
+_ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T')
+
+
+def pack_array(values):
+    """
+    Packs a numeric array as a plotly.js typed array: float64 bytes in base64.
+    """
+    values = np.ascontiguousarray(values, dtype='<f8')
+    return {'dtype': 'f8', 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+@Metrics.span('figure')
+def figure_payload(fig, config=None, include_layout=True):
+    """
+    Compact JSON-ready form of a Plotly figure for the client to render with
+    Plotly.react instead of shipping the to_html() output.
+
+    Numeric trace arrays are packed as base64 typed arrays and ISO datetime
+    arrays as epoch milliseconds on a date axis, which is several times smaller
+    than the JSON text. The layout and config only need to be sent with the
+    first response for a chart; later responses can leave them out.
+    """
+    figure = fig.to_plotly_json()
+    date_axes = set()
+
+    for trace in figure['data']:
+        for key in _ARRAY_KEYS:
+            values = trace.get(key)
+            if values is None or isinstance(values, (str, dict)):
+                continue
+
+            values = np.asarray(values)
+            if values.dtype.kind in 'US' or values.dtype == object:
+                if len(values) == 0 or not _ISO_DATETIME.match(str(values[0])):
+                    continue
+                values = values.astype('datetime64[ms]').astype(np.float64)
+                date_axes.add(trace.get('xaxis', 'x') if key == 'x' else trace.get('yaxis', 'y'))
+            elif values.dtype.kind == 'M':
+                values = values.astype('datetime64[ms]').astype(np.float64)
+                date_axes.add(trace.get('xaxis', 'x') if key == 'x' else trace.get('yaxis', 'y'))
+            elif values.dtype.kind not in 'biuf':
+                continue
+
+            trace[key] = pack_array(values)
+
+    payload = {'data': figure['data']}
+
+    if include_layout:
+        layout = figure['layout']
+        for axis in date_axes:
+            name = axis[0] + 'axis' + axis[1:]
+            layout.setdefault(name, {})['type'] = 'date'
+        payload['layout'] = layout
+        payload['config'] = config or DEFAULT_CONFIG
+
+    # Round trip through Plotly's encoder so the payload holds plain Python types
+    # that JsonResponse and the json_script template filter can serialize.
+    return json.loads(to_json_plotly(payload))
+
+
+def series_etag(*parts):
+    """
+    Strong ETag from the parts that decide a chart's content, e.g. ticker, period
+    and the date and value of the last bar.
+    """
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'"{digest}"'
@@ -0,0 +1,115 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+BASE_URL = "https://www.imf.org/external/datamapper/api/v1"
+
+
+class IMFDataMapper():
+    """
+    Client for the IMF DataMapper API.
+
+    All requests go through one requests.Session per process, so connections
+    to the IMF are pooled and kept alive, responses are gzip-compressed, and
+    failed requests (connection errors, 429 and 5xx) are retried up to
+    IMF_RETRIES times with exponential backoff.
+    """
+
+    _session = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def session():
+        with IMFDataMapper._lock:
+            if IMFDataMapper._session is None:
+                retry = Retry(
+                    total=settings.IMF_RETRIES,
+                    backoff_factor=settings.IMF_BACKOFF,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=['GET'],
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.IMF_POOL_SIZE, max_retries=retry)
+
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+                IMFDataMapper._session = session
+
+            return IMFDataMapper._session
+
+    @staticmethod
+    def urls(indicator, countries, periods):
+        """
+        URLs fetching one indicator for all countries and periods. The API takes a
+        single indicator per request but any number of countries and periods, so
+        countries are only split to keep every URL under IMF_MAX_URL_LENGTH.
+        """
+        query = f"?periods={','.join(str(p) for p in periods)}" if periods else ''
+        prefix = f"{BASE_URL}/{indicator}/"
+
+        urls = []
+        batch = []
+        for code in countries:
+            if batch and len(prefix) + len(','.join(batch + [code])) + len(query) > settings.IMF_MAX_URL_LENGTH:
+                urls.append(prefix + ','.join(batch) + query)
+                batch = []
+            batch.append(code)
+        if batch:
+            urls.append(prefix + ','.join(batch) + query)
+        return urls
+
+    @staticmethod
+    def fetch(indicators, countries, periods=None):
+        """
+        Fetches indicators x countries x periods. Returns a tidy panel with one row
+        per observation: categorical 'indicator' and 'country' columns, an int16
+        'year' and a float64 'value', and the set of indicators that failed. An
+        indicator with a request that still fails after the retries is left out of
+        the panel entirely rather than returned in part.
+        """
+        session = IMFDataMapper.session()
+        rows_indicator, rows_country, rows_year, rows_value = [], [], [], []
+        failed = set()
+
+        for indicator in indicators:
+            rows = []
+            try:
+                for url in IMFDataMapper.urls(indicator, countries, periods):
+                    with Metrics.upstream('imf'):
+                        response = session.get(url, timeout=settings.IMF_TIMEOUT)
+                        response.raise_for_status()
+
+                    values = (response.json().get('values') or {}).get(indicator) or {}
+                    for country, by_year in values.items():
+                        for year, value in (by_year or {}).items():
+                            rows.append((country, year, value))
+
+            except (requests.RequestException, ValueError) as e:
+                logger.error("Failed to fetch IMF indicator %s: %s", indicator, e)
+                failed.add(indicator)
+                continue
+
+            for country, year, value in rows:
+                rows_indicator.append(indicator)
+                rows_country.append(country)
+                rows_year.append(year)
+                rows_value.append(value)
+
+        panel = pd.DataFrame({
+            'indicator': pd.Categorical(rows_indicator, categories=list(indicators)),
+            'country': pd.Categorical(rows_country),
+            'year': np.array(rows_year, dtype=np.int16),
+            'value': pd.to_numeric(pd.Series(rows_value, dtype=object), errors='coerce').to_numpy(dtype=np.float64),
+        })
+        return panel, failed
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from app.models_finance import FinanceModel
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks aligning and normalizing many tickers for the comparison page "
+        "against a plain pandas outer join."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickers', type=int, default=50)
+        parser.add_argument('--years', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        calendar = pd.bdate_range(end=pd.Timestamp.today(), periods=options['years'] * 252)
+
+        # Tickers list at different dates and miss a few random days each
+        closes = {}
+        for i in range(options['tickers']):
+            start = rng.integers(0, len(calendar) // 3)
+            days = calendar[start:][rng.random(len(calendar) - start) > 0.02]
+            closes[f"T{i}"] = pd.Series(100 + rng.standard_normal(len(days)).cumsum(), index=days)
+
+        vectorized = self._time(lambda: FinanceModel.align_normalized(closes), options['repeat'])
+
+        def outer_join():
+            aligned = pd.concat(closes, axis=1, join='outer', sort=True).ffill()
+            return aligned / aligned.bfill().iloc[0] * 100
+
+        baseline = self._time(outer_join, options['repeat'])
+
+        expected = outer_join()
+        result = FinanceModel.align_normalized(closes)
+        assert np.allclose(expected.to_numpy(), result.to_numpy(), equal_nan=True)
+
+        self.stdout.write(f"{options['tickers']} tickers x {options['years']} years, {len(result)} aligned days")
+        self.stdout.write(f"align_normalized:  {vectorized * 1000:8.2f} ms")
+        self.stdout.write(f"pandas outer join: {baseline * 1000:8.2f} ms")
+
+    def _time(self, func, repeat):
+        func()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat
@@ -0,0 +1,65 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from app.observations import parse_observations
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks parsing Data Commons series payloads into DataFrames against "
+        "the previous per-observation loop. Uses recorded get_stat_series payloads "
+        "(JSON files) if given, otherwise generated annual, monthly and daily ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('payloads', nargs='*', help="JSON files holding {date: value} payloads")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        payloads = {}
+        for path in options['payloads']:
+            with open(path) as f:
+                payloads[path] = json.load(f)
+
+        if not payloads:
+            rng = np.random.default_rng(0)
+            for name, dates in (
+                ('annual 1960-', pd.period_range('1960', pd.Timestamp.today(), freq='Y').strftime('%Y')),
+                ('monthly 1950-', pd.period_range('1950-01', pd.Timestamp.today(), freq='M').strftime('%Y-%m')),
+                ('daily 1990-', pd.date_range('1990-01-01', pd.Timestamp.today()).strftime('%Y-%m-%d')),
+            ):
+                payloads[name] = dict(zip(dates, rng.standard_normal(len(dates)).cumsum().round(4).tolist()))
+
+        for name, payload in payloads.items():
+            vectorized = self._time(lambda: parse_observations(payload), options['repeat'])
+            baseline = self._time(lambda: self._loop(payload), options['repeat'])
+
+            df, rejected = parse_observations(payload)
+            self.stdout.write(f"{name}: {len(payload)} observations, {len(rejected)} unparsable")
+            self.stdout.write(f"  parse_observations: {vectorized * 1000:8.2f} ms")
+            self.stdout.write(f"  per-key loop:       {baseline * 1000:8.2f} ms")
+
+    def _loop(self, series_data):
+        # The parsing loop parse_observations replaced
+        records = []
+        for key, value in series_data.items():
+            try:
+                pd.to_datetime(key)
+                records.append({'date': key, 'value': value})
+            except Exception:
+                if isinstance(value, dict) and 'date' in value and 'value' in value:
+                    records.append({'date': value['date'], 'value': value['value']})
+                elif isinstance(value, (int, float)) and key.isdigit():
+                    records.append({'date': key, 'value': value})
+        return pd.DataFrame(records).sort_values('date')
+
+    def _time(self, func, repeat):
+        func()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat
@@ -0,0 +1,106 @@
+import time
+import asyncio
+import tempfile
+import itertools
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.test import Client, AsyncClient, override_settings
+
+from app import views
+from app.models_finance import FinanceModel
+
+
+async def _fetch_sequential(ticker, start_date, end_date):
+    # The page before the async views: get_market_data, then get_basic_info
+    return (
+        FinanceModel.get_market_data(ticker, start_date, end_date),
+        FinanceModel.get_basic_info(ticker),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the markets_period page with stubbed Alpha Vantage upstreams: "
+        "requests/sec of the WSGI path against the ASGI path with concurrent fan-out."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--wsgi-workers', type=int, default=4)
+        parser.add_argument('--latency', type=float, default=0.5,
+                            help='Simulated latency of each upstream call in seconds')
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+        n_requests = options['requests']
+
+        index = pd.bdate_range(end=pd.Timestamp.today(), periods=2500)
+        bars = pd.DataFrame(
+            np.random.default_rng(0).random((len(index), 5)) * 100,
+            index=index, columns=['Open', 'High', 'Low', 'Close', 'Volume']
+        )
+
+        def fake_daily(ticker, outputsize='full', priority=None):
+            time.sleep(latency)
+            return bars
+
+        def fake_basic_info(ticker, priority=None):
+            time.sleep(latency)
+            return {'symbol': ticker, 'longName': ticker}
+
+        # Unique tickers so that every request misses the bar store and the info cache
+        counter = itertools.count()
+
+        def next_url():
+            return f"/markets_period/BENCH{next(counter)}/1y/"
+
+        original = (FinanceModel._fetch_daily, FinanceModel._fetch_basic_info)
+        FinanceModel._fetch_daily = staticmethod(fake_daily)
+        FinanceModel._fetch_basic_info = staticmethod(fake_basic_info)
+
+        try:
+            with tempfile.TemporaryDirectory() as store_dir, override_settings(
+                BAR_STORE_DIR=store_dir,
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                SESSION_ENGINE='django.contrib.sessions.backends.cache',
+                ALLOWED_HOSTS=['testserver'],
+                ALPHA_VANTAGE_CALLS_PER_MINUTE=10**9,
+                ALPHA_VANTAGE_CALLS_PER_DAY=10**9,
+            ):
+                with mock.patch.object(views, '_fetch_market_page', _fetch_sequential):
+                    sequential = self._bench_wsgi(n_requests, options['wsgi_workers'], next_url)
+                wsgi = self._bench_wsgi(n_requests, options['wsgi_workers'], next_url)
+                asgi = asyncio.run(self._bench_asgi(n_requests, options['concurrency'], next_url))
+        finally:
+            FinanceModel._fetch_daily, FinanceModel._fetch_basic_info = original
+
+        self.stdout.write(f"upstream latency {latency * 1000:.0f} ms per call, {n_requests} requests")
+        self.stdout.write(f"sequential fetches, {options['wsgi_workers']} WSGI workers: {sequential:8.1f} req/s")
+        self.stdout.write(f"concurrent fetches, {options['wsgi_workers']} WSGI workers: {wsgi:8.1f} req/s")
+        self.stdout.write(f"concurrent fetches, ASGI, {options['concurrency']} in flight: {asgi:8.1f} req/s")
+
+    def _bench_wsgi(self, n_requests, workers, next_url):
+        def fetch(_):
+            Client().get(next_url())
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(fetch, range(n_requests)))
+        return n_requests / (time.perf_counter() - started)
+
+    async def _bench_asgi(self, n_requests, concurrency, next_url):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with semaphore:
+                await client.get(next_url())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(n_requests)))
+        return n_requests / (time.perf_counter() - started)
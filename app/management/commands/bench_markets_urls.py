@@ -0,0 +1,117 @@
+import os
+import time
+import inspect
+import tempfile
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import path
+
+from app import views
+from app.models_finance import FinanceModel
+from macroeconomics.urls import urlpatterns as site_urlpatterns
+
+
+_markets_period = inspect.unwrap(views.markets_period)
+
+
+async def _session_period(request, ticker, period):
+    # The period page before the stateless URLs: the chart parameters were written to
+    # the session on every click and the page could not be cached
+    end_date = pd.Timestamp.today().date()
+    start_date, _ = views._period_start(period, end_date)
+    await request.session.aset('ticker', ticker)
+    await request.session.aset('start_date', start_date.strftime('%Y-%m-%d'))
+    await request.session.aset('end_date', end_date.strftime('%Y-%m-%d'))
+    return await _markets_period(request, ticker, period)
+
+
+# URLs of the three flows next to the site's own, used as ROOT_URLCONF while benchmarking
+urlpatterns = [
+    path('session/<str:ticker>/<str:period>/', _session_period),
+    path('stateless/<str:ticker>/<str:period>/', _markets_period),
+    path('cached/<str:ticker>/<str:period>/', views.markets_period),
+] + site_urlpatterns
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the markets period page under concurrency with database sessions "
+        "on SQLite: writing the chart parameters to the session on every view against "
+        "the stateless URLs, without and with the per-URL page cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--tickers', type=int, default=10)
+
+    def handle(self, *args, **options):
+        index = pd.bdate_range(end=pd.Timestamp.today(), periods=2500)
+        bars = pd.DataFrame(
+            np.random.default_rng(0).random((len(index), 5)) * 100,
+            index=index, columns=['Open', 'High', 'Low', 'Close', 'Volume']
+        )
+        tickers = [f"BENCH{i}" for i in range(options['tickers'])]
+        periods = ['1m', 'ytd', '1y', 'all']
+
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(
+            BAR_STORE_DIR=os.path.join(tmp_dir, 'bars'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            SESSION_ENGINE='django.contrib.sessions.backends.db',
+            ALLOWED_HOSTS=['testserver'],
+            ROOT_URLCONF=__name__,
+        ), mock.patch.object(FinanceModel, '_fetch_daily', return_value=bars), \
+                mock.patch.object(FinanceModel, '_fetch_basic_info', side_effect=lambda t, p=None: {'longName': t}):
+
+            # Sessions in a SQLite file, so writes take the database write lock
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+            try:
+                # Fill the bar store and the info cache so only the page itself is timed
+                for ticker in tickers:
+                    FinanceModel.get_market_data(ticker, '2000-01-01', '2100-01-01')
+                    FinanceModel.get_basic_info(ticker)
+
+                results = {}
+                for flow in ('session', 'stateless', 'cached'):
+                    urls = [
+                        f"/{flow}/{tickers[i % len(tickers)]}/{periods[i // len(tickers) % len(periods)]}/"
+                        for i in range(options['requests'])
+                    ]
+                    results[flow] = self._bench(urls, options['concurrency'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} concurrent clients, "
+            f"{len(tickers)} tickers x {len(periods)} periods"
+        )
+        for flow, label in (
+            ('session', 'session writes'),
+            ('stateless', 'stateless URLs'),
+            ('cached', 'stateless URLs, page cache'),
+        ):
+            rate, p95 = results[flow]
+            self.stdout.write(f"{label:<28} {rate:8.1f} req/s   p95 {p95 * 1000:7.1f} ms")
+
+    def _bench(self, urls, concurrency):
+        def fetch(url):
+            client = Client()
+            started = time.perf_counter()
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(fetch, urls))
+        elapsed = time.perf_counter() - started
+
+        return len(urls) / elapsed, float(np.percentile(latencies, 95))
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from app.portfolio import PortfolioAnalytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the portfolio risk and correlation metrics on generated prices "
+        "and checks the correlation and covariance matrices against pandas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=500)
+        parser.add_argument('--years', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        n_days = options['years'] * 252
+        n_assets = options['assets']
+
+        # Correlated random walks through a common market factor; a third of the
+        # assets start trading somewhere in the first half of the window
+        market = rng.standard_normal((n_days, 1)) * 0.01
+        returns = 0.0003 + market * rng.uniform(0.5, 1.5, n_assets) + rng.standard_normal((n_days, n_assets)) * 0.015
+        prices = 100 * np.cumprod(1 + returns, axis=0)
+        late = rng.choice(n_assets, n_assets // 3, replace=False)
+        for column, start in zip(late, rng.integers(1, n_days // 2, len(late))):
+            prices[:start, column] = np.nan
+
+        index = pd.bdate_range(end=pd.Timestamp.today(), periods=n_days)
+        prices = pd.DataFrame(prices, index=index, columns=[f"A{i}" for i in range(n_assets)])
+        weights = rng.random(n_assets)
+
+        elapsed = self._time(lambda: PortfolioAnalytics.metrics(prices, weights), options['repeat'])
+
+        daily = prices.pct_change(fill_method=None).iloc[1:]
+        baseline = self._time(lambda: (daily.corr(), daily.cov()), options['repeat'])
+
+        result = PortfolioAnalytics.metrics(prices, weights)
+        assert np.allclose(result['correlation'].to_numpy(), daily.corr().to_numpy(), atol=1e-8, equal_nan=True)
+        assert np.allclose(result['covariance'].to_numpy() / 252, daily.cov().to_numpy(), atol=1e-10, equal_nan=True)
+
+        self.stdout.write(f"{n_assets} assets x {options['years']} years ({n_days} days)")
+        self.stdout.write(f"all metrics incl. correlation/covariance: {elapsed * 1000:9.1f} ms")
+        self.stdout.write(f"pandas corr() + cov() only:               {baseline * 1000:9.1f} ms")
+        self.stdout.write(f"portfolio: {', '.join(f'{k} {v:.4f}' for k, v in result['portfolio'].items())}")
+
+    def _time(self, func, repeat):
+        func()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat
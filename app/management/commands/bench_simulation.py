@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app import montecarlo
+from app.simulation import MonteCarloSimulator
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the Monte Carlo simulator on generated returns and shows how "
+        "the percentile bands converge chunk by chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=10)
+        parser.add_argument('--horizon', type=int, default=252)
+        parser.add_argument('--paths', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--method', default=montecarlo.BOOTSTRAP, choices=[montecarlo.BOOTSTRAP, montecarlo.NORMAL])
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        n_assets = options['assets']
+
+        # Ten years of correlated daily returns through a common market factor
+        market = rng.standard_normal((2520, 1)) * 0.01
+        returns = 0.0003 + market * rng.uniform(0.5, 1.5, n_assets) + rng.standard_normal((2520, n_assets)) * 0.015
+        weights = rng.random(n_assets)
+
+        # Start the pool outside the timings, as a running server would have it
+        MonteCarloSimulator.pool().submit(int).result()
+
+        self.stdout.write(f"{n_assets} assets, {options['horizon']} days, {settings.SIMULATION_WORKERS} workers, {options['method']}")
+        for paths in options['paths']:
+            started = time.perf_counter()
+            updates = 0
+            for result in MonteCarloSimulator.simulate(returns, weights, options['horizon'], paths, 0, options['method']):
+                updates += 1
+                if updates == 1:
+                    first = time.perf_counter() - started
+            elapsed = time.perf_counter() - started
+
+            final = dict(zip(result['percentiles'], (band[-1] for band in result['bands'])))
+            self.stdout.write(
+                f"{paths:>8} paths: {elapsed * 1000:8.1f} ms, first bands after {first * 1000:7.1f} ms, "
+                f"{updates} updates, last change {result['change'] or 0:.4f}"
+            )
+            self.stdout.write(f"          final value percentiles {', '.join(f'p{q} {v:.3f}' for q, v in final.items())}, "
+                              f"P(loss) {result['loss_probability']:.3f}, mean {result['mean']:.3f}")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from app.availability import AvailabilityIndex
+from app.models import COMMON_INDICATORS, OBSERVATION_PERIODS, DataCommonsDataForm
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the Data Commons availability index: which indicators have data for "
+        "which form countries and frequencies, and their date coverage."
+    )
+
+    def handle(self, *args, **options):
+        countries = [code for code, _ in DataCommonsDataForm.country_choices]
+        stat_vars = list(dict.fromkeys(code for indicators in COMMON_INDICATORS.values() for code, _ in indicators))
+
+        index = AvailabilityIndex.build(countries, stat_vars, OBSERVATION_PERIODS)
+        AvailabilityIndex.save(index)
+
+        bitmap = index['bitmap']
+        self.stdout.write(
+            f"{len(countries)} countries x {len(stat_vars)} indicators x {len(OBSERVATION_PERIODS)} frequencies, "
+            f"{int(bitmap.sum())} series available"
+        )
+        for c, country in enumerate(countries):
+            self.stdout.write(f"  {country}: {int(bitmap[c].any(axis=1).sum())} of {len(stat_vars)} indicators")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.news import NewsIndex
+from app.quota import QuotaExceeded
+
+
+class Command(BaseCommand):
+    help = "Fetches the news published since the last run into the local news index. Meant to run from cron."
+
+    def handle(self, *args, **options):
+        try:
+            count = NewsIndex.ingest()
+        except QuotaExceeded as e:
+            raise CommandError(f"News ingestion stopped, the index is kept: {e}")
+        self.stdout.write(f"News index updated: {count} new articles")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models_gd import GDIMF
+
+
+class Command(BaseCommand):
+    help = "Fetches the IMF data of the General Data page and swaps in a new snapshot. Meant to run from cron."
+
+    def handle(self, *args, **options):
+        if not GDIMF.refresh():
+            raise CommandError("IMF refresh failed, the previous snapshot is kept")
+        self.stdout.write(f"IMF snapshot refreshed: {len(GDIMF.snapshot()['tables'])} tables")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.digests import DigestEngine
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks every watched series for new observations and e-mails each watchlist "
+        "owner a digest. Each series is fetched once, however many users watch it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Detect new data and move the watermarks without sending")
+
+    def handle(self, *args, **options):
+        result = DigestEngine.run(send=not options['dry_run'])
+        self.stdout.write(
+            f"{result['entries']} watchlist entries, {result['series']} unique series "
+            f"({result['failed']} failed), {result['digests']} digests, {result['sent']} sent, "
+            f"{result['held']} series held back for unsent digests"
+        )
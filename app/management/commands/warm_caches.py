@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.models import DataCommonsData
+from app.models_finance import FinanceModel
+from app.popularity import Popularity
+from app.quota import AlphaVantageScheduler
+from app.singleflight import stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Warms the caches of the most requested tickers and Data Commons series before "
+        "they expire. Alpha Vantage calls use background priority, so they never take "
+        "the quota reserved for users. Runs once, or every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.WARM_TOP_N, help="Number of tickers and of series to warm")
+        parser.add_argument('--ahead', type=int, default=settings.WARM_AHEAD, help="Warm entries expiring within this many seconds")
+        parser.add_argument('--workers', type=int, default=settings.WARM_WORKERS)
+        parser.add_argument('--interval', type=int, default=0, help="Seconds between rounds, 0 runs one round")
+        parser.add_argument('--status', action='store_true', help="Only print the status")
+
+    def handle(self, *args, **options):
+        while True:
+            Popularity.flush()
+
+            if not options['status']:
+                self._warm(options)
+                Popularity.decay(settings.WARM_DECAY)
+
+            self._print_status(options['top'])
+
+            if not options['interval'] or options['status']:
+                break
+            time.sleep(options['interval'])
+
+    def _warm(self, options):
+        tickers = Popularity.top('ticker', options['top'])
+        series = Popularity.top('dc', options['top'])
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            jobs = [
+                (f"ticker {key[0]}", pool.submit(self._warm_ticker, key[0], options['ahead']))
+                for key, _ in tickers
+            ] + [
+                (f"series {' '.join(key)}", pool.submit(DataCommonsData.warm, *key, ahead=options['ahead']))
+                for key, _ in series
+            ]
+
+            results = {'fresh': 0, 'warmed': 0, 'failed': 0, 'skipped': 0}
+            for name, job in jobs:
+                try:
+                    result = job.result()
+                except Exception as e:
+                    self.stderr.write(f"{name}: {e}")
+                    result = False
+
+                state = {None: 'fresh', True: 'warmed', False: 'failed', 'skipped': 'skipped'}[result]
+                results[state] += 1
+                if state != 'fresh':
+                    self.stdout.write(f"  {name}: {state}")
+
+        self.stdout.write(
+            f"Round done in {time.monotonic() - started:.1f}s: "
+            + ', '.join(f"{count} {state}" for state, count in results.items())
+        )
+
+    def _warm_ticker(self, ticker, ahead):
+        # Leave the rest of the day's Alpha Vantage calls to users
+        quota = AlphaVantageScheduler.status()
+        if quota['day_used'] >= quota['calls_per_day'] - settings.ALPHA_VANTAGE_INTERACTIVE_DAILY_RESERVE:
+            return 'skipped'
+        return FinanceModel.warm(ticker, ahead)
+
+    def _print_status(self, top):
+        self.stdout.write("Cache hit rates:")
+        for kind, rate in Popularity.hit_rates().items():
+            percent = '-' if rate['rate'] is None else f"{rate['rate']:.1%}"
+            self.stdout.write(f"  {kind:<14} {percent:>7}  ({rate['hits']} hits, {rate['misses']} misses)")
+
+        self.stdout.write("Warm set:")
+        for kind in ('ticker', 'dc'):
+            for key, count in Popularity.top(kind, top):
+                self.stdout.write(f"  {kind:<6} {' '.join(key):<50} {count:8.1f}")
+
+        quota = AlphaVantageScheduler.status()
+        self.stdout.write(
+            f"Alpha Vantage quota: {quota['day_used']}/{quota['calls_per_day']} calls today, "
+            f"{quota['tokens']}/{quota['calls_per_minute']} tokens in the bucket"
+        )
+        self.stdout.write(f"Single-flight in this run: {stats()}")
@@ -0,0 +1,229 @@
+import math
+import time
+import random
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import singleflight
+from .singleflight import acquire_lock, release_lock
+from .popularity import Popularity
+
+logger = logging.getLogger(__name__)
+
+
+_OBSERVATIONS_KEY = 'metrics_observations'
+_LOCK_KEY = 'metrics_lock'
+
+# Histograms: Prometheus name and help text
+HISTOGRAMS = {
+    'request': ('macronomics_request_seconds', 'Time to the response per view.'),
+    'span': ('macronomics_span_seconds', 'Time spent per stage of a request (fetch, parse, reshape, figure, render, ...).'),
+    'upstream': ('macronomics_upstream_seconds', 'Latency of upstream calls per provider and outcome.'),
+}
+
+# Spans of the request being handled, for its Server-Timing header
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class Metrics():
+    """
+    Latency histograms of requests, request stages and upstream calls, shared by
+    every worker.
+
+    Observations are counted per histogram bucket in memory and merged into the
+    default cache at most every METRICS_FLUSH_INTERVAL seconds, like the
+    Popularity counters, so timing a block costs no I/O on most requests. The
+    coalescing counters of single_flight are merged at the same time. Flushes
+    due while recording run in a background thread.
+    exposition() renders everything in the Prometheus text format together with
+    the cache hit and miss counters of Popularity.
+    """
+
+    _observations = Counter()
+    _flushed = time.monotonic()
+    _flushing = False
+    _singleflight_seen = Counter()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def observe(histogram, seconds, **labels):
+        bucket = bisect_left(settings.METRICS_BUCKETS, seconds)
+        labels = tuple(sorted(labels.items()))
+        with Metrics._lock:
+            Metrics._observations[(histogram, labels, bucket)] += 1
+            Metrics._observations[(histogram, labels, 'sum')] += seconds
+        if time.monotonic() - Metrics._flushed >= settings.METRICS_FLUSH_INTERVAL:
+            Metrics._flush_in_background()
+
+    @staticmethod
+    def _flush_in_background():
+        # A flush takes the shared lock and reads and writes the cache, which must
+        # not happen on the event loop an async view observes from
+        with Metrics._lock:
+            if Metrics._flushing:
+                return
+            Metrics._flushing = True
+            Metrics._flushed = time.monotonic()
+        threading.Thread(target=Metrics._background_flush, name='metrics-flush', daemon=True).start()
+
+    @staticmethod
+    def _background_flush():
+        try:
+            Metrics.flush()
+        except Exception as e:
+            logger.error("Failed to flush metrics: %s", e)
+        finally:
+            Metrics._flushing = False
+
+    @staticmethod
+    @contextmanager
+    def span(name):
+        """
+        Times a stage of a request, e.g. `with Metrics.span('figure'):`, or every
+        call of a function when used as a decorator.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            Metrics._finish_span(name, time.perf_counter() - started)
+
+    @staticmethod
+    @contextmanager
+    def upstream(provider):
+        """
+        Times a call to an upstream provider; calls that raise count as errors.
+        """
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            elapsed = time.perf_counter() - started
+            Metrics.observe('upstream', elapsed, provider=provider, outcome=outcome)
+            Metrics._add_request_span(f"upstream.{provider}", elapsed)
+
+    @staticmethod
+    def _finish_span(name, elapsed):
+        Metrics.observe('span', elapsed, span=name)
+        Metrics._add_request_span(name, elapsed)
+
+    @staticmethod
+    def _add_request_span(name, elapsed):
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+    @staticmethod
+    def start_request():
+        """
+        Starts collecting the spans of a request. Returns the list they are added
+        to and the token for finish_request(). Work handed to other threads with
+        sync_to_async runs in a copy of the context and adds to the same list.
+        """
+        spans = []
+        return spans, _request_spans.set(spans)
+
+    @staticmethod
+    def finish_request(token, view, elapsed):
+        _request_spans.reset(token)
+        Metrics.observe('request', elapsed, view=view)
+
+    @staticmethod
+    def flush():
+        """
+        Merges the observations of this process into the shared ones. If the
+        shared ones are locked the local ones are kept for the next flush.
+        """
+        lock = acquire_lock(_LOCK_KEY, timeout=5)
+        if lock is None:
+            return False
+
+        try:
+            coalescing = Counter(singleflight.stats())
+            with Metrics._lock:
+                observations, Metrics._observations = Metrics._observations, Counter()
+                Metrics._flushed = time.monotonic()
+                for event, count in (coalescing - Metrics._singleflight_seen).items():
+                    observations[('singleflight', (('event', event),), 'total')] += count
+                Metrics._singleflight_seen = coalescing
+
+            if observations:
+                cache.set(_OBSERVATIONS_KEY, Counter(cache.get(_OBSERVATIONS_KEY) or {}) + observations, None)
+            return True
+        finally:
+            release_lock(_LOCK_KEY, lock)
+
+    @staticmethod
+    def exposition(gauges=None):
+        """
+        All shared metrics in the Prometheus text format. `gauges` maps extra gauge
+        names to (help, {labels tuple: value}).
+        """
+        Metrics.flush()
+        Popularity.flush()
+        observations = cache.get(_OBSERVATIONS_KEY) or {}
+        lines = []
+
+        series = defaultdict(dict)
+        for (histogram, labels, part), value in observations.items():
+            series[(histogram, labels)][part] = value
+
+        bounds = list(settings.METRICS_BUCKETS) + [math.inf]
+        for histogram, (name, help_text) in HISTOGRAMS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (kind, labels), parts in sorted(series.items()):
+                if kind != histogram:
+                    continue
+                cumulative = 0
+                for i, bound in enumerate(bounds):
+                    cumulative += parts.get(i, 0)
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {parts.get('sum', 0.0):.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        lines += ["# HELP macronomics_singleflight_total Coalescing outcomes of single_flight calls.",
+                  "# TYPE macronomics_singleflight_total counter"]
+        for (kind, labels), parts in sorted(series.items()):
+            if kind == 'singleflight':
+                lines.append(f"macronomics_singleflight_total{_labels(labels)} {parts['total']}")
+
+        lines += ["# HELP macronomics_cache_lookups_total Cache lookups per key family and result.",
+                  "# TYPE macronomics_cache_lookups_total counter"]
+        for family, rate in Popularity.hit_rates().items():
+            for result, count in (('hit', rate['hits']), ('miss', rate['misses'])):
+                lines.append(f"macronomics_cache_lookups_total{_labels((('family', family), ('result', result)))} {count}")
+
+        for name, (help_text, values) in (gauges or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for labels, value in values.items():
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class SampledFilter(logging.Filter):
+    """
+    Logging filter that lets through every record of WARNING and above and a
+    LOG_SAMPLE_RATE share of the lower ones, so per-request debug and info
+    messages (cache hits, refreshes) do not flood the log under load.
+    """
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < settings.LOG_SAMPLE_RATE
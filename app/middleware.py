@@ -0,0 +1,120 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+
+from .metrics import Metrics
+from .profiling import StackSampler, save_profile
+
+
+class TimingMiddleware():
+    """
+    Times every request into the request histogram of its view and sends the
+    stages it spent its time in as a Server-Timing header, e.g.
+    `Server-Timing: upstream.alpha_vantage;dur=412.3, figure;dur=18.0, render;dur=6.1`,
+    which the browser's network panel shows per request. Works for sync and
+    async views.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        spans, token = Metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            Metrics.finish_request(token, _view_name(request), time.perf_counter() - started)
+        return _add_server_timing(response, spans)
+
+    async def __acall__(self, request):
+        spans, token = Metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            Metrics.finish_request(token, _view_name(request), time.perf_counter() - started)
+        return _add_server_timing(response, spans)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match is not None else 'unmatched'
+
+
+def _add_server_timing(response, spans):
+    totals = {}
+    for name, elapsed in spans:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    if totals:
+        response['Server-Timing'] = ', '.join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
+    return response
+
+
+class ProfilingMiddleware():
+    """
+    Profiles a single request on demand. A staff user adds `X-Profile: 1` or
+    `?profile=1` to a request of one of the PROFILING_VIEWS and the request runs
+    under a StackSampler; the collapsed stacks are saved to PROFILING_DIR and
+    named in the X-Profile header of the response. `?profile=1` also changes
+    the URL, so it gets past the page cache of the cached views.
+
+    Requests without the flag only pay for a header and query string lookup, and
+    the middleware is not loaded at all unless PROFILING_ENABLED is set. Goes
+    after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        view = _profiled_view(request)
+        if view is None or not request.user.is_staff:
+            return self.get_response(request)
+
+        with StackSampler() as sampler:
+            response = self.get_response(request)
+        response['X-Profile'] = save_profile(sampler, view, request.path)
+        return response
+
+    async def __acall__(self, request):
+        view = _profiled_view(request)
+        if view is None or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+
+        with StackSampler() as sampler:
+            response = await self.get_response(request)
+        response['X-Profile'] = await sync_to_async(save_profile, thread_sensitive=False)(sampler, view, request.path)
+        return response
+
+
+def _profiled_view(request):
+    # The url name of a request that asks to be profiled, if its view may be
+    if request.headers.get('X-Profile') != '1' and request.GET.get('profile') != '1':
+        return None
+    try:
+        view = resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+    return view if view in settings.PROFILING_VIEWS else None
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_financemodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeriesWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=200, unique=True)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('checked', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watchlist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254)),
+                ('series', models.CharField(db_index=True, max_length=200)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['email', 'series'],
+                'unique_together': {('email', 'series')},
+            },
+        ),
+    ]
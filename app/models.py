@@ -2,9 +2,31 @@ from django.db import models
 from django import forms
 import pandas as pd
 from datetime import datetime
+import time
+import logging
+import threading
 import requests
 import datacommons as dc
 import datacommons_pandas as dc_pd
+from django.core.cache import cache
+from django.conf import settings
+
+from .singleflight import single_flight
+from .observations import parse_observations
+from .availability import AvailabilityIndex
+from .popularity import Popularity
+from .metrics import Metrics
+from .models_watchlist import Watchlist, SeriesWatermark
+
+logger = logging.getLogger(__name__)
+
+# Data Commons observation period of every frequency offered in DataCommonsDataForm
+OBSERVATION_PERIODS = {
+    'A': 'P1Y',
+    'Q': 'P3M',
+    'M': 'P1M',
+    'D': 'P1D',
+}
 
 class DataCommonsData(models.Model):
     """
@@ -19,155 +41,313 @@ class DataCommonsData(models.Model):
         Parameters:
         - country_code: The country code (e.g., 'USA' for United States)
         - indicator_code: The indicator code (Data Commons Statistical Variable)
-        - start_date: Optional start date filter (int year or datetime)
-        - end_date: Optional end date filter (int year or datetime)
+        - frequency: 'A', 'Q', 'M' or 'D'
         
         Returns:
         - DataFrame with date and value columns
+
+        Series are cached per (place dcid, stat var, observation period) for as long as
+        DATA_COMMONS_TTL gives for the frequency. After that the cached series is still
+        served while it is refreshed in the background (stale-while-revalidate), for up
+        to DATA_COMMONS_STALE_TTL seconds. The place id that returned data is remembered
+        so the fallback lookup is not repeated.
+
+        Indicators of the COMMON_INDICATORS categories for the form countries are
+        sliced from the category panel (see get_category_panel).
         """
+        observation_period = OBSERVATION_PERIODS.get(frequency)
 
-        try:
-            dcid = f"country/{country_code}"
+        panel = DataCommonsData.get_category_panel(INDICATOR_CATEGORY.get(indicator_code), frequency)
+        if panel is not None and (indicator_code, country_code) in panel.columns:
+            series = panel[(indicator_code, country_code)].dropna()
+            if not series.empty:
+                return pd.DataFrame({'date': series.index, 'value': series.to_numpy()})
 
-            observation_period = None
-            if frequency == 'A':
-                observation_period = 'P1Y' 
-            elif frequency == 'Q':
-                observation_period = 'P3M'
-            elif frequency == 'M':
-                observation_period = 'P1M' 
-            elif frequency == 'D':
-                observation_period = 'P1D' 
+        place = cache.get(f"dc_place_{country_code}_{indicator_code}") or f"country/{country_code}"
+        cache_key = f"dc_series_{place}_{indicator_code}_{observation_period}"
 
-            series_data = dc.get_stat_series(dcid, stat_var=indicator_code, observation_period=observation_period)
+        def fetch():
+            return DataCommonsData._fetch_and_cache(country_code, indicator_code, frequency)
 
-            if not series_data:
-                place_id_alt = country_code
-                series_data = dc.get_stat_series(place_id_alt, indicator_code, observation_period=observation_period)
+        return DataCommonsData._serve_cached(cache_key, fetch)
 
-                if series_data is None:
-                    raise ValueError(f"Failed to find indicator {indicator_code} for country {country_code}")
+    @staticmethod
+    def warm(country_code, indicator_code, frequency, ahead=0):
+        """
+        Refreshes the cached panel or series behind a request if it is missing or
+        stops being fresh within `ahead` seconds. Returns True if data was fetched,
+        False if the fetch returned nothing and None if the cache was still fresh.
+        """
+        observation_period = OBSERVATION_PERIODS.get(frequency)
+        category = INDICATOR_CATEGORY.get(indicator_code)
+        countries = dict(DataCommonsDataForm.country_choices)
+
+        if category is not None and country_code in countries and observation_period is not None:
+            cache_key = f"dc_panel_{category}_{observation_period}"
+            fetch = lambda: DataCommonsData._fetch_and_cache_panel(category, frequency)
+        else:
+            place = cache.get(f"dc_place_{country_code}_{indicator_code}") or f"country/{country_code}"
+            cache_key = f"dc_series_{place}_{indicator_code}_{observation_period}"
+            fetch = lambda: DataCommonsData._fetch_and_cache(country_code, indicator_code, frequency)
 
-            if isinstance(series_data, list):
-                print("Creating df from a list")
-                df = pd.DataFrame(series_data)
-                df = df.sort_values('date')
-                return df
+        entry = cache.get(cache_key)
+        if entry is not None and entry['fresh_until'] - time.time() > ahead:
+            return None
 
-            elif isinstance(series_data, dict):
-                print("Creating df from a dict")
-                records = []
+        data = single_flight(cache_key, fetch)
+        return data is not None and not data.empty
 
-                for key, value in series_data.items():
-                    try:
-                        pd.to_datetime(key)
-                        records.append({'date': key, 'value': value})
+    @staticmethod
+    def _serve_cached(cache_key, fetch):
+        """
+        Serves a {'data', 'fresh_until'} cache entry, refreshing it in the background
+        once it is stale. On a miss the fetch runs through single_flight.
+        """
+        entry = cache.get(cache_key)
+        Popularity.lookup('data_commons', entry is not None and time.time() <= entry['fresh_until'])
+        if entry is not None:
+            if time.time() > entry['fresh_until'] and cache.add(f"dc_refreshing_{cache_key}", 1, 300):
+                logger.info("Refreshing stale Data Commons data %s", cache_key)
+                threading.Thread(target=single_flight, args=(cache_key, fetch), daemon=True).start()
+            return entry['data']
 
-                    except:
-                        if isinstance(value, dict) and 'date' in value and 'value' in value:
-                            records.append({'date': value['date'], 'value': value['value']})
-                        elif isinstance(value, (int, float)) and key.isdigit():
-                            records.append({'date': key, 'value': value})
+        return single_flight(cache_key, fetch)
 
-                        else:
-                            print('random format from response')
+    @staticmethod
+    def get_category_panel(category, frequency):
+        """
+        Wide table with every indicator of a category for every country offered in
+        DataCommonsDataForm, indexed by date with (indicator code, country code)
+        columns. Returns None for an unknown category.
 
-                df = pd.DataFrame(records)
-                df = df.sort_values('date')
-                return df
+        The panel is fetched with a few bulk get_stat_all calls instead of one call
+        per series and cached like a single series, so the individual series are
+        slices of it. A failed fetch is cached as an empty panel for
+        DATA_COMMONS_PANEL_RETRY seconds.
+        """
+        if category not in COMMON_INDICATORS or frequency not in OBSERVATION_PERIODS:
+            return None
 
+        cache_key = f"dc_panel_{category}_{OBSERVATION_PERIODS[frequency]}"
+
+        def fetch():
+            return DataCommonsData._fetch_and_cache_panel(category, frequency)
+
+        return DataCommonsData._serve_cached(cache_key, fetch)
+
+    @staticmethod
+    def _fetch_and_cache_panel(category, frequency):
+
+        observation_period = OBSERVATION_PERIODS[frequency]
+        cache_key = f"dc_panel_{category}_{observation_period}"
+        panel = DataCommonsData._fetch_panel(category, observation_period)
+
+        if not panel.empty:
+            ttl = settings.DATA_COMMONS_TTL.get(frequency, settings.DATA_COMMONS_TTL['A'])
+            cache.set(cache_key, {'data': panel, 'fresh_until': time.time() + ttl}, ttl + settings.DATA_COMMONS_STALE_TTL)
+            cache.delete(f"dc_refreshing_{cache_key}")
+        else:
+            # Remember the failure for a while so requests go straight to the
+            # per-series fetch, unless a stale panel can still be served
+            entry = cache.get(cache_key)
+            if entry is None or entry['data'].empty:
+                retry = settings.DATA_COMMONS_PANEL_RETRY
+                cache.set(cache_key, {'data': panel, 'fresh_until': time.time() + retry}, retry)
+
+        return panel
+
+    @staticmethod
+    def _fetch_panel(category, observation_period):
+        """
+        Fetches all indicators of a category for all form countries, in batches of
+        DATA_COMMONS_BULK_BATCH places. Of the source series of a place and indicator,
+        the first one with the requested observation period is used.
+        """
+        stat_vars = [code for code, _ in COMMON_INDICATORS[category]]
+        countries = [code for code, _ in DataCommonsDataForm.country_choices]
+        batch = settings.DATA_COMMONS_BULK_BATCH
+        columns = {}
+
+        try:
+            for i in range(0, len(countries), batch):
+                places = [f"country/{code}" for code in countries[i:i + batch]]
+                with Metrics.upstream('data_commons'):
+                    result = dc.get_stat_all(places, stat_vars)
+
+                for place, by_stat_var in result.items():
+                    for stat_var, stat in (by_stat_var or {}).items():
+                        for source in (stat or {}).get('sourceSeries', []):
+                            if source.get('observationPeriod') == observation_period and source.get('val'):
+                                with Metrics.span('parse'):
+                                    df, rejected = parse_observations(source['val'])
+                                if rejected:
+                                    logger.warning("Skipped %d unparsable observations of %s for %s: %s", len(rejected), stat_var, place, rejected[:5])
+                                columns[(stat_var, place.split('/', 1)[-1])] = df.set_index('date')['value']
+                                break
 
         except Exception as e:
-            print(f"Failed to fetch data from Data Commons: {e}")
+            logger.error("Failed to fetch Data Commons panel %s: %s", category, e)
+            return pd.DataFrame()
+
+        if not columns:
             return pd.DataFrame()
 
-def get_indicators(country_code, category=''):
+        with Metrics.span('reshape'):
+            panel = pd.DataFrame(columns).sort_index()
+            panel.columns = pd.MultiIndex.from_tuples(panel.columns, names=['indicator', 'country'])
+            panel.index.name = 'date'
+        return panel
+
+    @staticmethod
+    def _fetch_and_cache(country_code, indicator_code, frequency):
+
+        observation_period = OBSERVATION_PERIODS.get(frequency)
+        df, place = DataCommonsData._fetch_data_commons_data(country_code, indicator_code, observation_period)
+
+        if place is not None and not df.empty:
+            ttl = settings.DATA_COMMONS_TTL.get(frequency, settings.DATA_COMMONS_TTL['A'])
+            cache_key = f"dc_series_{place}_{indicator_code}_{observation_period}"
+
+            cache.set(f"dc_place_{country_code}_{indicator_code}", place, None)
+            cache.set(cache_key, {'data': df, 'fresh_until': time.time() + ttl}, ttl + settings.DATA_COMMONS_STALE_TTL)
+            cache.delete(f"dc_refreshing_{cache_key}")
+
+        return df
+
+    @staticmethod
+    def _fetch_data_commons_data(country_code, indicator_code, observation_period):
+        """
+        Fetches a series, trying the remembered place id first. Returns the DataFrame
+        and the place id that returned data (None if no place did).
+        """
+        places = [f"country/{country_code}", country_code]
+        remembered = cache.get(f"dc_place_{country_code}_{indicator_code}")
+        if remembered in places:
+            places.remove(remembered)
+            places.insert(0, remembered)
+
+        try:
+            series_data = None
+            place = None
+
+            for place in places:
+                with Metrics.upstream('data_commons'):
+                    series_data = dc.get_stat_series(place, indicator_code, observation_period=observation_period)
+                if series_data:
+                    break
+
+            if not series_data:
+                raise ValueError(f"Failed to find indicator {indicator_code} for country {country_code}")
+
+            with Metrics.span('parse'):
+                df, rejected = parse_observations(series_data)
+            if rejected:
+                logger.warning("Skipped %d unparsable observations of %s for %s: %s", len(rejected), indicator_code, place, rejected[:5])
+
+            if not df.empty:
+                return df, place
+
+            return pd.DataFrame(), None
+
+        except Exception as e:
+            logger.error("Failed to fetch data from Data Commons: %s", e)
+            return pd.DataFrame(), None
+
+# Data Commons statistical variables offered per indicator category
+COMMON_INDICATORS = {
+    'EconomicActivity': [
+        ('Amount_EconomicActivity_GrossDomesticProduction_Nominal', 'GDP (Nominal)'),
+        ('GrowthRate_Amount_EconomicActivity_GrossDomesticProduction', 'GDP Growth Rate'),
+        ('Amount_EconomicActivity_GrossDomesticProduction_Nominal_PerCapita', 'Nominal GDP Per Capita'),
+        #('sdg/FP_CPI_TOTL_ZG', 'Annual Inflation Rate (CPI)'),
+        #('InflationAdjustedGDP', 'Inflation Adjusted Gross Domestic Production'),
+        #('sdg/NE_EXP_GNFS_KD_ZG', 'Annual growth of exports of goods and services'),
+        #('sdg/NE_IMP_GNFS_KD_ZG', 'Annual growth of imports of goods and services'),
+        ('Amount_EconomicActivity_GrossNationalIncome_PurchasingPowerParity', 'Gross National Income Based on Purchasing Power Parity'),
+        #('sdg/GC_BAL_CASH_GD_ZS', 'Cash surplus/deficit as a proportion of GDP')
+    ], 
+    'Population': [
+        ('Count_Person', 'Total Population'),
+        ('Count_Person_Rural', 'Rural Population'),
+        ('Count_Person_Urban', 'Urban Population'),
+        ('GrowthRate_Count_Person', 'Population Growth Rate'),
+        ('LifeExpectancy_Person', 'Life Expectancy'),
+        ('worldBank/SL_UEM_TOTL_NE_ZS', 'Unemployment, total (% of total labor force) (national estimate)')
+    ],
+    'Demographics': [
+        ('Count_Person_Female', 'Female Population'),
+        ('Count_Person_Male', 'Male Population')
+    ]
+}
+
+"""
+IN TEST
+    'Debt': [
+        ('Amount_Debt_Government', 'Government Debt'),
+        ('Amount_Debt_Government_PerCapita', 'Government Debt Per Capita'),
+        ('Percent_Debt_Government_GDP', 'Government Debt to GDP'),
+        ('Amount_Debt_Household', 'Household Debt'),
+        ('Amount_Debt_External', 'External Debt')
+    ],
+    'Employment': [
+        ('UnemploymentRate_Person', 'Unemployment Rate'),
+        ('Count_UnemploymentInsuranceClaim_PercentOfCoveredEmployment', 'Unemployment Insurance Claims'),
+        ('Count_Person_Employed', 'Employed Persons'),
+        ('Count_Person_InLaborForce', 'Labor Force'),
+        ('Count_Job', 'Jobs'),
+        ('GrowthRate_Count_Job', 'Job Growth Rate')
+    ],
+    'Income': [
+        ('Median_Income_Person', 'Median Income'),
+        ('Median_Income_Household', 'Median Household Income'),
+        ('Percent_Person_BelowPovertyLevel', 'Poverty Rate'),
+        ('GiniIndex_EconomicActivity', 'Gini Index'),
+        ('Median_Earnings_Person_WithEarnings', 'Median Earnings')
+    ],
+    'Government': [
+        ('Amount_Government_Revenue', 'Government Revenue'),
+        ('Amount_Government_Expenditure', 'Government Expenditure'),
+        ('Amount_Government_Deficit', 'Government Deficit')
+    ],
+    'Finance': [
+        ('InterestRate_Discount', 'Discount Rate'),
+        ('InterestRate_Market', 'Market Interest Rate'),
+        ('Amount_Currency_Volume', 'Currency Volume'),
+        ('Amount_Stock_Traded', 'Stock Traded Value'),
+        ('MarketCapitalization_Stock', 'Stock Market Capitalization')
+    ],
+    'Trade': [
+        ('Amount_EconomicActivity_ExportValue', 'Exports'),
+        ('Amount_EconomicActivity_ImportValue', 'Imports'),
+        ('Amount_EconomicActivity_GrossExternalDebt', 'Gross External Debt'),
+        ('Amount_EconomicActivity_TradeBalance', 'Trade Balance'),
+        ('Percent_ExportValue_GDP', 'Exports to GDP'),
+        ('Percent_ImportValue_GDP', 'Imports to GDP')
+    ]
+"""
+
+# Category of every indicator in COMMON_INDICATORS
+INDICATOR_CATEGORY = {code: category for category, indicators in COMMON_INDICATORS.items() for code, _ in indicators}
+
+def get_indicators(country_code, category='', frequency=''):
     """
-    Get a list of indicators for user to choose from.
+    Get a list of indicators for user to choose from. Indicators the availability
+    index knows to have no data for the country (at the frequency, if given) are left out.
     """
     try:
-        dcid = f"country/{country_code}"
-        common_indicators = {
-            'EconomicActivity': [
-                ('Amount_EconomicActivity_GrossDomesticProduction_Nominal', 'GDP (Nominal)'),
-                ('GrowthRate_Amount_EconomicActivity_GrossDomesticProduction', 'GDP Growth Rate'),
-                ('Amount_EconomicActivity_GrossDomesticProduction_Nominal_PerCapita', 'Nominal GDP Per Capita'),
-                #('sdg/FP_CPI_TOTL_ZG', 'Annual Inflation Rate (CPI)'),
-                #('InflationAdjustedGDP', 'Inflation Adjusted Gross Domestic Production'),
-                #('sdg/NE_EXP_GNFS_KD_ZG', 'Annual growth of exports of goods and services'),
-                #('sdg/NE_IMP_GNFS_KD_ZG', 'Annual growth of imports of goods and services'),
-                ('Amount_EconomicActivity_GrossNationalIncome_PurchasingPowerParity', 'Gross National Income Based on Purchasing Power Parity'),
-                #('sdg/GC_BAL_CASH_GD_ZS', 'Cash surplus/deficit as a proportion of GDP')
-            ], 
-            'Population': [
-                ('Count_Person', 'Total Population'),
-                ('Count_Person_Rural', 'Rural Population'),
-                ('Count_Person_Urban', 'Urban Population'),
-                ('GrowthRate_Count_Person', 'Population Growth Rate'),
-                ('LifeExpectancy_Person', 'Life Expectancy'),
-                ('worldBank/SL_UEM_TOTL_NE_ZS', 'Unemployment, total (% of total labor force) (national estimate)')
-            ],
-            'Demographics': [
-                ('Count_Person_Female', 'Female Population'),
-                ('Count_Person_Male', 'Male Population')
-            ]
-        }
-        
-        """
-        IN TEST
-            'Debt': [
-                ('Amount_Debt_Government', 'Government Debt'),
-                ('Amount_Debt_Government_PerCapita', 'Government Debt Per Capita'),
-                ('Percent_Debt_Government_GDP', 'Government Debt to GDP'),
-                ('Amount_Debt_Household', 'Household Debt'),
-                ('Amount_Debt_External', 'External Debt')
-            ],
-            'Employment': [
-                ('UnemploymentRate_Person', 'Unemployment Rate'),
-                ('Count_UnemploymentInsuranceClaim_PercentOfCoveredEmployment', 'Unemployment Insurance Claims'),
-                ('Count_Person_Employed', 'Employed Persons'),
-                ('Count_Person_InLaborForce', 'Labor Force'),
-                ('Count_Job', 'Jobs'),
-                ('GrowthRate_Count_Job', 'Job Growth Rate')
-            ],
-            'Income': [
-                ('Median_Income_Person', 'Median Income'),
-                ('Median_Income_Household', 'Median Household Income'),
-                ('Percent_Person_BelowPovertyLevel', 'Poverty Rate'),
-                ('GiniIndex_EconomicActivity', 'Gini Index'),
-                ('Median_Earnings_Person_WithEarnings', 'Median Earnings')
-            ],
-            'Government': [
-                ('Amount_Government_Revenue', 'Government Revenue'),
-                ('Amount_Government_Expenditure', 'Government Expenditure'),
-                ('Amount_Government_Deficit', 'Government Deficit')
-            ],
-            'Finance': [
-                ('InterestRate_Discount', 'Discount Rate'),
-                ('InterestRate_Market', 'Market Interest Rate'),
-                ('Amount_Currency_Volume', 'Currency Volume'),
-                ('Amount_Stock_Traded', 'Stock Traded Value'),
-                ('MarketCapitalization_Stock', 'Stock Market Capitalization')
-            ],
-            'Trade': [
-                ('Amount_EconomicActivity_ExportValue', 'Exports'),
-                ('Amount_EconomicActivity_ImportValue', 'Imports'),
-                ('Amount_EconomicActivity_GrossExternalDebt', 'Gross External Debt'),
-                ('Amount_EconomicActivity_TradeBalance', 'Trade Balance'),
-                ('Percent_ExportValue_GDP', 'Exports to GDP'),
-                ('Percent_ImportValue_GDP', 'Imports to GDP')
-            ]
-        """
         indicators = []
 
-        if category in common_indicators:
-            indicators = common_indicators[category]
+        if category in COMMON_INDICATORS:
+            indicators = [
+                (code, name) for code, name in COMMON_INDICATORS[category]
+                if AvailabilityIndex.available(country_code, code, frequency)
+            ]
         
         return indicators
 
 
     except Exception as e:
-        print(f"Failed to fetch indicators: {e}")
+        logger.error("Failed to fetch indicators: %s", e)
         indicators = []
         return indicators
 
@@ -295,13 +475,13 @@ class DataCommonsDataForm(forms.Form):
                 category = self.data.get('indicator_category')
 
             try:
-                indicator_list =  get_indicators(country_code, category or '')
+                indicator_list =  get_indicators(country_code, category or '', self.data.get('frequency', ''))
                 self.fields['indicator_code'].choices = indicator_list
 
                 self.indicator_choices = dict(indicator_list)
 
             except Exception as e:
-                print(f"Error fetching indicators: {e}")
+                logger.error("Error fetching indicators: %s", e)
                 
         
         # Set indicator name attribute based on selected indicator code
@@ -1,103 +1,244 @@
+import logging
+
 from django.db import models
 from django import forms
 from alpha_vantage.timeseries import TimeSeries
 from alpha_vantage.fundamentaldata import FundamentalData
+import numpy as np
 import pandas as pd
 from django.core.cache import cache
 from django.conf import settings
 
+from .bar_store import BarStore
+from .singleflight import single_flight
+from .quota import AlphaVantageScheduler, INTERACTIVE, BACKGROUND
+from .popularity import Popularity
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
 class FinanceModel(models.Model):
 
     @staticmethod  
-    def get_market_data(ticker, start_date, end_date):
+    def get_market_data(ticker, start_date, end_date, priority=INTERACTIVE):
         """
         Fetches market data for a given ticker symbol between specified start and end dates.
+
+        The full daily history of each ticker is kept in the local BarStore and every
+        date range is sliced from it, so Alpha Vantage is only called for tickers that
+        have not been stored yet or whose history is older than BAR_STORE_TTL.
+        Upstream calls go through the AlphaVantageScheduler with the given priority;
+        when the quota is used up the stored history is served as it is.
         """
-        
-        API_KEY = settings.ALPHA_VANTAGE_API_KEY
 
-        full_cache_key = f"av_market_data_{ticker}"
-        full_data = cache.get(full_cache_key)
+        age = BarStore.age(ticker)
+        Popularity.lookup('bars', age is not None and age <= settings.BAR_STORE_TTL)
 
-        if full_data is not None:
-            print(f"Using cached data for {ticker}")
-            start_date = pd.to_datetime(start_date)
-            end_date = pd.to_datetime(end_date)
-            filtered_data = full_data.loc[start_date:end_date]
-            return filtered_data
-        
-        cache_key = f"av_market_data_{ticker}_{start_date}_{end_date}"
-        cached_data = cache.get(cache_key)
+        if age is None or age > settings.BAR_STORE_TTL:
+            refreshed = single_flight(
+                f"av_market_data_{ticker}",
+                lambda: FinanceModel._refresh_bars(ticker, full=age is None, priority=priority)
+            )
+
+            if not refreshed:
+                if age is None:
+                    return None
+                logger.info("Using stored data for %s", ticker)
 
-        if cached_data is not None:
-            print(f"Using cached data for {ticker} from {start_date} to {end_date}")
-            return cached_data
-                
         try:
-            print(ticker, start_date, end_date)
-            if hasattr(start_date, 'strftime'):
-                start_date = start_date.strftime('%Y-%m-%d')
-            if hasattr(end_date, 'strftime'):
-                end_date = end_date.strftime('%Y-%m-%d')
+            with Metrics.span('bars'):
+                filtered_data = BarStore.slice(ticker, start_date, end_date)
+
+                filtered_data.columns = pd.MultiIndex.from_product(
+                    [filtered_data.columns, [ticker]],
+                    names=['Price', 'Ticker']
+                )
+            return filtered_data
+
+        except Exception as e:
+            logger.error("Error reading stored data for %s: %s", ticker, e)
+            return None
+
+    @staticmethod
+    def warm(ticker, ahead=0):
+        """
+        Refreshes the stored history and company info of a ticker with background
+        priority if they are missing or expire within `ahead` seconds.
+        Returns True if anything was fetched, False if the fetch failed and None
+        if everything was still fresh.
+        """
+        fetched = None
+
+        age = BarStore.age(ticker)
+        if age is None or age > settings.BAR_STORE_TTL - ahead:
+            fetched = single_flight(
+                f"av_market_data_{ticker}",
+                lambda: FinanceModel._refresh_bars(ticker, full=age is None, priority=BACKGROUND)
+            )
 
-            series = TimeSeries(key=API_KEY, output_format='pandas') 
+        cache_key = f"av_basic_info_{ticker}"
+        if cache.get(cache_key) is None:
+            info = single_flight(cache_key, lambda: FinanceModel._fetch_basic_info(ticker, BACKGROUND))
+            fetched = (fetched is not False) and info is not None
 
-            data, meta_data = series.get_daily(symbol=ticker, outputsize='full')
-            print(data)
+        return fetched
 
+    @staticmethod
+    def _refresh_bars(ticker, full=False, priority=INTERACTIVE):
+        """
+        Brings the stored history of a ticker up to date.
 
-            data_start = data.index.min()
-            data_end = data.index.max()
+        Only the compact payload (last ~100 bars) is downloaded and merged into the
+        stored series. A full download is done when nothing is stored yet, when the
+        compact payload does not reach back to the last stored bar (gap), or when the
+        overlapping bars disagree with what is stored (split or correction).
+        Returns True if the stored history was updated.
+        """
+        try:
+            stored = None if full else BarStore.frame(ticker)
 
-            data_columns = data.columns.tolist()
-            print(data_columns)
-            data.columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+            if stored is None or stored.empty:
+                BarStore.write(ticker, FinanceModel._fetch_daily(ticker, 'full', priority))
+                return True
 
-            if not isinstance(data.index, pd.DatetimeIndex):
-                data.index = pd.to_datetime(data.index)
+            recent = FinanceModel._fetch_daily(ticker, 'compact', priority)
 
-            data.index = pd.to_datetime(data.index)
-            start_date = pd.to_datetime(start_date)
-            end_date = pd.to_datetime(end_date)
-            data = data.sort_index()
+            last_stored = stored.index[-1]
+            if recent.empty or recent.index[0] > last_stored:
+                logger.info("Gap in compact data for %s, fetching full history", ticker)
+                BarStore.write(ticker, FinanceModel._fetch_daily(ticker, 'full', priority))
+                return True
 
-            if start_date < data_start:
-                print(f"Warning: Requested start date {start_date} is earlier than available data ({data_start})")
-                start_date = data_start
-                
-            if end_date > data_end:
-                print(f"Warning: Requested end date {end_date} is later than available data ({data_end})")
-                end_date = data_end 
-            filtered_data = data.loc[start_date:end_date]
-
-            filtered_data.columns = pd.MultiIndex.from_product(
-                [filtered_data.columns, [ticker]],
-                names=['Price', 'Ticker']
-            )
+            overlap = recent.index.intersection(stored.index)
+            old_close = stored.loc[overlap, 'Close'].to_numpy()
+            new_close = recent.loc[overlap, 'Close'].to_numpy()
+            if not np.allclose(old_close, new_close, rtol=1e-4):
+                logger.warning("Stored history of %s no longer matches upstream, fetching full history", ticker)
+                BarStore.write(ticker, FinanceModel._fetch_daily(ticker, 'full', priority))
+                return True
 
-            cache.set(cache_key, filtered_data, timeout=86400)
+            BarStore.write(ticker, pd.concat([stored, recent]), changed_since=last_stored)
+            return True
 
-            print(filtered_data)
-            return filtered_data
-          
         except Exception as e:
-            print(f"Error fetching data for {ticker}: {e}")
-            return None
+            logger.error("Error fetching data for %s: %s", ticker, e)
+            return False
 
     @staticmethod
-    def get_basic_info(ticker):
+    def _fetch_daily(ticker, outputsize='full', priority=INTERACTIVE):
+        """
+        Downloads daily bars for a ticker from Alpha Vantage. outputsize='compact'
+        returns the last ~100 bars, 'full' the whole history.
+        """
+        series = TimeSeries(key=settings.ALPHA_VANTAGE_API_KEY, output_format='pandas')
+
+        data, meta_data = AlphaVantageScheduler.call(
+            series.get_daily, symbol=ticker, outputsize=outputsize, priority=priority
+        )
+
+        data.columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+        data.index = pd.to_datetime(data.index)
+        return data.sort_index()
+
+    @staticmethod
+    def get_candles(ticker, start_date, end_date, min_candles=None):
+        """
+        OHLCV candles for a candlestick chart. Uses the coarsest stored level (quarterly,
+        monthly, weekly or daily) that still gives at least `min_candles` candles between
+        the dates, so long ranges render from a few hundred rows.
+
+        Returns:
+        - (DataFrame of Open, High, Low, Close, Volume, level) or (None, None)
+        """
+        if min_candles is None:
+            min_candles = settings.CANDLE_MIN_BARS
+
+        data = FinanceModel.get_market_data(ticker, start_date, end_date)
+        if data is None or data.empty:
+            return None, None
+
+        level = BarStore.pick_level(ticker, start_date, end_date, min_candles)
+        if level == 'D':
+            return data.droplevel('Ticker', axis=1), level
+
+        return BarStore.slice(ticker, start_date, end_date, level), level
+
+    @staticmethod
+    @Metrics.span('reshape')
+    def align_normalized(closes):
+        """
+        Aligns close price series of many tickers on a common trading calendar and
+        normalizes each of them to 100 at its first available bar.
+
+        Parameters:
+        - closes: dict of ticker -> close price Series with a DatetimeIndex
+
+        Returns:
+        - DataFrame indexed by the union of all trading days with one column per ticker.
+          Missing days are forward filled, days before a ticker's first bar are NaN.
+        """
+        tickers = list(closes)
+        days = [closes[t].index.values.astype('datetime64[D]').view(np.int64) for t in tickers]
+        all_days = np.concatenate(days)
+        values = np.concatenate([closes[t].to_numpy(dtype=np.float64) for t in tickers])
+        columns = np.repeat(np.arange(len(tickers)), [len(d) for d in days])
+
+        if len(all_days) == 0:
+            return pd.DataFrame(columns=tickers, dtype=np.float64)
+
+        # Outer join of all calendars in one pass: mark every day that has a bar and
+        # map each bar to its row with a running count, no sorting needed.
+        first_day = all_days.min()
+        present = np.zeros(all_days.max() - first_day + 1, dtype=bool)
+        present[all_days - first_day] = True
+        rows = np.cumsum(present)[all_days - first_day] - 1
+        calendar = np.flatnonzero(present) + first_day
+
+        aligned = np.full((len(calendar), len(tickers)), np.nan)
+        aligned[rows, columns] = values
+
+        # Forward fill: index of the last valid row for every cell
+        valid = ~np.isnan(aligned)
+        last_valid = np.where(valid, np.arange(len(calendar))[:, None], 0)
+        np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+        column_index = np.arange(len(tickers))
+        aligned = aligned[last_valid, column_index]
+
+        base = aligned[valid.argmax(axis=0), column_index]
+        aligned = aligned / base * 100
+
+        index = pd.DatetimeIndex(calendar.astype('datetime64[D]'), name='date')
+        return pd.DataFrame(aligned, index=index, columns=tickers)
+
+    @staticmethod
+    def get_basic_info(ticker, priority=INTERACTIVE):
         
         cache_key = f"av_basic_info_{ticker}"
         cached_info = cache.get(cache_key)
+        Popularity.lookup('basic_info', cached_info is not None)
         if cached_info is not None:
-            print(f"Using cached company info for {ticker}")
+            logger.debug("Using cached company info for %s", ticker)
             return cached_info
 
+        info = single_flight(cache_key, lambda: FinanceModel._fetch_basic_info(ticker, priority))
+
+        if info is None:
+            # Upstream failed or the quota is used up, fall back to the last known info
+            info = cache.get(f"av_basic_info_stale_{ticker}")
+            if info is not None:
+                logger.info("Using stale company info for %s", ticker)
+        return info
+
+    @staticmethod
+    def _fetch_basic_info(ticker, priority=INTERACTIVE):
+
+        cache_key = f"av_basic_info_{ticker}"
+
         try:
             basic_info = FundamentalData(key=settings.ALPHA_VANTAGE_API_KEY, output_format='json')
-            response = basic_info.get_company_overview(ticker)
-            print(response)
-            print(type(response))
+            response = AlphaVantageScheduler.call(
+                basic_info.get_company_overview, ticker, priority=priority
+            )
 
             if isinstance(response, tuple) and len(response) > 0:
                 data = response[0]
@@ -137,8 +278,6 @@ class FinanceModel(models.Model):
                                 if data.get('DividendYield') and data.get('DividendYield') != ''
                                 else 'N/A'
             }
-            print(info['marketCap'])
-            print(type(info['marketCap']))
 
             if info['marketCap'] != 'N/A':
                 if info['marketCap'] >= 10**9:
@@ -148,15 +287,15 @@ class FinanceModel(models.Model):
                 elif info['marketCap'] >= 10**3:
                     info['marketCap'] = f"{info['marketCap'] / 10**3:.2f}K"
             
-            print(info['marketCap'])
-            print(info)
+            logger.debug("Fetched company info for %s", ticker)
             # Cache info for 1 day
             cache.set(cache_key, info, 86400)
+            cache.set(f"av_basic_info_stale_{ticker}", info, None)
             
             return info
         
         except Exception as e:
-            print(f"Error fetching basic info for {ticker}: {e}")
+            logger.error("Error fetching basic info for %s: %s", ticker, e)
             return None
         
         
@@ -1,52 +1,193 @@
-import requests
+import os
+import time
+import pickle
+import logging
+import tempfile
+import threading
+
 import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+
+from .singleflight import single_flight
+from .imf import IMFDataMapper
+
+logger = logging.getLogger(__name__)
+
 
+COUNTRIES = [
+    ('USA', 'United States'),
+    ('CAN', 'Canada'),
+    ('GBR', 'United Kingdom'),
+    ('DEU', 'Germany'),
+    ('FRA', 'France'),
+    ('ITA', 'Italy'),
+    ('ESP', 'Spain'),
+    ('NLD', 'Netherlands'),
+    ('CHE', 'Switzerland'),
+    ('BEL', 'Belgium'),
+    ('AUT', 'Austria'),
+    ('DNK', 'Denmark'),
+    ('NOR', 'Norway'),
+    ('SWE', 'Sweden'),
+    ('FIN', 'Finland'),
+    ('IRL', 'Ireland'),
+    ('AUS', 'Australia'),
+    ('NZL', 'New Zealand'),
+    ('JPN', 'Japan'),
+    ('KOR', 'South Korea'),
+    ('SGP', 'Singapore')
+]
+
+# Tables of the General Data page: IMF indicator, table title and value column
+TABLES = [
+    ('NGDPD', 'GDP', 'GDP (Billions USD)'),
+    ('PCPIPCH', 'Inflation', 'Inflation (%)'),
+    ('GGXWDG_NGDP', 'Government debt', 'Government Debt (% of GDP)'),
+    ('LUR', 'Unemployment', 'Unemployment Rate (%)'),
+]
 
 
 class GDIMF():
+    """
+    IMF tables of the General Data page.
+
+    The page is served from a snapshot holding the sorted tables and their
+    rendered HTML. refresh() fetches the data and atomically replaces the snapshot file
+    (run it from cron with `manage.py refresh_imf`); every process keeps the
+    snapshot in memory until the file changes. If a refresh fails the last good
+    snapshot stays in place.
+    """
+
+    _snapshot = None
+    _lock = threading.Lock()
 
     def __init__():
         pass
 
     @staticmethod
     def popular_countries_data():
+        """
+        Sorted GDP table of the popular countries, or None if no snapshot could be made.
+        """
+        snapshot = GDIMF.snapshot()
+        return None if snapshot is None else snapshot['tables'][0]['table']
+
+    @staticmethod
+    def snapshot():
+        """
+        Current snapshot: a dict with the 'tables' (each with its 'title', sorted
+        'table' and rendered 'html'), the data 'year' and 'fetched_at', the time the
+        data was fetched. Without a snapshot one is made
+        now; a snapshot older than IMF_REFRESH_INTERVAL is served while it is
+        refreshed in the background.
+        """
+        snapshot = GDIMF._load()
+        if snapshot is None:
+            single_flight('imf_popular_countries', GDIMF.refresh)
+            return GDIMF._load()
+
+        if time.time() - snapshot['fetched_at'] > settings.IMF_REFRESH_INTERVAL and cache.add('imf_refreshing', 1, 300):
+            logger.info("Refreshing stale IMF snapshot")
+            threading.Thread(target=single_flight, args=('imf_popular_countries', GDIMF.refresh), daemon=True).start()
+
+        return snapshot
+
+    @staticmethod
+    def _load():
+        path = settings.IMF_SNAPSHOT_PATH
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with GDIMF._lock:
+            if GDIMF._snapshot is not None and GDIMF._snapshot[0] == mtime:
+                return GDIMF._snapshot[1]
+
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            logger.error("Failed to read IMF snapshot: %s", e)
+            return None
 
-        countries = [
-            ('USA', 'United States'),
-            ('CAN', 'Canada'),
-            ('GBR', 'United Kingdom'),
-            ('DEU', 'Germany'),
-            ('FRA', 'France'),
-            ('ITA', 'Italy'),
-            ('ESP', 'Spain'),
-            ('NLD', 'Netherlands'),
-            ('CHE', 'Switzerland'),
-            ('BEL', 'Belgium'),
-            ('AUT', 'Austria'),
-            ('DNK', 'Denmark'),
-            ('NOR', 'Norway'),
-            ('SWE', 'Sweden'),
-            ('FIN', 'Finland'),
-            ('IRL', 'Ireland'),
-            ('AUS', 'Australia'),
-            ('NZL', 'New Zealand'),
-            ('JPN', 'Japan'),
-            ('KOR', 'South Korea'),
-            ('SGP', 'Singapore')
-        ]
-        countries_str = ','.join([country[0] for country in countries])
-        data = {}
-        
-        url = f"https://www.imf.org/external/datamapper/api/v1/NGDPD/{countries_str}?periods=2024"
-        response = requests.get(url)
-        if response.status_code == 200:
-            json_data = response.json()
-            gdp_data = json_data['values']['NGDPD']
-            for code, country in countries:
-                result = gdp_data[code]['2024']
-                data[country] = round(result, 2)
-        else:
-            print(f"Failed to fetch data: {response.status_code}")
-            
-        df = pd.DataFrame(list(data.items()), columns=['Country', 'GDP (Billions USD)'])
-        return df
\ No newline at end of file
+        with GDIMF._lock:
+            GDIMF._snapshot = (mtime, snapshot)
+        return snapshot
+
+    @staticmethod
+    def refresh():
+        """
+        Fetches the IMF data and swaps in a new snapshot. Returns False and keeps
+        the current snapshot if the fetch fails. Tables of indicators that failed
+        keep their values from the current snapshot.
+        """
+        try:
+            panel, failed = GDIMF._fetch_tables_data()
+            if panel is None or panel.empty:
+                return False
+
+            year = settings.IMF_YEAR
+            names = dict(COUNTRIES)
+            current = GDIMF._load()
+            previous = {t['indicator']: t for t in current['tables']} if current is not None and current['year'] == year else {}
+            tables = []
+
+            for indicator, title, column in TABLES:
+                if indicator in failed and indicator in previous:
+                    logger.warning("Keeping the previous IMF table of %s", indicator)
+                    tables.append(previous[indicator])
+                    continue
+
+                values = panel[(panel['indicator'] == indicator) & (panel['year'] == year)].dropna(subset=['value'])
+                table = pd.DataFrame({
+                    'Country': values['country'].astype(str).map(names).to_numpy(),
+                    column: values['value'].round(2).to_numpy(),
+                })
+                table = table.sort_values(by=column, ascending=False)
+
+                table_html = table.to_html(
+                    classes='table table-striped table-hover',
+                    index=False,
+                    border=0, 
+                    justify='center', 
+                    escape=False
+                )
+                tables.append({'indicator': indicator, 'title': title, 'table': table, 'html': table_html})
+
+            GDIMF._save({'tables': tables, 'year': year, 'fetched_at': time.time()})
+            return True
+
+        except Exception as e:
+            logger.error("Failed to refresh IMF data: %s", e)
+            return False
+
+        finally:
+            cache.delete('imf_refreshing')
+
+    @staticmethod
+    def _save(snapshot):
+        path = settings.IMF_SNAPSHOT_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _fetch_tables_data():
+        """
+        Panel with every table indicator for the popular countries, fetched in one
+        batched client call, and the set of indicators that failed.
+        """
+        return IMFDataMapper.fetch(
+            [indicator for indicator, _, _ in TABLES],
+            [code for code, _ in COUNTRIES],
+            [settings.IMF_YEAR],
+        )
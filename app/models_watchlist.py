@@ -0,0 +1,48 @@
+from django.db import models
+
+
+class Watchlist(models.Model):
+    """
+    One series on a user's watchlist. Series are named by a key shared by all
+    users watching them (see series_key), so the digest engine fetches each
+    series once however many users watch it.
+    """
+
+    TICKER = 'ticker'
+    DATA_COMMONS = 'dc'
+    IMF = 'imf'
+
+    email = models.EmailField()
+    series = models.CharField(max_length=200, db_index=True)
+    name = models.CharField(max_length=200, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('email', 'series')
+        ordering = ['email', 'series']
+
+    def __str__(self):
+        return f"{self.email}: {self.name or self.series}"
+
+    @staticmethod
+    def series_key(kind, *parts):
+        """
+        Key of a series, e.g. 'ticker:AAPL', 'dc:USA:Count_Person:A' or 'imf:NGDPD:USA'.
+        """
+        return ':'.join([kind] + [str(p) for p in parts])
+
+
+class SeriesWatermark(models.Model):
+    """
+    Newest observation of a watched series seen by the digest engine. Only
+    observations after it are reported as new.
+    """
+
+    series = models.CharField(max_length=200, unique=True)
+    last_date = models.DateField(null=True, blank=True)
+    last_value = models.FloatField(null=True, blank=True)
+    checked = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.series} @ {self.last_date}"
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+# Monte Carlo kernels of the portfolio simulator (see MonteCarloSimulator). They
+# only depend on NumPy, so process pool workers import them without Django.
+
+BOOTSTRAP = 'bootstrap'
+NORMAL = 'normal'
+
+# Histogram of log wealth (portfolio value relative to the start) per horizon day.
+# Percentiles are read from merged histograms, so the results of the chunks can be
+# combined as they arrive without keeping the paths.
+LOG_MIN = -4.0
+LOG_MAX = 4.0
+BINS = 1600
+
+
+def simulate_chunk(returns, weights, horizon, n_paths, seed, method=BOOTSTRAP):
+    """
+    Simulates `n_paths` buy-and-hold paths of a portfolio for `horizon` days.
+
+    With BOOTSTRAP every simulated day is a randomly drawn historical day of
+    `returns` (days x assets), which keeps the correlation between the assets.
+    With NORMAL the daily returns are drawn from a multivariate normal with the
+    historical mean and covariance.
+
+    Returns the (horizon, BINS) histogram of the log portfolio value of all paths
+    on every day, and the sum of the final values.
+    """
+    rng = np.random.default_rng(seed)
+    n_assets = returns.shape[1]
+
+    if method == NORMAL:
+        mean = returns.mean(axis=0)
+        cov = np.atleast_2d(np.cov(returns, rowvar=False))
+        # Cholesky of the covariance, with a little jitter for singular ones
+        chol = np.linalg.cholesky(cov + np.eye(n_assets) * 1e-12)
+        draws = rng.standard_normal((n_paths, horizon, n_assets)) @ chol.T + mean
+    else:
+        draws = returns[rng.integers(0, len(returns), size=(n_paths, horizon))]
+
+    # Growth of every asset, then the weighted sum of the asset values
+    np.log1p(draws, out=draws)
+    np.cumsum(draws, axis=1, out=draws)
+    np.exp(draws, out=draws)
+    wealth = draws @ weights
+
+    log_wealth = np.log(np.maximum(wealth, 1e-300))
+    bins = np.clip(((log_wealth - LOG_MIN) / (LOG_MAX - LOG_MIN) * BINS).astype(np.int64), 0, BINS - 1)
+
+    # One bincount for all days: offset the bins of day d by d * BINS
+    offsets = bins + np.arange(horizon) * BINS
+    histogram = np.bincount(offsets.ravel(), minlength=horizon * BINS).reshape(horizon, BINS)
+    return histogram, float(wealth[:, -1].sum())
+
+
+def percentiles(histogram, qs):
+    """
+    Percentiles (0-100) of every day of a (days, BINS) histogram, interpolated
+    linearly inside the bin. Returns an array of shape (len(qs), days) of values
+    relative to the start.
+    """
+    counts = histogram.astype(np.float64)
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    width = (LOG_MAX - LOG_MIN) / BINS
+    days = np.arange(len(histogram))
+
+    bands = np.empty((len(qs), len(histogram)))
+    for i, q in enumerate(qs):
+        target = total[:, 0] * q / 100.0
+        index = np.argmax(cumulative >= target[:, None], axis=1)
+        below = np.where(index > 0, cumulative[days, np.maximum(index - 1, 0)], 0.0)
+        inside = counts[days, index]
+        fraction = np.where(inside > 0, (target - below) / np.where(inside > 0, inside, 1), 0.5)
+        bands[i] = np.exp(LOG_MIN + (index + fraction) * width)
+    return bands
+
+
+def loss_probability(histogram):
+    """
+    Share of paths below the starting value on the last day.
+    """
+    last = histogram[-1]
+    break_even = int((0.0 - LOG_MIN) / (LOG_MAX - LOG_MIN) * BINS)
+    return float(last[:break_even].sum() / max(last.sum(), 1))
@@ -0,0 +1,278 @@
+import os
+import re
+import time
+import pickle
+import logging
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from alpha_vantage.alphaintelligence import AlphaIntelligence
+from django.conf import settings
+
+from .models import INDICATOR_CATEGORY
+from .quota import AlphaVantageScheduler, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+# Keywords of the countries of the Data Commons page, matched in the headlines
+# and summaries of the articles
+COUNTRY_KEYWORDS = {
+    'AFG': ['afghanistan', 'afghan'],
+    'ALB': ['albania', 'albanian'],
+    'DZA': ['algeria', 'algerian'],
+    'AGO': ['angola', 'angolan'],
+    'ARG': ['argentina', 'argentine', 'argentinian'],
+    'AUS': ['australia', 'australian', 'rba'],
+    'AUT': ['austria', 'austrian'],
+    'DEU': ['germany', 'german', 'bundesbank'],
+    'USA': ['united states', 'u.s.', 'us economy', 'american', 'federal reserve', 'the fed'],
+    'GBR': ['united kingdom', 'britain', 'british', 'u.k.', 'bank of england'],
+}
+
+# Feed topics and keywords of the Data Commons indicator categories, with
+# overrides for single indicators
+CATEGORY_TERMS = {
+    'EconomicActivity': (
+        ['economy_macro', 'economy_monetary', 'economy_fiscal'],
+        ['gdp', 'economic growth', 'recession', 'inflation', 'cpi', 'gross national income'],
+    ),
+    'Population': (
+        ['economy_macro'],
+        ['population', 'census', 'life expectancy', 'migration'],
+    ),
+    'Demographics': (
+        [],
+        ['population', 'demographic', 'birth rate', 'aging'],
+    ),
+}
+
+INDICATOR_TERMS = {
+    'worldBank/SL_UEM_TOTL_NE_ZS': (
+        ['economy_macro'],
+        ['unemployment', 'jobless', 'labor market', 'labour market', 'payrolls'],
+    ),
+}
+
+KEYWORDS = sorted(
+    {k for keywords in COUNTRY_KEYWORDS.values() for k in keywords}
+    | {k for _, keywords in CATEGORY_TERMS.values() for k in keywords}
+    | {k for _, keywords in INDICATOR_TERMS.values() for k in keywords},
+    key=len, reverse=True,
+)
+
+# One pass over the text finds every keyword; longer keywords are tried first
+_KEYWORD_PATTERN = re.compile(
+    r'(?<![a-z0-9])(' + '|'.join(re.escape(k) for k in KEYWORDS) + r')(?![a-z0-9])'
+)
+
+_TIME_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def topic_term(label):
+    """
+    Index term of a feed topic, e.g. 'Economy - Monetary' -> 'topic:economy_monetary'.
+    """
+    return 'topic:' + re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
+
+
+class NewsIndex():
+    """
+    Local store of the Alpha Vantage NEWS_SENTIMENT feed with an inverted index.
+
+    ingest() fetches the articles published since the newest stored one (run it
+    from cron with `manage.py ingest_news`) and atomically replaces the store
+    file. The store holds the articles newest first and an index from terms to
+    the sorted positions of the articles they occur in:
+
+    - 'ticker:AAPL' for the tickers of the feed's ticker sentiment
+    - 'topic:economy_monetary' for the feed's topics
+    - 'kw:inflation' for the KEYWORDS found in the title and summary
+
+    Every process keeps the store in memory until the file changes, so pages
+    look up their headlines without calling Alpha Vantage.
+    """
+
+    _store = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def headlines(terms, within=None, limit=None):
+        """
+        Newest articles that have any of `terms`. With `within`, articles that also
+        have one of those terms come first, e.g. inflation news about the country
+        of the page before inflation news from anywhere.
+        """
+        limit = limit or settings.NEWS_HEADLINES
+        store = NewsIndex._load()
+        if store is None:
+            return []
+
+        # Positions follow the articles, newest first, so the first set positions
+        # of a mask are the newest matches
+        matches = NewsIndex._mask(store, terms)
+        if within:
+            about = matches & NewsIndex._mask(store, within)
+            positions = np.concatenate([np.flatnonzero(about)[:limit], np.flatnonzero(matches & ~about)[:limit]])
+        else:
+            positions = np.flatnonzero(matches)
+
+        return [store['articles'][i] for i in positions[:limit]]
+
+    @staticmethod
+    def for_ticker(ticker, limit=None):
+        return NewsIndex.headlines([f"ticker:{ticker.upper()}"], limit=limit)
+
+    @staticmethod
+    def for_series(country_code, indicator_code, limit=None):
+        """
+        Headlines for a Data Commons series: articles on the topics and keywords of
+        the indicator (or its category), those about the country first.
+        """
+        topics, keywords = INDICATOR_TERMS.get(indicator_code) or CATEGORY_TERMS.get(INDICATOR_CATEGORY.get(indicator_code), ([], []))
+        terms = [f"topic:{t}" for t in topics] + [f"kw:{k}" for k in keywords]
+        within = [f"kw:{k}" for k in COUNTRY_KEYWORDS.get(country_code, [])]
+        return NewsIndex.headlines(terms, within, limit)
+
+    @staticmethod
+    def _mask(store, terms):
+        # Union of the postings of the terms as a mask over the articles
+        mask = np.zeros(len(store['articles']), dtype=bool)
+        for term in terms:
+            postings = store['index'].get(term)
+            if postings is not None:
+                mask[postings] = True
+        return mask
+
+    @staticmethod
+    def _load():
+        path = settings.NEWS_INDEX_PATH
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with NewsIndex._lock:
+            if NewsIndex._store is not None and NewsIndex._store[0] == mtime:
+                return NewsIndex._store[1]
+
+        try:
+            with open(path, 'rb') as f:
+                store = pickle.load(f)
+        except Exception as e:
+            logger.error("Failed to read news index: %s", e)
+            return None
+
+        with NewsIndex._lock:
+            NewsIndex._store = (mtime, store)
+        return store
+
+    @staticmethod
+    def ingest(priority=BACKGROUND):
+        """
+        Fetches the articles published since the newest stored one, in pages of
+        NEWS_PAGE_SIZE and at most NEWS_MAX_CALLS calls, and swaps in the new store.
+        Without a store the last NEWS_LOOKBACK_HOURS are fetched. Returns the
+        number of new articles.
+        """
+        store = NewsIndex._load()
+        articles = store['articles'] if store is not None else []
+        seen = {a['url'] for a in articles}
+
+        if articles:
+            since = articles[0]['published']
+        else:
+            since = datetime.now(timezone.utc) - timedelta(hours=settings.NEWS_LOOKBACK_HOURS)
+
+        new = []
+        for _ in range(settings.NEWS_MAX_CALLS):
+            feed = NewsIndex._fetch(since, priority)
+            for item in feed:
+                article = NewsIndex._article(item)
+                if article is not None and article['url'] not in seen:
+                    seen.add(article['url'])
+                    new.append(article)
+
+            latest = max(filter(None, map(NewsIndex._published, feed)), default=None)
+            # A short page is the end of the feed; the time filter is by minute,
+            # so a page that does not get past `since` would repeat forever
+            if len(feed) < settings.NEWS_PAGE_SIZE or latest is None or latest <= since:
+                break
+            since = latest
+
+        if not new and store is not None:
+            return 0
+
+        articles = sorted(new + articles, key=lambda a: a['published'], reverse=True)[:settings.NEWS_MAX_ARTICLES]
+        NewsIndex._save({'articles': articles, 'index': NewsIndex.build(articles), 'fetched_at': time.time()})
+        return len(new)
+
+    @staticmethod
+    def build(articles):
+        """
+        Inverted index of a list of articles: term -> sorted int32 array of positions.
+        """
+        postings = defaultdict(list)
+        for position, article in enumerate(articles):
+            for term in article['terms']:
+                postings[term].append(position)
+        return {term: np.array(positions, dtype=np.int32) for term, positions in postings.items()}
+
+    @staticmethod
+    def _fetch(since, priority):
+        client = AlphaIntelligence(key=settings.ALPHA_VANTAGE_API_KEY, output_format='json')
+        feed, _ = AlphaVantageScheduler.call(
+            client.get_news_sentiment,
+            time_from=since.strftime('%Y%m%dT%H%M'), sort='EARLIEST', limit=settings.NEWS_PAGE_SIZE,
+            priority=priority,
+        )
+        # The client turns the feed list into a DataFrame
+        return feed.to_dict('records') if len(feed) else []
+
+    @staticmethod
+    def _published(item):
+        try:
+            return datetime.strptime(item['time_published'], _TIME_FORMAT).replace(tzinfo=timezone.utc)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _article(item):
+        """
+        Stored form of a feed item with its index terms, or None without a title,
+        URL or publish time.
+        """
+        published = NewsIndex._published(item)
+        if published is None or not item.get('title') or not item.get('url'):
+            return None
+
+        text = f"{item['title']} {item.get('summary') or ''}".lower()
+        terms = {f"kw:{k}" for k in _KEYWORD_PATTERN.findall(text)}
+        terms.update(topic_term(t['topic']) for t in item.get('topics') or [] if t.get('topic'))
+        terms.update(f"ticker:{t['ticker'].upper()}" for t in item.get('ticker_sentiment') or [] if t.get('ticker'))
+
+        return {
+            'title': item['title'],
+            'url': item['url'],
+            'source': item.get('source', ''),
+            'published': published,
+            'sentiment': item.get('overall_sentiment_label', ''),
+            'terms': sorted(terms),
+        }
+
+    @staticmethod
+    def _save(store):
+        path = settings.NEWS_INDEX_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(store, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+
+# Date formats used by Data Commons observations, by the length of the date string
+DATE_FORMATS = {
+    4: '%Y',
+    7: '%Y-%m',
+    10: '%Y-%m-%d',
+}
+
+
+def parse_observations(series_data):
+    """
+    Turns a Data Commons series into a DataFrame with a datetime64 'date' and a
+    float64 'value' column, sorted by date.
+
+    `series_data` is either a {date: value} dict as returned by get_stat_series
+    and get_stat_all, or a list of {'date': ..., 'value': ...} records. The date
+    format is worked out once per distinct date length (Data Commons uses YYYY,
+    YYYY-MM and YYYY-MM-DD) and every date and value is converted in one vectorized
+    pass instead of one pd.to_datetime call per observation.
+
+    Returns the DataFrame and the list of (date, value) entries that could not be
+    parsed.
+    """
+    if isinstance(series_data, dict):
+        dates = np.array(list(series_data.keys()), dtype=object)
+        values = np.array(list(series_data.values()), dtype=object)
+    else:
+        records = [r for r in series_data if isinstance(r, dict)]
+        dates = np.array([r.get('date') for r in records], dtype=object)
+        values = np.array([r.get('value') for r in records], dtype=object)
+
+    # Observations nested as {'date': ..., 'value': ...} under some other key
+    nested = np.array([isinstance(v, dict) for v in values], dtype=bool)
+    if nested.any():
+        dates[nested] = [v.get('date') for v in values[nested]]
+        values[nested] = [v.get('value') for v in values[nested]]
+
+    dates = pd.Series(dates, dtype=object).astype(str)
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+
+    lengths = dates.str.len()
+    for length in lengths.unique():
+        if length not in DATE_FORMATS:
+            continue
+        date_format = DATE_FORMATS[length]
+        group = lengths == length
+        parsed[group] = pd.to_datetime(dates[group], format=date_format, errors='coerce')
+
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').astype(np.float64)
+
+    valid = parsed.notna().to_numpy() & numbers.notna().to_numpy()
+    rejected = list(zip(dates[~valid].tolist(), values[~valid].tolist()))
+
+    df = pd.DataFrame({
+        'date': parsed[valid].to_numpy(dtype='datetime64[ns]'),
+        'value': numbers[valid].to_numpy(),
+    })
+    return df.sort_values('date', ignore_index=True), rejected
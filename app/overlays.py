@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+
+from .bar_store import BarStore
+from .popularity import Popularity
+
+
+TRADING_DAYS = 252
+
+# Overlays and their default windows. Moving averages and Bollinger bands are
+# drawn on the price axis, the others on a second axis.
+INDICATORS = {
+    'sma': 50,
+    'ema': 20,
+    'bollinger': 20,
+    'volatility': 21,
+    'rsi': 14,
+    'drawdown': None,
+}
+
+PRICE_SCALE = {'sma', 'ema', 'bollinger'}
+
+
+# Every kernel takes a run of closes, the window and the state left by the
+# previous run (None for the first one), and returns the overlay columns for
+# every close of the run and the state to continue from. So a stored overlay is
+# extended with the new bars only instead of being computed again.
+
+def _with_context(close, state):
+    # Rolling window kernels keep the last closes as state and compute the new
+    # run with them in front
+    if state is None:
+        return close, 0
+    return np.concatenate([state, close]), len(state)
+
+
+def _sma(close, window, state):
+    values, skip = _with_context(close, state)
+    sma = pd.Series(values).rolling(window).mean().to_numpy()
+    return {f"SMA {window}": sma[skip:]}, values[-window:]
+
+
+def _bollinger(close, window, state):
+    values, skip = _with_context(close, state)
+    rolling = pd.Series(values).rolling(window)
+    mean = rolling.mean().to_numpy()
+    std = rolling.std(ddof=0).to_numpy()
+    return {
+        f"Bollinger {window} upper": (mean + 2 * std)[skip:],
+        f"Bollinger {window} middle": mean[skip:],
+        f"Bollinger {window} lower": (mean - 2 * std)[skip:],
+    }, values[-window:]
+
+
+def _volatility(close, window, state):
+    # Annualized standard deviation of the daily log returns
+    values, skip = _with_context(close, state)
+    returns = np.empty(len(values))
+    returns[:1] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = np.log(values[1:] / values[:-1])
+    vol = pd.Series(returns).rolling(window).std().to_numpy() * np.sqrt(TRADING_DAYS)
+    return {f"Volatility {window}": vol[skip:]}, values[-(window + 1):]
+
+
+def _ema(close, window, state):
+    # State: the last average and the number of closes it has seen
+    if len(close) == 0:
+        return {f"EMA {window}": close}, state
+    seen, start = (0, close) if state is None else (state[1], np.concatenate([[state[0]], close]))
+    ema = pd.Series(start).ewm(span=window, adjust=False).mean().to_numpy(copy=True)
+    if state is not None:
+        ema = ema[1:]
+    last = ema[-1]
+    ema[seen + np.arange(1, len(close) + 1) < window] = np.nan
+    return {f"EMA {window}": ema}, (last, seen + len(close))
+
+
+def _rsi(close, window, state):
+    # Wilder's RSI. State: the last close, the average gain and loss and the
+    # number of daily changes they have seen
+    if len(close) == 0:
+        return {f"RSI {window}": close}, state
+    if state is None:
+        state = (None, None, None, 0)
+    previous, gain, loss, seen = state
+
+    values = close if previous is None else np.concatenate([[previous], close])
+    change = np.diff(values)
+    if len(change) == 0:
+        return {f"RSI {window}": np.full(len(close), np.nan)}, (values[-1], gain, loss, seen)
+
+    gains = np.maximum(change, 0.0)
+    losses = np.maximum(-change, 0.0)
+    if gain is not None:
+        gains = np.concatenate([[gain], gains])
+        losses = np.concatenate([[loss], losses])
+    average_gain = pd.Series(gains).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    average_loss = pd.Series(losses).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    if gain is not None:
+        average_gain, average_loss = average_gain[1:], average_loss[1:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rsi = 100 * average_gain / (average_gain + average_loss)
+    rsi[seen + np.arange(1, len(change) + 1) < window] = np.nan
+    if previous is None:
+        # The first close has no change
+        rsi = np.concatenate([[np.nan], rsi])
+
+    return {f"RSI {window}": rsi}, (values[-1], average_gain[-1], average_loss[-1], seen + len(change))
+
+
+def _drawdown(close, window, state):
+    # State: the running peak
+    peak = np.maximum.accumulate(np.concatenate([[-np.inf if state is None else state], close]))[1:]
+    return {'Drawdown': close / peak - 1}, (peak[-1] if len(peak) else state)
+
+
+KERNELS = {
+    'sma': _sma,
+    'ema': _ema,
+    'bollinger': _bollinger,
+    'volatility': _volatility,
+    'rsi': _rsi,
+    'drawdown': _drawdown,
+}
+
+
+class Overlays():
+    """
+    Indicator overlays of the market charts, computed over the daily closes in
+    the BarStore.
+
+    Overlays are kept in the cache per (ticker, indicator, window) together with
+    the state of their kernel. When new bars arrive only they are run through
+    the kernel and appended, so the cost of an overlay is one cache read and a
+    few array operations. The newest bar can still change during the trading
+    day, so it is computed on every request and never stored.
+    """
+
+    @staticmethod
+    def parse(value):
+        """
+        Parses ?overlays=sma:50,ema,rsi:14 into a list of (indicator, window)
+        pairs, with the default window where none is given. Raises ValueError for
+        unknown indicators, bad windows or too many overlays.
+        """
+        specs = []
+        for part in filter(None, (p.strip().lower() for p in value.split(','))):
+            name, _, window = part.partition(':')
+            if name not in INDICATORS:
+                raise ValueError(f"Unknown overlay {name}.")
+            if INDICATORS[name] is None:
+                window = None
+            else:
+                window = int(window) if window else INDICATORS[name]
+                if not 2 <= window <= settings.OVERLAY_MAX_WINDOW:
+                    raise ValueError(f"Overlay windows go from 2 to {settings.OVERLAY_MAX_WINDOW}.")
+            if (name, window) not in specs:
+                specs.append((name, window))
+
+        if len(specs) > settings.OVERLAY_MAX:
+            raise ValueError(f"Please select at most {settings.OVERLAY_MAX} overlays.")
+        return specs
+
+    @staticmethod
+    def compute(ticker, name, window, bars=None):
+        """
+        Columns of an overlay for every stored daily bar of a ticker, as a dict of
+        label to array. Returns None if the ticker has no stored bars.
+        """
+        ticker = BarStore.symbol(ticker)
+        if bars is None:
+            bars = BarStore.load(ticker)
+        if bars is None or bars.shape[1] == 0:
+            return None
+
+        days, close = bars[0], bars[4]
+        settled = len(close) - 1
+        kernel = KERNELS[name]
+
+        cache_key = f"overlay_{ticker}_{name}_{window}"
+        entry = cache.get(cache_key)
+        Popularity.lookup('overlay', entry is not None)
+        if not Overlays._extends(entry, days, close, settled):
+            entry = {'n': 0, 'columns': None, 'state': None}
+
+        if entry['n'] < settled:
+            columns, state = kernel(np.array(close[entry['n']:settled]), window, entry['state'])
+            if entry['columns'] is not None:
+                columns = {label: np.concatenate([entry['columns'][label], values]) for label, values in columns.items()}
+            entry = {
+                'n': settled,
+                'first': days[0],
+                'last': (days[settled - 1], close[settled - 1]),
+                'columns': columns,
+                'state': state,
+            }
+            cache.set(cache_key, entry, settings.OVERLAY_CACHE_TTL)
+
+        latest, _ = kernel(np.array(close[settled:]), window, entry['state'])
+        if entry['columns'] is None:
+            return latest
+        return {label: np.concatenate([entry['columns'][label], values]) for label, values in latest.items()}
+
+    @staticmethod
+    def _extends(entry, days, close, settled):
+        # A stored overlay is only extended if the bars it was computed from are
+        # still the same; a rewritten history starts over
+        if entry is None or not 0 < entry['n'] <= settled:
+            return False
+        n = entry['n']
+        return entry['first'] == days[0] and entry['last'] == (days[n - 1], close[n - 1])
+
+    @staticmethod
+    def frame(ticker, specs, start_date, end_date):
+        """
+        The overlays of `specs` between start_date and end_date as a DataFrame
+        indexed by date, and the set of its columns drawn on the price axis.
+        Returns (None, set()) if the ticker has no stored bars.
+        """
+        ticker = BarStore.symbol(ticker)
+        bars = BarStore.load(ticker)
+        if bars is None or bars.shape[1] == 0:
+            return None, set()
+
+        index = pd.DatetimeIndex(np.datetime64('1970-01-01', 'D') + np.asarray(bars[0]).astype('timedelta64[D]'))
+        lo = index.searchsorted(pd.Timestamp(start_date), side='left')
+        hi = index.searchsorted(pd.Timestamp(end_date), side='right')
+
+        columns = {}
+        price_scale = set()
+        for name, window in specs:
+            overlay = Overlays.compute(ticker, name, window, bars)
+            if overlay is None:
+                continue
+            for label, values in overlay.items():
+                columns[label] = values[lo:hi]
+                if name in PRICE_SCALE:
+                    price_scale.add(label)
+
+        return pd.DataFrame(columns, index=index[lo:hi]), price_scale
@@ -0,0 +1,130 @@
+import time
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .singleflight import acquire_lock, release_lock
+
+logger = logging.getLogger(__name__)
+
+
+_COUNTS_KEY = 'popularity_counts'
+_LOOKUPS_KEY = 'popularity_lookups'
+_LOCK_KEY = 'popularity_lock'
+
+
+class Popularity():
+    """
+    Request popularity and cache hit rates, shared by every worker.
+
+    Views record what is requested, e.g. ('ticker', 'AAPL') or ('dc', 'USA',
+    'Count_Person', 'A'), and the data layer records whether its cache could
+    answer a lookup. Counts are kept in memory and merged into the default cache
+    at most every POPULARITY_FLUSH_INTERVAL seconds in a background thread, so
+    recording never does I/O on the request path, not even on the event loop of
+    an async view. The warm_caches command reads them to pick what to warm.
+    """
+
+    _counts = Counter()
+    _lookups = Counter()
+    _flushed = time.monotonic()
+    _flushing = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def record(kind, *key):
+        with Popularity._lock:
+            Popularity._counts[(kind,) + key] += 1
+        Popularity._maybe_flush()
+
+    @staticmethod
+    def lookup(kind, hit):
+        with Popularity._lock:
+            Popularity._lookups[(kind, 'hit' if hit else 'miss')] += 1
+        Popularity._maybe_flush()
+
+    @staticmethod
+    def _maybe_flush():
+        if time.monotonic() - Popularity._flushed < settings.POPULARITY_FLUSH_INTERVAL:
+            return
+        with Popularity._lock:
+            if Popularity._flushing:
+                return
+            Popularity._flushing = True
+            Popularity._flushed = time.monotonic()
+        threading.Thread(target=Popularity._background_flush, name='popularity-flush', daemon=True).start()
+
+    @staticmethod
+    def _background_flush():
+        try:
+            Popularity.flush()
+        except Exception as e:
+            logger.error("Failed to flush popularity counts: %s", e)
+        finally:
+            Popularity._flushing = False
+
+    @staticmethod
+    def flush():
+        """
+        Merges the counts of this process into the shared ones. If the shared
+        counts are locked the local ones are kept for the next flush.
+        """
+        lock = acquire_lock(_LOCK_KEY, timeout=5)
+        if lock is None:
+            return False
+
+        try:
+            with Popularity._lock:
+                counts, Popularity._counts = Popularity._counts, Counter()
+                lookups, Popularity._lookups = Popularity._lookups, Counter()
+                Popularity._flushed = time.monotonic()
+
+            if counts:
+                cache.set(_COUNTS_KEY, Counter(cache.get(_COUNTS_KEY) or {}) + counts, None)
+            if lookups:
+                cache.set(_LOOKUPS_KEY, Counter(cache.get(_LOOKUPS_KEY) or {}) + lookups, None)
+            return True
+        finally:
+            release_lock(_LOCK_KEY, lock)
+
+    @staticmethod
+    def top(kind, n):
+        """
+        The n most requested keys of a kind with their counts, most popular first.
+        """
+        counts = cache.get(_COUNTS_KEY) or {}
+        ranked = sorted(((key[1:], count) for key, count in counts.items() if key[0] == kind), key=lambda x: -x[1])
+        return ranked[:n]
+
+    @staticmethod
+    def decay(factor):
+        """
+        Scales all shared counts by `factor` and drops the ones that become
+        negligible, so the ranking follows recent traffic.
+        """
+        lock = acquire_lock(_LOCK_KEY, timeout=5)
+        if lock is None:
+            return False
+
+        try:
+            counts = cache.get(_COUNTS_KEY) or {}
+            cache.set(_COUNTS_KEY, Counter({k: c * factor for k, c in counts.items() if c * factor >= 0.1}), None)
+            return True
+        finally:
+            release_lock(_LOCK_KEY, lock)
+
+    @staticmethod
+    def hit_rates():
+        """
+        Cache hits, misses and hit rate per kind of lookup since the counters started.
+        """
+        lookups = cache.get(_LOOKUPS_KEY) or {}
+        rates = {}
+        for kind in sorted({kind for kind, _ in lookups}):
+            hits = lookups.get((kind, 'hit'), 0)
+            misses = lookups.get((kind, 'miss'), 0)
+            rates[kind] = {'hits': hits, 'misses': misses, 'rate': hits / (hits + misses) if hits + misses else None}
+        return rates
@@ -0,0 +1,195 @@
+import hashlib
+import warnings
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+
+from .models_finance import FinanceModel
+from .popularity import Popularity
+
+
+TRADING_DAYS = 252
+
+
+class PortfolioAnalytics():
+    """
+    Risk and correlation metrics of a portfolio built on the daily bars of
+    get_market_data.
+
+    All metrics are computed on the (days x assets) matrix of daily returns with
+    array operations over whole columns, so hundreds of assets cost a few matrix
+    products instead of a Python loop per asset or per pair. Assets that start
+    trading later than others are handled with masks: each correlation uses the
+    days both assets have data for.
+    """
+
+    @staticmethod
+    def analyze(tickers, weights=None, start_date=None, end_date=None, benchmark=None):
+        """
+        Metrics of a portfolio of `tickers` with `weights` (equal weights by
+        default) between start_date and end_date. Beta is measured against the
+        `benchmark` ticker if given, otherwise against the portfolio itself.
+
+        Results are cached per portfolio and window for PORTFOLIO_CACHE_TTL
+        seconds. Returns None if none of the tickers has data.
+        """
+        tickers = [t.upper() for t in tickers]
+        if weights is None:
+            weights = [1.0] * len(tickers)
+
+        key = '|'.join(f"{t}={float(w):g}" for t, w in zip(tickers, weights))
+        digest = hashlib.sha1(f"{key}|{benchmark}|{start_date}|{end_date}".encode()).hexdigest()
+        cache_key = f"portfolio_{digest}"
+
+        result = cache.get(cache_key)
+        Popularity.lookup('portfolio', result is not None)
+        if result is not None:
+            return result
+
+        prices = PortfolioAnalytics.prices(tickers + ([benchmark.upper()] if benchmark else []), start_date, end_date)
+
+        held = [t for t in tickers if t in prices.columns]
+        if not held:
+            return None
+
+        weight_of = dict(zip(tickers, weights))
+        result = PortfolioAnalytics.metrics(
+            prices[held],
+            np.array([weight_of[t] for t in held], dtype=np.float64),
+            prices[benchmark.upper()] if benchmark and benchmark.upper() in prices.columns else None,
+        )
+
+        cache.set(cache_key, result, settings.PORTFOLIO_CACHE_TTL)
+        return result
+
+    @staticmethod
+    def prices(tickers, start_date=None, end_date=None):
+        """
+        Close prices of the tickers aligned on one calendar (see align_normalized),
+        one column per ticker that has data in the window.
+        """
+        closes = {}
+        for ticker in dict.fromkeys(tickers):
+            data = FinanceModel.get_market_data(ticker, start_date or '1900-01-01', end_date or pd.Timestamp.today().date())
+            if data is not None and not data.empty:
+                closes[ticker] = data['Close'][ticker]
+
+        if not closes:
+            return pd.DataFrame()
+        return FinanceModel.align_normalized(closes)
+
+    @staticmethod
+    def metrics(prices, weights, benchmark=None):
+        """
+        Metrics from a DataFrame of aligned prices (one column per asset, NaN before
+        an asset's first bar) and an array of weights.
+
+        Returns a dict with:
+        - 'assets': DataFrame per asset of annualized return and volatility, beta,
+          maximum drawdown and one-day historical VaR
+        - 'portfolio': the same figures for the weighted portfolio
+        - 'covariance' and 'correlation': annualized covariance and correlation
+          matrices of the daily returns
+        """
+        values = prices.to_numpy(dtype=np.float64)
+        returns = values[1:] / values[:-1] - 1
+        mask = ~np.isnan(returns)
+        filled = np.where(mask, returns, 0.0)
+
+        weights = weights / weights.sum()
+        # Assets without a bar yet count as cash for the day
+        portfolio = filled @ weights
+
+        if benchmark is not None:
+            bench = benchmark.to_numpy(dtype=np.float64)
+            bench = np.nan_to_num(bench[1:] / bench[:-1] - 1)
+        else:
+            bench = portfolio
+
+        covariance, correlation = PortfolioAnalytics.pairwise_cov_corr(filled, mask)
+
+        assets = pd.DataFrame({
+            'return': PortfolioAnalytics._annual_return(filled, mask),
+            'volatility': np.sqrt(np.diag(covariance)),
+            'beta': PortfolioAnalytics._beta(filled, mask, bench),
+            'max_drawdown': PortfolioAnalytics._max_drawdown(filled),
+            'var': PortfolioAnalytics._var(returns),
+        }, index=prices.columns)
+
+        column = portfolio[:, None]
+        portfolio_mask = np.ones_like(column, dtype=bool)
+        summary = {
+            'return': float(PortfolioAnalytics._annual_return(column, portfolio_mask)[0]),
+            'volatility': float(portfolio.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(portfolio) > 1 else np.nan,
+            'beta': float(PortfolioAnalytics._beta(column, portfolio_mask, bench)[0]),
+            'max_drawdown': float(PortfolioAnalytics._max_drawdown(column)[0]),
+            'var': float(PortfolioAnalytics._var(column)[0]),
+        }
+
+        return {
+            'assets': assets,
+            'portfolio': summary,
+            'covariance': pd.DataFrame(covariance, index=prices.columns, columns=prices.columns),
+            'correlation': pd.DataFrame(correlation, index=prices.columns, columns=prices.columns),
+        }
+
+    @staticmethod
+    def pairwise_cov_corr(filled, mask):
+        """
+        Annualized covariance and correlation of every pair of columns over the rows
+        where both are present, from four matrix products. `filled` holds the returns
+        with missing ones set to 0 and `mask` marks the present ones.
+        """
+        m = mask.astype(np.float64)
+        n = m.T @ m
+        sum_x = filled.T @ m
+        sum_xx = (filled * filled).T @ m
+        sum_xy = filled.T @ filled
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dof = np.where(n > 1, n - 1, np.nan)
+            cov = (sum_xy - sum_x * sum_x.T / n) / dof
+            var_x = (sum_xx - sum_x * sum_x / n) / dof
+            corr = cov / np.sqrt(var_x * var_x.T)
+
+        np.fill_diagonal(corr, np.where(np.diag(n) > 1, 1.0, np.nan))
+        return cov * TRADING_DAYS, np.clip(corr, -1.0, 1.0)
+
+    @staticmethod
+    def _annual_return(filled, mask):
+        days = mask.sum(axis=0)
+        growth = np.prod(1 + filled, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(days > 0, growth ** (TRADING_DAYS / np.maximum(days, 1)) - 1, np.nan)
+
+    @staticmethod
+    def _beta(filled, mask, bench):
+        # Covariance with the benchmark over each asset's own trading days
+        m = mask.astype(np.float64)
+        b = bench[:, None] * m
+        n = m.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_x = filled.sum(axis=0) / n
+            mean_b = b.sum(axis=0) / n
+            cov = (filled * b).sum(axis=0) / n - mean_x * mean_b
+            var_b = (b * b).sum(axis=0) / n - mean_b ** 2
+            return cov / var_b
+
+    @staticmethod
+    def _max_drawdown(filled):
+        wealth = np.cumprod(1 + filled, axis=0)
+        peak = np.maximum.accumulate(wealth, axis=0)
+        return (wealth / peak - 1).min(axis=0) if len(wealth) else np.full(filled.shape[1], np.nan)
+
+    @staticmethod
+    def _var(returns):
+        # Historical one-day value at risk, as a positive loss fraction
+        level = settings.PORTFOLIO_VAR_LEVEL
+        if len(returns) == 0:
+            return np.full(returns.shape[1], np.nan)
+        with warnings.catch_warnings():
+            # Assets without any return in the window give NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return -np.nanpercentile(returns, (1 - level) * 100, axis=0)
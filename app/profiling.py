@@ -0,0 +1,174 @@
+import os
+import re
+import sys
+import time
+import logging
+import tempfile
+import threading
+import contextvars
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Leaf frames of threads that are waiting for work rather than doing any
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+}
+
+# Frames that run code in a contextvars.Context: the event loop running a
+# callback or task step, and the worker thread of sync_to_async
+_CONTEXT_FRAMES = {
+    ('events.py', '_run'),
+    ('sync.py', 'run_child'),
+    ('sync.py', 'thread_handler'),
+}
+
+# The sampler of the request being profiled, seen by everything it hands work to
+_profiled = contextvars.ContextVar('profiled', default=None)
+
+
+class StackSampler():
+    """
+    Wall-clock sampling profiler of one request, for the duration of a `with`
+    block.
+
+    A background thread reads the stacks of the threads of the process each
+    PROFILING_INTERVAL seconds and counts them in the collapsed format of flame
+    graphs (`thread;outer (file.py:12);inner (file.py:40)` -> samples). Under
+    ASGI the event loop and the sync_to_async threads are shared by every
+    request, so a stack is only counted if the innermost task or sync_to_async
+    call it runs in belongs to the profiled request, which is told by the
+    contextvars Context they run in. The thread that entered the block is also
+    counted outside of those, e.g. while it waits, and other threads only while
+    they are busy. Unlike cProfile nothing is traced, so the profiled code runs
+    at close to its normal speed.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.PROFILING_INTERVAL
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._contexts = {}
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._token = _profiled.set(self)
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        _profiled.reset(self._token)
+        self._contexts.clear()
+        return False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (ident != self._target and _idle(frame)):
+                    continue
+                stack = []
+                owner = None
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    if owner is None:
+                        owner = self._context_of(frame)
+                    frame = frame.f_back
+                if not self._owns(owner, ident):
+                    continue
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def _owns(self, context, ident):
+        if context is None:
+            return ident == self._target
+        return context.get(_profiled) is self
+
+    def _context_of(self, frame):
+        # The Context a task step or sync_to_async call runs in, looked up once
+        # per frame, or None for other frames
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) not in _CONTEXT_FRAMES:
+            return None
+        if frame not in self._contexts:
+            self._contexts[frame] = _find_context(frame.f_locals)
+        return self._contexts[frame]
+
+    def folded(self):
+        """
+        The samples as collapsed stacks, one `stack count` line each, as read by
+        flamegraph.pl, speedscope and inferno.
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _find_context(local_values):
+    # Handle._run has the handle as `self`; asgiref keeps the Context itself or
+    # its bound run method
+    for value in local_values.values():
+        for candidate in (value, getattr(value, '_context', None), getattr(value, '__self__', None)):
+            if isinstance(candidate, contextvars.Context):
+                return candidate
+    return None
+
+
+def _idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+
+def save_profile(sampler, view, path):
+    """
+    Writes the samples of a request to PROFILING_DIR as
+    `<time>-<view>-<path>.folded` and removes the oldest profiles beyond
+    PROFILING_MAX_FILES. Returns the file name.
+    """
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    now = time.time()
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_')[:80]
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}-{view}-{slug}.folded"
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(sampler.folded())
+        os.replace(tmp_path, os.path.join(directory, name))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    _prune(directory)
+    logger.info("Saved profile %s (%d samples)", name, sampler.samples)
+    return name
+
+
+def _prune(directory):
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.folded'):
+            try:
+                profiles.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                continue
+
+    profiles.sort(reverse=True)
+    for _, path in profiles[settings.PROFILING_MAX_FILES:]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,184 @@
+import time
+import threading
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .singleflight import acquire_lock, release_lock
+from .metrics import Metrics
+
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# How long a caller may wait in the queue for a token by default
+DEFAULT_DEADLINES = {
+    INTERACTIVE: 5,
+    BACKGROUND: 120,
+}
+
+_BUCKET_KEY = 'av_quota_bucket'
+_LOCK_KEY = 'av_quota_lock'
+
+_THROTTLE_MESSAGES = (
+    'rate limit',
+    'call frequency',
+    'requests per day',
+    'premium',
+)
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an Alpha Vantage call cannot get a token before its deadline,
+    or when Alpha Vantage itself answers that the key is throttled.
+    """
+
+
+class AlphaVantageScheduler():
+    """
+    Token bucket shared by every worker through the default cache.
+
+    The bucket refills at ALPHA_VANTAGE_CALLS_PER_MINUTE and the calls of the
+    current UTC day are capped at ALPHA_VANTAGE_CALLS_PER_DAY. Background work
+    (cache warming) must leave ALPHA_VANTAGE_INTERACTIVE_RESERVE tokens and
+    ALPHA_VANTAGE_INTERACTIVE_DAILY_RESERVE calls of the day untouched, and in
+    this process it also waits while any interactive caller is queued.
+    """
+
+    _waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+    _waiting_lock = threading.Lock()
+
+    @staticmethod
+    def call(func, *args, priority=INTERACTIVE, deadline=None, **kwargs):
+        """
+        Runs one Alpha Vantage call once a token is available. Raises
+        QuotaExceeded if no token is granted within `deadline` seconds or if
+        the response says the key is throttled.
+        """
+        if not AlphaVantageScheduler.acquire(priority, deadline):
+            raise QuotaExceeded(f"Alpha Vantage quota exhausted ({priority})")
+
+        try:
+            with Metrics.upstream('alpha_vantage'):
+                return func(*args, **kwargs)
+        except ValueError as e:
+            message = str(e).lower()
+            if any(m in message for m in _THROTTLE_MESSAGES):
+                AlphaVantageScheduler.drain()
+                raise QuotaExceeded(str(e)) from e
+            raise
+
+    @staticmethod
+    def acquire(priority=INTERACTIVE, deadline=None):
+        """
+        Waits for a token until the deadline passes. Returns True if a token
+        was taken.
+        """
+        if deadline is None:
+            deadline = DEFAULT_DEADLINES[priority]
+        give_up = time.monotonic() + deadline
+
+        with AlphaVantageScheduler._waiting_lock:
+            AlphaVantageScheduler._waiting[priority] += 1
+
+        try:
+            while True:
+                wait = None
+                if priority == INTERACTIVE or AlphaVantageScheduler._waiting[INTERACTIVE] == 0:
+                    wait = AlphaVantageScheduler._take(priority)
+                    if wait == 0:
+                        return True
+
+                remaining = give_up - time.monotonic()
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    return False
+                time.sleep(min(wait or 0.1, remaining))
+        finally:
+            with AlphaVantageScheduler._waiting_lock:
+                AlphaVantageScheduler._waiting[priority] -= 1
+
+    @staticmethod
+    def _take(priority):
+        """
+        Takes one token from the shared bucket. Returns 0 on success, otherwise
+        the number of seconds until a token could be available (inf when the
+        daily budget is used up).
+        """
+        per_minute = settings.ALPHA_VANTAGE_CALLS_PER_MINUTE
+        per_day = settings.ALPHA_VANTAGE_CALLS_PER_DAY
+        rate = per_minute / 60.0
+
+        min_tokens = 1
+        day_limit = per_day
+        if priority == BACKGROUND:
+            min_tokens += settings.ALPHA_VANTAGE_INTERACTIVE_RESERVE
+            day_limit -= settings.ALPHA_VANTAGE_INTERACTIVE_DAILY_RESERVE
+
+        lock = acquire_lock(_LOCK_KEY, timeout=5)
+        if lock is None:
+            return 0.05
+
+        try:
+            now = time.time()
+            state = AlphaVantageScheduler._state(now)
+
+            if state['day_used'] >= day_limit:
+                return float('inf')
+
+            if state['tokens'] < min_tokens:
+                return (min_tokens - state['tokens']) / rate
+
+            state['tokens'] -= 1
+            state['day_used'] += 1
+            cache.set(_BUCKET_KEY, state, 2 * 86400)
+            return 0
+        finally:
+            release_lock(_LOCK_KEY, lock)
+
+    @staticmethod
+    def _state(now):
+        per_minute = settings.ALPHA_VANTAGE_CALLS_PER_MINUTE
+        today = datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+
+        state = cache.get(_BUCKET_KEY)
+        if state is None:
+            state = {'tokens': float(per_minute), 'updated': now, 'day': today, 'day_used': 0}
+
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(float(per_minute), state['tokens'] + elapsed * per_minute / 60.0)
+        state['updated'] = now
+
+        if state['day'] != today:
+            state['day'] = today
+            state['day_used'] = 0
+        return state
+
+    @staticmethod
+    def drain():
+        """
+        Empties the bucket after Alpha Vantage reported throttling, so no worker
+        calls it again before the bucket has refilled.
+        """
+        lock = acquire_lock(_LOCK_KEY, timeout=5)
+        try:
+            state = AlphaVantageScheduler._state(time.time())
+            state['tokens'] = 0.0
+            cache.set(_BUCKET_KEY, state, 2 * 86400)
+        finally:
+            release_lock(_LOCK_KEY, lock)
+
+    @staticmethod
+    def status():
+        """
+        Current shared budget: tokens left in the bucket and calls used today.
+        """
+        state = AlphaVantageScheduler._state(time.time())
+        return {
+            'tokens': round(state['tokens'], 2),
+            'calls_per_minute': settings.ALPHA_VANTAGE_CALLS_PER_MINUTE,
+            'day_used': state['day_used'],
+            'calls_per_day': settings.ALPHA_VANTAGE_CALLS_PER_DAY,
+            'waiting': dict(AlphaVantageScheduler._waiting),
+        }
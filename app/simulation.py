@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from . import montecarlo
+from .portfolio import PortfolioAnalytics
+from .popularity import Popularity
+
+
+class MonteCarloSimulator():
+    """
+    Forward-looking value ranges of a buy-and-hold portfolio.
+
+    Paths are simulated in chunks sized to about SIMULATION_CHUNK_CELLS
+    simulated asset-days each. Chunks run on a shared process pool of
+    SIMULATION_WORKERS processes; a run that fits in one chunk runs inline,
+    which is faster than a trip to the pool. Every chunk returns a histogram
+    of the portfolio value per day, so percentile bands can be reported after
+    each finished chunk and get tighter as more paths come in. The chunk
+    seeds are spawned from the run's seed, so a run gives the same result
+    however the chunks are spread over the processes.
+    """
+
+    _pool = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def pool():
+        with MonteCarloSimulator._lock:
+            if MonteCarloSimulator._pool is None:
+                # Spawned workers only import the NumPy kernels, never the Django app
+                MonteCarloSimulator._pool = ProcessPoolExecutor(
+                    max_workers=settings.SIMULATION_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return MonteCarloSimulator._pool
+
+    @staticmethod
+    def cache_key(tickers, weights, horizon, paths, seed, method, start_date, end_date):
+        portfolio = '|'.join(f"{t}={float(w):g}" for t, w in zip(tickers, weights))
+        digest = hashlib.sha1(
+            f"{portfolio}|{horizon}|{paths}|{seed}|{method}|{start_date}|{end_date}".encode()
+        ).hexdigest()
+        return f"simulation_{digest}"
+
+    @staticmethod
+    def stream(tickers, weights=None, horizon=252, paths=10000, seed=0,
+               method=montecarlo.BOOTSTRAP, start_date=None, end_date=None):
+        """
+        Runs a simulation and yields a progress dict after every finished chunk:
+        'paths' done so far, 'total' paths, the percentile 'bands' (one list of
+        daily values relative to the start per SIMULATION_PERCENTILES entry),
+        'loss_probability', 'mean' final value and 'change', the largest move of
+        a final percentile since the previous update. The last dict has 'done' set.
+
+        Finished runs are cached by portfolio, horizon, paths, seed, method and
+        window; a cached run yields its final result only. Yields a dict with
+        'error' if none of the tickers has data.
+        """
+        tickers = [t.upper() for t in tickers]
+        if weights is None:
+            weights = [1.0] * len(tickers)
+
+        cache_key = MonteCarloSimulator.cache_key(tickers, weights, horizon, paths, seed, method, start_date, end_date)
+        result = cache.get(cache_key)
+        Popularity.lookup('simulation', result is not None)
+        if result is not None:
+            yield result
+            return
+
+        prices = PortfolioAnalytics.prices(tickers, start_date, end_date)
+        held = [t for t in tickers if t in prices.columns]
+        if not held:
+            yield {'error': 'No data found for the portfolio.', 'done': True}
+            return
+
+        # Days on which every asset of the portfolio traded
+        values = prices[held].to_numpy(dtype=np.float64)
+        returns = values[1:] / values[:-1] - 1
+        returns = returns[~np.isnan(returns).any(axis=1)]
+        if len(returns) < 2:
+            yield {'error': 'Not enough common history for the portfolio.', 'done': True}
+            return
+
+        weight_of = dict(zip(tickers, weights))
+        result = None
+        for result in MonteCarloSimulator.simulate(returns, [weight_of[t] for t in held], horizon, paths, seed, method):
+            result['tickers'] = held
+            yield result
+
+        cache.set(cache_key, result, settings.SIMULATION_CACHE_TTL)
+
+    @staticmethod
+    def simulate(returns, weights, horizon, paths, seed=0, method=montecarlo.BOOTSTRAP):
+        """
+        Simulates from a (days x assets) array of daily returns and yields the
+        progress dicts described in stream.
+        """
+        w = np.asarray(weights, dtype=np.float64)
+        w = w / w.sum()
+
+        chunk_paths = max(1, settings.SIMULATION_CHUNK_CELLS // (horizon * returns.shape[1]))
+        sizes = [min(chunk_paths, paths - start) for start in range(0, paths, chunk_paths)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = [(returns, w, horizon, size, s, method) for size, s in zip(sizes, seeds)]
+
+        if len(args) == 1:
+            finished = iter([(sizes[0], montecarlo.simulate_chunk(*args[0]))])
+        else:
+            # Chunks finish in any order; the last one is usually shorter
+            pool = MonteCarloSimulator.pool()
+            futures = {pool.submit(montecarlo.simulate_chunk, *a): size for size, a in zip(sizes, args)}
+            finished = ((futures[future], future.result()) for future in as_completed(futures))
+
+        histogram = np.zeros((horizon, montecarlo.BINS), dtype=np.int64)
+        total = 0.0
+        done = 0
+        previous = None
+
+        for chunk, (chunk_histogram, chunk_total) in finished:
+            histogram += chunk_histogram
+            total += chunk_total
+            done += chunk
+
+            bands = montecarlo.percentiles(histogram, settings.SIMULATION_PERCENTILES)
+            change = None if previous is None else float(np.abs(bands[:, -1] - previous).max())
+            previous = bands[:, -1]
+
+            yield {
+                'horizon': horizon,
+                'paths': done,
+                'total': paths,
+                'percentiles': list(settings.SIMULATION_PERCENTILES),
+                'bands': np.round(bands, 5).tolist(),
+                'loss_probability': montecarlo.loss_probability(histogram),
+                'mean': total / done,
+                'change': change,
+                'done': done == paths,
+            }
@@ -0,0 +1,137 @@
+import os
+import time
+import uuid
+import threading
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import PyLibMCCache, PyMemcacheCache
+from django.core.cache.backends.redis import RedisCache
+
+
+SINGLE_FLIGHT_LOCK_TIMEOUT = 60
+SINGLE_FLIGHT_RESULT_TTL = 30
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+# Backends whose add() is atomic for every process sharing the cache
+_ATOMIC_ADD = (RedisCache, PyMemcacheCache, PyLibMCCache, LocMemCache)
+
+_inflight = {}
+_lock = threading.Lock()
+
+_stats = {
+    'calls': 0,
+    'executed': 0,
+    'coalesced_local': 0,
+    'coalesced_remote': 0,
+}
+
+
+class _Call():
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def stats():
+    """
+    Returns the coalescing counters of this process: total calls, fetches that
+    were actually executed, and calls that were served by an in-flight fetch in
+    this process (coalesced_local) or in another worker (coalesced_remote).
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def single_flight(key, fetch):
+    """
+    Runs fetch() once for all concurrent callers asking for the same key.
+
+    Callers in the same process wait on the in-flight call and get its result.
+    Across processes, the caller that wins a lock in the shared cache runs the
+    fetch and publishes the result for SINGLE_FLIGHT_RESULT_TTL seconds, and the
+    callers in other workers wait for the lock to be released and read it. If
+    the publishing worker died or the result is gone, the caller fetches itself.
+    """
+    _count('calls')
+
+    with _lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _inflight[key] = call
+
+    if not leader:
+        _count('coalesced_local')
+        call.event.wait(SINGLE_FLIGHT_LOCK_TIMEOUT)
+        return call.result
+
+    try:
+        call.result = _fetch_shared(key, fetch)
+        return call.result
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        call.event.set()
+
+
+def acquire_lock(lock_key, timeout=SINGLE_FLIGHT_LOCK_TIMEOUT):
+    """
+    Tries once to take a lock in the shared cache. Returns the lock token, or
+    None if another caller holds the lock. The lock expires after `timeout`
+    seconds so a crashed worker cannot hold it forever.
+    """
+    token = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+    if not cache.add(lock_key, token, timeout):
+        return None
+    if isinstance(caches['default'], _ATOMIC_ADD):
+        return token
+
+    # On the file cache add() is only check-then-set, so wait one poll interval
+    # and read the lock back to see which worker won a simultaneous add
+    time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    if cache.get(lock_key) != token:
+        return None
+    return token
+
+
+def release_lock(lock_key, token):
+    """
+    Releases a lock taken with acquire_lock() if it is still held by `token`.
+    """
+    if token is not None and cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def _fetch_shared(key, fetch):
+    lock_key = f"singleflight_lock_{key}"
+    result_key = f"singleflight_result_{key}"
+
+    token = acquire_lock(lock_key)
+    if token is None:
+        deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_TIMEOUT
+        while cache.get(lock_key) is not None and time.monotonic() < deadline:
+            time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+        published = cache.get(result_key)
+        if published is not None:
+            _count('coalesced_remote')
+            return published[0]
+
+        token = acquire_lock(lock_key)
+
+    try:
+        _count('executed')
+        result = fetch()
+        cache.set(result_key, (result,), SINGLE_FLIGHT_RESULT_TTL)
+        return result
+    finally:
+        release_lock(lock_key, token)
@@ -0,0 +1,17 @@
+// "Copy to Excel" buttons: fetch the TSV export and put it on the clipboard,
+// ready to paste into a spreadsheet.
+document.addEventListener('click', function(event) {
+    const button = event.target.closest('[data-copy-url]');
+    if (!button) return;
+
+    const label = button.textContent;
+    fetch(button.dataset.copyUrl)
+        .then(response => {
+            if (!response.ok) throw new Error(response.statusText);
+            return response.text();
+        })
+        .then(text => navigator.clipboard.writeText(text))
+        .then(() => { button.textContent = 'Copied'; })
+        .catch(() => { button.textContent = 'Copy failed'; })
+        .finally(() => setTimeout(() => { button.textContent = label; }, 2000));
+});
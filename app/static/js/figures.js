@@ -0,0 +1,25 @@
+// Renders the figure payloads built by app/figures.py with Plotly.js.
+// The layout and config arrive with the first payload of a chart and are kept on
+// the container, so later payloads only need to carry the trace data.
+
+function renderFigure(container, figure, title) {
+    if (figure.layout) {
+        container.figureLayout = figure.layout;
+        container.figureConfig = figure.config;
+    }
+    const layout = Object.assign({}, container.figureLayout);
+    if (title) {
+        layout.title = Object.assign({}, layout.title, {text: title});
+    }
+    container.figureReady = Plotly.react(container, figure.data, layout, container.figureConfig);
+    return container.figureReady;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-figure]').forEach(container => {
+        const source = document.getElementById(container.dataset.figure);
+        if (source) {
+            renderFigure(container, JSON.parse(source.textContent));
+        }
+    });
+});
@@ -0,0 +1,35 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+
+_END = object()
+
+
+def content(request, iterator):
+    """
+    Streaming content for a StreamingHttpResponse to `request` that sends each
+    item of `iterator` as soon as it is made, under either server.
+
+    A WSGI server iterates the response itself, item by item, so the iterator
+    is passed as it is. Under ASGI it is wrapped in pull().
+    """
+    return pull(iterator) if isinstance(request, ASGIRequest) else iterator
+
+
+async def pull(iterator):
+    """
+    Async iterator over a sync iterator that takes every item in a worker thread.
+
+    Under ASGI a StreamingHttpResponse given a sync iterator reads all of it
+    with sync_to_async(list) before the first byte goes out. With this each
+    item is sent as soon as it is produced, and the event loop is not blocked
+    while the next one is made. Under WSGI it is the other way round: Django
+    reads an async iterator completely first, so use content() to pick.
+    """
+    iterator = iter(iterator)
+    take = sync_to_async(next, thread_sensitive=False)
+    while True:
+        item = await take(iterator, _END)
+        if item is _END:
+            return
+        yield item
@@ -1,3 +1,791 @@
-from django.test import TestCase
+import os
+import json
+import base64
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import singleflight
+from .availability import AvailabilityIndex
+from .bar_store import BarStore
+from .digests import DigestEngine
+from .downsample import lttb, point_budget, downsample_series
+from .imf import IMFDataMapper
+from .metrics import Metrics
+from .middleware import ProfilingMiddleware
+from .models import DataCommonsData
+from .models_finance import FinanceModel
+from .models_gd import GDIMF, TABLES
+from .models_watchlist import Watchlist, SeriesWatermark
+from .news import NewsIndex
+from .observations import parse_observations
+from .overlays import KERNELS, Overlays
+from .popularity import Popularity
+from .portfolio import PortfolioAnalytics
+from .profiling import StackSampler, save_profile
+from .quota import AlphaVantageScheduler, QuotaExceeded, BACKGROUND
+from .simulation import MonteCarloSimulator
+
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+def bars(start, end):
+    """
+    Daily bars on business days with a rising close, as BarStore.write takes them.
+    """
+    index = pd.bdate_range(start, end)
+    close = np.arange(1, len(index) + 1, dtype=np.float64)
+    return pd.DataFrame({
+        'Open': close, 'High': close + 1, 'Low': close - 0.5, 'Close': close, 'Volume': np.full(len(index), 100.0),
+    }, index=index)
+
+
+def points(trace, axis='x'):
+    # figure_payload sends numeric arrays as base64 typed arrays
+    values = trace[axis]
+    return np.frombuffer(base64.b64decode(values['bdata']), dtype=values['dtype']) if isinstance(values, dict) else np.asarray(values)
+
+
+async def read_streaming(response):
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+class StoreTestCase(SimpleTestCase):
+    """
+    Runs every test with a fresh local-memory cache and a temporary data directory.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.settings_override = override_settings(
+            CACHES=LOCMEM,
+            BAR_STORE_DIR=f"{self.tmp}/bars",
+            NEWS_INDEX_PATH=f"{self.tmp}/news.pkl",
+            IMF_SNAPSHOT_PATH=f"{self.tmp}/imf.pkl",
+            PROFILING_DIR=f"{self.tmp}/profiles",
+            AVAILABILITY_INDEX_PATH=f"{self.tmp}/availability.npz",
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        cache.clear()
+
+
+class BarStoreTests(StoreTestCase):
+
+    def test_slice_is_inclusive(self):
+        BarStore.write('AAPL', bars('2024-01-01', '2024-03-29'))
+
+        data = BarStore.slice('AAPL', '2024-01-02', '2024-01-05')
+        self.assertEqual(list(data.index.strftime('%Y-%m-%d')), ['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'])
+
+    def test_market_data_is_served_from_the_store_while_fresh(self):
+        BarStore.write('AAPL', bars('2024-01-01', '2024-03-29'))
+
+        with mock.patch.object(FinanceModel, '_fetch_daily') as fetch:
+            data = FinanceModel.get_market_data('AAPL', '2024-02-01', '2024-02-29')
+
+        fetch.assert_not_called()
+        self.assertEqual(len(data), 21)
+        self.assertEqual(list(data.columns.get_level_values('Ticker').unique()), ['AAPL'])
+
+
+class BarRefreshTests(StoreTestCase):
+
+    def test_refresh_merges_the_compact_payload(self):
+        history = bars('2024-01-01', '2024-03-29')
+        BarStore.write('AAPL', history.loc[:'2024-03-15'])
+
+        with mock.patch.object(FinanceModel, '_fetch_daily', return_value=history.loc['2024-03-01':]) as fetch:
+            self.assertTrue(FinanceModel._refresh_bars('AAPL'))
+
+        fetch.assert_called_once_with('AAPL', 'compact', 'interactive')
+        pd.testing.assert_frame_equal(BarStore.frame('AAPL'), history, check_freq=False, check_names=False, check_index_type=False)
+
+
+class SingleFlightTests(StoreTestCase):
+
+    def test_concurrent_callers_share_one_fetch(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            leader = pool.submit(singleflight.single_flight, 'key', fetch)
+            started.wait(5)
+            followers = [pool.submit(singleflight.single_flight, 'key', fetch) for _ in range(3)]
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(results, [42] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_lock_on_an_atomic_cache_does_not_wait(self):
+        with mock.patch('app.singleflight.time.sleep') as sleep:
+            token = singleflight.acquire_lock('lock')
+            self.assertIsNotNone(token)
+            self.assertIsNone(singleflight.acquire_lock('lock'))
+        sleep.assert_not_called()
+
+        singleflight.release_lock('lock', token)
+        self.assertIsNone(cache.get('lock'))
+
+    def test_lock_on_the_file_cache_is_read_back(self):
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': f"{self.tmp}/cache"}}
+        with override_settings(CACHES=file_cache), mock.patch('app.singleflight.time.sleep') as sleep:
+            token = singleflight.acquire_lock('lock')
+            self.assertEqual(cache.get('lock'), token)
+        sleep.assert_called_once()
+
+
+@override_settings(
+    ALPHA_VANTAGE_CALLS_PER_MINUTE=2,
+    ALPHA_VANTAGE_CALLS_PER_DAY=100,
+    ALPHA_VANTAGE_INTERACTIVE_RESERVE=1,
+    ALPHA_VANTAGE_INTERACTIVE_DAILY_RESERVE=0,
+)
+class QuotaTests(StoreTestCase):
+
+    def test_bucket_runs_dry(self):
+        self.assertTrue(AlphaVantageScheduler.acquire(deadline=0))
+        self.assertTrue(AlphaVantageScheduler.acquire(deadline=0))
+        self.assertFalse(AlphaVantageScheduler.acquire(deadline=0))
+        self.assertEqual(AlphaVantageScheduler.status()['day_used'], 2)
+
+    def test_background_leaves_the_interactive_reserve(self):
+        self.assertTrue(AlphaVantageScheduler.acquire(BACKGROUND, deadline=0))
+        self.assertFalse(AlphaVantageScheduler.acquire(BACKGROUND, deadline=0))
+        self.assertTrue(AlphaVantageScheduler.acquire(deadline=0))
+
+    def test_throttled_response_drains_the_bucket(self):
+        def throttled():
+            raise ValueError("Thank you for using Alpha Vantage! Our standard API rate limit is 25 requests per day.")
+
+        with self.assertRaises(QuotaExceeded):
+            AlphaVantageScheduler.call(throttled, deadline=0)
+        self.assertLess(AlphaVantageScheduler.status()['tokens'], 1)
+        self.assertFalse(AlphaVantageScheduler.acquire(deadline=0))
+
+
+class AlignNormalizedTests(SimpleTestCase):
+
+    def test_calendars_are_joined_and_normalized(self):
+        a = pd.Series([10.0, 11.0, 12.0], index=pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-04']))
+        b = pd.Series([50.0, 25.0], index=pd.to_datetime(['2024-01-02', '2024-01-03']))
+
+        aligned = FinanceModel.align_normalized({'A': a, 'B': b})
+
+        self.assertEqual(list(aligned.index.strftime('%m-%d')), ['01-01', '01-02', '01-03', '01-04'])
+        np.testing.assert_allclose(aligned['A'], [100, 110, 110, 120])
+        np.testing.assert_allclose(aligned['B'], [np.nan, 100, 50, 50])
+
+
+class DownsampleTests(SimpleTestCase):
+
+    def test_lttb_keeps_the_ends_and_the_peaks(self):
+        x = np.arange(1000, dtype=np.float64)
+        y = np.sin(x / 50)
+        y[500] = 10.0
+
+        kept = lttb(x, y, 100)
+
+        self.assertEqual(len(kept), 100)
+        self.assertEqual(kept[0], 0)
+        self.assertEqual(kept[-1], 999)
+        self.assertIn(500, kept)
+        self.assertTrue((np.diff(kept) > 0).all())
+
+    @override_settings(CHART_MIN_POINTS=100, CHART_MAX_POINTS=1000, CHART_POINT_BUDGET=500)
+    def test_point_budget(self):
+        self.assertEqual(point_budget('300'), 600)
+        self.assertEqual(point_budget('10'), 100)
+        self.assertEqual(point_budget('5000'), 1000)
+        self.assertEqual(point_budget('wide'), 500)
+
+    def test_short_series_are_untouched(self):
+        series = pd.Series([1.0, 2.0, 3.0], index=pd.date_range('2024-01-01', periods=3))
+        self.assertIs(downsample_series(series, 10), series)
+
+
+class ZoomTests(StoreTestCase):
+
+    def test_zoomed_figure_is_sent_at_full_resolution(self):
+        data = pd.DataFrame({'date': pd.date_range('1960-01-01', periods=5000, freq='D'), 'value': np.arange(5000.0)})
+        params = {'format': 'figure', 'country_code': 'USA', 'indicator_code': 'X', 'frequency': 'D', 'width': 300, 'label': 'GDP'}
+
+        with mock.patch.object(DataCommonsData, 'get_data_commons_data', return_value=data):
+            full = self.client.get('/macrodata_search/', params)
+            zoomed = self.client.get('/macrodata_search/', {**params, 'start': '1961-01-01', 'end': '1961-03-01'})
+            cached = self.client.get('/macrodata_search/', params, HTTP_IF_NONE_MATCH=full['ETag'])
+            invalid = self.client.get('/macrodata_search/', {**params, 'start': 'soon'})
+
+        trace = full.json()['figure']['data'][0]
+        self.assertTrue(trace['hovertemplate'].startswith('Date=%{x}<br>GDP=%{y}'))
+        self.assertLess(len(points(trace)), 5000)
+        self.assertEqual(len(points(zoomed.json()['figure']['data'][0])), 60)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_zoom_into_a_past_custom_range(self):
+        BarStore.write('AAPL', bars('2020-01-01', '2021-12-31'))
+        params = {'format': 'figure', 'start_date': '2020-01-01', 'end_date': '2020-12-31', 'width': 1000}
+
+        response = self.client.get('/markets_period/AAPL/custom/', {**params, 'start': '2020-03-02', 'end': '2020-03-31'})
+
+        self.assertEqual(response.status_code, 200)
+        x = pd.to_datetime(points(response.json()['figure']['data'][0]), unit='ms')
+        self.assertEqual((x[0], x[-1]), (pd.Timestamp('2020-03-02'), pd.Timestamp('2020-03-31')))
+        self.assertEqual(len(x), 22)
+
+    def test_custom_zoom_stays_inside_the_searched_range(self):
+        BarStore.write('AAPL', bars('2020-01-01', '2021-12-31'))
+        params = {'format': 'figure', 'start_date': '2020-01-01', 'end_date': '2020-12-31'}
+
+        response = self.client.get('/markets_period/AAPL/custom/', {**params, 'start': '2020-12-01', 'end': '2021-06-30'})
+
+        x = pd.to_datetime(points(response.json()['figure']['data'][0]), unit='ms')
+        self.assertEqual(x[-1], pd.Timestamp('2020-12-31'))
+
+
+class BarLevelTests(StoreTestCase):
+
+    def test_aggregate_slice_keeps_the_current_period(self):
+        # A Wednesday: the week, month and quarter holding it are not over yet
+        BarStore.write('AAPL', bars('2025-01-01', '2026-10-14'))
+
+        for level, label in (('W', '2026-10-16'), ('M', '2026-10-31'), ('Q', '2026-12-31')):
+            with self.subTest(level=level):
+                data = BarStore.slice('AAPL', '2026-01-01', '2026-10-14', level)
+                self.assertEqual(data.index[-1], pd.Timestamp(label))
+                self.assertEqual(data['Close'].iloc[-1], bars('2025-01-01', '2026-10-14')['Close'].iloc[-1])
+
+    def test_incremental_aggregates_match_a_full_rebuild(self):
+        history = bars('2024-01-01', '2024-06-28')
+        BarStore.write('AAPL', history.loc[:'2024-05-15'])
+        BarStore.write('AAPL', history, changed_since=pd.Timestamp('2024-05-15'))
+        incremental = {level: BarStore.frame('AAPL', level) for level in 'WMQ'}
+
+        BarStore.write('AAPL', history)
+        for level in 'WMQ':
+            with self.subTest(level=level):
+                pd.testing.assert_frame_equal(incremental[level], BarStore.frame('AAPL', level))
+
+
+class DataCommonsPanelTests(StoreTestCase):
+
+    def test_failed_panel_is_not_fetched_again_right_away(self):
+        with mock.patch('app.models.dc.get_stat_all', side_effect=RuntimeError('unavailable')) as get_stat_all:
+            self.assertTrue(DataCommonsData.get_category_panel('EconomicActivity', 'A').empty)
+            self.assertTrue(DataCommonsData.get_category_panel('EconomicActivity', 'A').empty)
+
+        self.assertEqual(get_stat_all.call_count, 1)
+
+
+class ParseObservationsTests(SimpleTestCase):
+
+    def test_mixed_date_formats(self):
+        df, rejected = parse_observations({'2021': '1.5', '2020-06': 2, '2019-01-31': 3.0, 'soon': 4, '2018': 'n/a'})
+
+        self.assertEqual(list(df['date'].dt.strftime('%Y-%m-%d')), ['2019-01-31', '2020-06-01', '2021-01-01'])
+        self.assertEqual(list(df['value']), [3.0, 2.0, 1.5])
+        self.assertEqual(sorted(rejected), [('2018', 'n/a'), ('soon', 4)])
+
+    def test_records(self):
+        df, rejected = parse_observations([{'date': '2020', 'value': 1}, {'date': '2021', 'value': 2}, 'junk'])
+        self.assertEqual(list(df['value']), [1.0, 2.0])
+        self.assertEqual(rejected, [])
+
+    def test_malformed_date_does_not_reject_its_length_group(self):
+        df, rejected = parse_observations({'abcd': 1, '2019': 1.0, '2020': 2.0})
+
+        self.assertEqual(list(df['date'].dt.year), [2019, 2020])
+        self.assertEqual(rejected, [('abcd', 1)])
+
+
+class DataCommonsPageTests(StoreTestCase):
+
+    def test_failed_fetch_shows_an_error(self):
+        form = {
+            'country_code': 'USA',
+            'indicator_category': 'EconomicActivity',
+            'indicator_code': 'Amount_EconomicActivity_GrossDomesticProduction_Nominal',
+            'frequency': 'A',
+        }
+
+        for graph_type in ('line', 'bar', 'pie'):
+            with self.subTest(graph_type=graph_type), \
+                    mock.patch.object(DataCommonsData, 'get_data_commons_data', return_value=pd.DataFrame()):
+                response = self.client.post('/macrodata_search/', {**form, 'graph_type': graph_type})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'No data found for the specified parameters.')
+
+
+class AvailabilityTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, AvailabilityIndex, '_index', None)
+
+    def test_build_save_and_look_up(self):
+        result = {
+            'country/USA': {'Count_Person': {'sourceSeries': [
+                {'observationPeriod': 'P1Y', 'val': {'2000': 1, '2020': 2}},
+                {'observationPeriod': 'P1M', 'val': {}},
+            ]}},
+            'country/CAN': {},
+        }
+        with mock.patch('app.availability.dc.get_stat_all', return_value=result):
+            index = AvailabilityIndex.build(['USA', 'CAN'], ['Count_Person'], {'A': 'P1Y', 'M': 'P1M'})
+
+        AvailabilityIndex.save(index)
+        self.assertTrue(AvailabilityIndex.load())
+
+        self.assertTrue(AvailabilityIndex.available('USA', 'Count_Person', 'A'))
+        self.assertFalse(AvailabilityIndex.available('USA', 'Count_Person', 'M'))
+        self.assertFalse(AvailabilityIndex.available('CAN', 'Count_Person'))
+        self.assertTrue(AvailabilityIndex.available('FRA', 'Count_Person', 'A'))
+        self.assertEqual(
+            AvailabilityIndex.coverage('USA', 'Count_Person', 'A'),
+            (np.datetime64('2000-01-01'), np.datetime64('2020-01-01')),
+        )
+
+
+class IMFTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, GDIMF, '_snapshot', None)
+
+    def response(self, indicator, values):
+        response = mock.Mock()
+        response.json.return_value = {'values': {indicator: values}}
+        return response
+
+    def test_failed_indicator_is_left_out(self):
+        session = mock.Mock()
+        session.get.side_effect = [
+            self.response('NGDPD', {'USA': {'2024': 29000.5}, 'CHN': {'2024': 18000.0}}),
+            requests.ConnectionError('reset'),
+        ]
+
+        with mock.patch.object(IMFDataMapper, 'session', return_value=session):
+            panel, failed = IMFDataMapper.fetch(['NGDPD', 'PPPGDP'], ['USA', 'CHN'], [2024])
+
+        self.assertEqual(failed, {'PPPGDP'})
+        self.assertEqual(set(panel['indicator']), {'NGDPD'})
+        self.assertEqual(sorted(panel['value']), [18000.0, 29000.5])
+
+    def test_refresh_keeps_the_previous_table_of_a_failed_indicator(self):
+        def panel(indicators, value):
+            rows = [(indicator, code) for indicator, _, _ in TABLES if indicator in indicators for code in ('USA', 'CHN')]
+            return pd.DataFrame({
+                'indicator': [i for i, _ in rows],
+                'country': [c for _, c in rows],
+                'year': np.full(len(rows), settings.IMF_YEAR, dtype=np.int16),
+                'value': np.full(len(rows), value),
+            })
+
+        indicators = [indicator for indicator, _, _ in TABLES]
+        with mock.patch.object(GDIMF, '_fetch_tables_data', return_value=(panel(indicators, 1.0), set())):
+            self.assertTrue(GDIMF.refresh())
+        with mock.patch.object(GDIMF, '_fetch_tables_data', return_value=(panel(indicators[1:], 2.0), {indicators[0]})):
+            self.assertTrue(GDIMF.refresh())
+
+        tables = GDIMF.snapshot()['tables']
+        self.assertEqual(list(tables[0]['table'].iloc[:, 1]), [1.0, 1.0])
+        self.assertEqual(list(tables[-1]['table'].iloc[:, 1]), [2.0, 2.0])
+
+        with mock.patch.object(GDIMF, '_fetch_tables_data', return_value=(panel([], 3.0), set(indicators))):
+            self.assertFalse(GDIMF.refresh())
+
+
+class PopularityTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Popularity.flush()
+
+    def test_counts_are_merged_and_ranked(self):
+        for ticker in ('AAPL', 'MSFT', 'AAPL'):
+            Popularity.record('ticker', ticker)
+        Popularity.flush()
+
+        self.assertEqual(Popularity.top('ticker', 1), [(('AAPL',), 2)])
+
+    def test_due_flush_runs_off_the_calling_thread(self):
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(Popularity, 'flush', side_effect=flush), mock.patch.object(Popularity, '_flushed', 0):
+            Popularity.lookup('bars', True)
+            self.assertTrue(flushed.wait(5))
+
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_tickers_are_counted_in_upper_case(self):
+        with mock.patch.object(FinanceModel, 'get_market_data', return_value=None):
+            response = asyncio.run(AsyncClient().get('/markets_period/aapl/1m/', {'format': 'figure'}))
+
+        self.assertEqual(response.status_code, 404)
+        Popularity.flush()
+        self.assertEqual(Popularity.top('ticker', 5), [(('AAPL',), 1)])
+
+
+class ExportTests(StoreTestCase):
+
+    def test_markets_export_streams_stored_bars(self):
+        BarStore.write('AAPL', bars('2024-01-01', '2024-01-31'))
+
+        with mock.patch.object(FinanceModel, 'get_market_data') as upstream:
+            response = asyncio.run(AsyncClient().get('/export/markets.csv', {'tickers': 'AAPL,MSFT', 'end_date': '2024-01-31'}))
+            self.assertTrue(response.is_async)
+            content = asyncio.run(read_streaming(response)).decode()
+
+        upstream.assert_not_called()
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'date,ticker,Open,High,Low,Close,Volume')
+        self.assertEqual(len(lines), 1 + 23)
+        self.assertTrue(lines[1].startswith('2024-01-01,AAPL,'))
+
+    def test_markets_export_streams_under_wsgi(self):
+        for ticker in ('AAPL', 'MSFT'):
+            BarStore.write(ticker, bars('2024-01-01', '2024-01-31'))
+
+        with mock.patch.object(BarStore, 'slice', wraps=BarStore.slice) as read:
+            response = self.client.get('/export/markets.tsv', {'tickers': 'AAPL,MSFT', 'end_date': '2024-01-31'})
+            self.assertFalse(response.is_async)
+            first = next(iter(response.streaming_content))
+            # Only the first ticker has been read when its rows go out
+            self.assertEqual(read.call_count, 1)
+
+        self.assertEqual(first.decode().splitlines()[0], 'date\tticker\tOpen\tHigh\tLow\tClose\tVolume')
+
+    def test_markets_export_without_stored_bars_is_not_found(self):
+        response = self.client.get('/export/markets.csv', {'tickers': 'MSFT'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_stored_bars_are_counted(self):
+        BarStore.write('AAPL', bars('2024-01-01', '2024-03-29'))
+
+        self.assertEqual(BarStore.count('AAPL', '2024-01-02', '2024-01-05'), 4)
+        self.assertEqual(BarStore.count('MSFT', '2024-01-02', '2024-01-05'), 0)
+
+    def test_datacommons_export_without_data_is_not_found(self):
+        with mock.patch.object(DataCommonsData, 'get_data_commons_data', return_value=pd.DataFrame()):
+            response = self.client.get('/export/datacommons.csv', {'country_code': 'USA', 'indicator_code': 'X'})
+        self.assertEqual(response.status_code, 404)
+
+
+class DigestTests(TestCase):
+
+    def setUp(self):
+        for email in ('a@example.com', 'b@example.com'):
+            Watchlist.objects.create(email=email, series='ticker:AAPL', name='Apple')
+        SeriesWatermark.objects.create(series='ticker:AAPL', last_date=pd.Timestamp('2024-01-02').date(), last_value=1.0)
+        self.data = pd.DataFrame({'date': pd.to_datetime(['2024-01-02', '2024-01-03']), 'value': [1.0, 2.0]})
+
+    def test_watermarks_move_after_sending(self):
+        with mock.patch.object(DigestEngine, 'fetch', return_value=self.data), \
+                mock.patch.object(DigestEngine, 'send', return_value=(2, set())):
+            result = DigestEngine.run()
+
+        self.assertEqual(result['digests'], 2)
+        self.assertEqual(str(SeriesWatermark.objects.get().last_date), '2024-01-03')
+
+    def test_failed_batch_keeps_the_watermark(self):
+        with mock.patch.object(DigestEngine, 'fetch', return_value=self.data), \
+                mock.patch.object(DigestEngine, 'send', return_value=(1, {'b@example.com'})):
+            result = DigestEngine.run()
+
+        self.assertEqual(result['held'], 1)
+        watermark = SeriesWatermark.objects.get()
+        self.assertEqual(str(watermark.last_date), '2024-01-02')
+        self.assertIsNotNone(watermark.checked)
+
+    @override_settings(DIGEST_BATCH_SIZE=1)
+    def test_send_returns_the_undelivered_addresses(self):
+        connection = mock.MagicMock()
+        connection.__enter__.return_value = connection
+        connection.send_messages.side_effect = [1, OSError('connection reset')]
+        updates = {
+            'a@example.com': [{'series': 'ticker:AAPL', 'name': 'Apple', 'observations': []}],
+            'b@example.com': [{'series': 'ticker:AAPL', 'name': 'Apple', 'observations': []}],
+        }
+
+        with mock.patch('app.digests.get_connection', return_value=connection):
+            self.assertEqual(DigestEngine.send(updates), (1, {'b@example.com'}))
+
+
+class PortfolioTests(SimpleTestCase):
+
+    def test_pairwise_correlation_matches_pandas(self):
+        rng = np.random.default_rng(0)
+        prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.01, (300, 3)), axis=0)), columns=['A', 'B', 'C'])
+        prices.iloc[:120, 2] = np.nan
+
+        result = PortfolioAnalytics.metrics(prices, np.array([1.0, 1.0, 2.0]))
+
+        expected = (prices / prices.shift(1) - 1).corr()
+        np.testing.assert_allclose(result['correlation'].to_numpy(), expected.to_numpy(), atol=1e-10)
+        self.assertEqual(list(result['assets'].index), ['A', 'B', 'C'])
+        self.assertLessEqual(result['portfolio']['max_drawdown'], 0)
+
+
+class SimulationTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(1)
+        self.returns = rng.normal(0.0005, 0.01, (500, 2))
+
+    @override_settings(SIMULATION_CHUNK_CELLS=4 * 10 * 2)
+    def test_progress_counts_the_chunk_that_finished(self):
+        # Chunks of 4, 4 and 2 paths; the short last chunk finishes first
+        pool = ThreadPoolExecutor(max_workers=3)
+        self.addCleanup(pool.shutdown)
+
+        def in_order(futures):
+            return list(futures)
+
+        def last_first(futures):
+            return list(futures)[::-1]
+
+        with mock.patch.object(MonteCarloSimulator, 'pool', return_value=pool):
+            with mock.patch('app.simulation.as_completed', in_order):
+                in_order = list(MonteCarloSimulator.simulate(self.returns, [1, 1], 10, 10, seed=3))
+            with mock.patch('app.simulation.as_completed', last_first):
+                reversed_order = list(MonteCarloSimulator.simulate(self.returns, [1, 1], 10, 10, seed=3))
+
+        self.assertEqual([u['paths'] for u in reversed_order], [2, 6, 10])
+        self.assertEqual([u['paths'] for u in in_order], [4, 8, 10])
+        self.assertTrue(reversed_order[-1]['done'])
+        self.assertAlmostEqual(reversed_order[-1]['mean'], in_order[-1]['mean'])
+        self.assertEqual(reversed_order[-1]['bands'], in_order[-1]['bands'])
+
+    def test_simulation_view_streams_updates(self):
+        updates = [{'paths': 5, 'done': False}, {'paths': 10, 'done': True}]
+
+        with mock.patch.object(MonteCarloSimulator, 'stream', return_value=iter(updates)):
+            response = asyncio.run(AsyncClient().get('/portfolio/simulation/', {'tickers': 'AAPL', 'paths': 10}))
+            self.assertTrue(response.is_async)
+            lines = asyncio.run(read_streaming(response)).decode().splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], updates)
+
+    def test_first_update_arrives_before_the_run_ends_under_wsgi(self):
+        finish = threading.Event()
+
+        def stream(*args):
+            yield {'paths': 5, 'done': False}
+            finish.wait(5)
+            yield {'paths': 10, 'done': True}
+
+        with mock.patch.object(MonteCarloSimulator, 'stream', side_effect=stream):
+            response = self.client.get('/portfolio/simulation/', {'tickers': 'AAPL', 'paths': 10})
+            self.assertFalse(response.is_async)
+            content = iter(response.streaming_content)
+            self.assertEqual(json.loads(next(content)), {'paths': 5, 'done': False})
+            self.assertFalse(finish.is_set())
+            finish.set()
+            self.assertEqual(json.loads(next(content)), {'paths': 10, 'done': True})
+
+
+class OverlayTests(StoreTestCase):
+
+    def test_kernels_continue_from_their_state(self):
+        close = 100 + np.cumsum(np.random.default_rng(2).normal(0, 1, 300))
+
+        for name, kernel in KERNELS.items():
+            with self.subTest(overlay=name):
+                full, _ = kernel(close, 14, None)
+                head, state = kernel(close[:200], 14, None)
+                tail, _ = kernel(close[200:], 14, state)
+                for label in full:
+                    np.testing.assert_allclose(np.concatenate([head[label], tail[label]]), full[label], equal_nan=True)
+
+    def test_stored_overlays_are_extended(self):
+        history = bars('2024-01-01', '2024-06-28')
+        BarStore.write('AAPL', history.loc[:'2024-05-31'])
+        Overlays.compute('AAPL', 'sma', 5)
+
+        BarStore.write('AAPL', history)
+        extended = Overlays.compute('AAPL', 'sma', 5)
+
+        expected = history['Close'].rolling(5).mean().to_numpy()
+        np.testing.assert_allclose(extended['SMA 5'], expected, equal_nan=True)
+        self.assertEqual(cache.get('overlay_AAPL_sma_5')['n'], len(history) - 1)
+
+    def test_ticker_case_shares_one_overlay(self):
+        BarStore.write('AAPL', bars('2024-01-01', '2024-06-28'))
+
+        lower = Overlays.compute('aapl', 'ema', 10)
+        kernel = mock.Mock(wraps=KERNELS['ema'])
+        with mock.patch.dict(KERNELS, ema=kernel):
+            upper = Overlays.compute('AAPL', 'ema', 10)
+
+        np.testing.assert_allclose(upper['EMA 10'], lower['EMA 10'], equal_nan=True)
+        # Only the newest bar is run through the kernel again
+        self.assertEqual(kernel.call_count, 1)
+        self.assertIsNone(cache.get('overlay_aapl_ema_10'))
+
+    def test_parse(self):
+        self.assertEqual(Overlays.parse('sma:10, ema,drawdown'), [('sma', 10), ('ema', 20), ('drawdown', None)])
+        with self.assertRaises(ValueError):
+            Overlays.parse('macd')
+
+
+class NewsIndexTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, NewsIndex, '_store', None)
+
+    def item(self, title, published, tickers=(), topics=()):
+        return {
+            'title': title,
+            'url': f"https://example.com/{title}",
+            'time_published': published,
+            'summary': '',
+            'ticker_sentiment': [{'ticker': t} for t in tickers],
+            'topics': [{'topic': t} for t in topics],
+        }
+
+    def test_bare_fed_is_not_a_keyword(self):
+        self.assertNotIn('kw:fed', NewsIndex._article(self.item('Investors fed up with tariffs', '20260101T000000'))['terms'])
+        self.assertIn('kw:the fed', NewsIndex._article(self.item('The Fed holds rates', '20260101T000000'))['terms'])
+
+    def test_headlines_newest_first_with_the_country_first(self):
+        articles = [NewsIndex._article(i) for i in (
+            self.item('Inflation in Germany cools', '20260103T000000'),
+            self.item('Inflation in Japan rises', '20260104T000000'),
+            self.item('Apple earnings beat', '20260102T000000', tickers=['AAPL']),
+            self.item('Germany inflation outlook', '20260101T000000'),
+        )]
+        articles.sort(key=lambda a: a['published'], reverse=True)
+        NewsIndex._save({'articles': articles, 'index': NewsIndex.build(articles), 'fetched_at': 0})
+
+        self.assertEqual([a['title'] for a in NewsIndex.for_ticker('aapl')], ['Apple earnings beat'])
+        self.assertEqual(
+            [a['title'] for a in NewsIndex.headlines(['kw:inflation'], within=['kw:germany'])],
+            ['Inflation in Germany cools', 'Germany inflation outlook', 'Inflation in Japan rises'],
+        )
+
+
+class MetricsTests(StoreTestCase):
+
+    def test_exposition(self):
+        Metrics.observe('request', 0.02, view='general_data')
+        Metrics.flush()
+
+        text = Metrics.exposition()
+
+        self.assertIn('# TYPE macronomics_request_seconds histogram', text)
+        self.assertIn('macronomics_request_seconds_bucket{view="general_data",le="+Inf"} 1', text)
+        self.assertIn('macronomics_request_seconds_count{view="general_data"} 1', text)
+
+    def test_due_flush_runs_off_the_calling_thread(self):
+        flushed = threading.Event()
+        threads = []
+
+        def flush():
+            threads.append(threading.current_thread())
+            flushed.set()
+
+        with mock.patch.object(Metrics, 'flush', side_effect=flush), mock.patch.object(Metrics, '_flushed', 0):
+            Metrics.observe('span', 0.001, span='test')
+            self.assertTrue(flushed.wait(5))
+
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_endpoint_is_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'macronomics_alpha_vantage_tokens', response.content)
+
+
+class ProfilingTests(StoreTestCase):
+
+    def test_only_the_profiled_request_is_sampled(self):
+        def spin_profiled():
+            until = time.monotonic() + 0.2
+            while time.monotonic() < until:
+                sum(range(100))
+
+        def spin_other():
+            until = time.monotonic() + 0.2
+            while time.monotonic() < until:
+                sum(range(100))
+
+        async def profiled():
+            with StackSampler(interval=0.002) as sampler:
+                await sync_to_async(spin_profiled, thread_sensitive=False)()
+            return sampler
+
+        async def both():
+            sampler, _ = await asyncio.gather(profiled(), sync_to_async(spin_other, thread_sensitive=False)())
+            return sampler
+
+        folded = asyncio.run(both()).folded()
+
+        self.assertIn('spin_profiled', folded)
+        self.assertNotIn('spin_other', folded)
+
+    @override_settings(PROFILING_MAX_FILES=2)
+    def test_old_profiles_are_pruned(self):
+        sampler = StackSampler()
+        sampler.stacks['MainThread;view (views.py:1)'] = 3
+        names = []
+        for i in range(3):
+            names.append(save_profile(sampler, 'general_data', f"/general_data/{i}"))
+            os.utime(f"{self.tmp}/profiles/{names[-1]}", (1000 + i, 1000 + i))
+
+        kept = sorted(os.listdir(f"{self.tmp}/profiles"))
+        self.assertEqual(len(kept), 2)
+        self.assertNotIn(names[0], kept)
+
+    def test_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_flagged_staff_request_is_profiled(self):
+        middleware = ProfilingMiddleware(lambda request: HttpResponse('ok'))
+
+        request = RequestFactory().get('/general_data/', HTTP_X_PROFILE='1')
+        request.user = mock.Mock(is_staff=False)
+        self.assertNotIn('X-Profile', middleware(request))
+
+        request.user = mock.Mock(is_staff=True)
+        response = middleware(request)
+        self.assertTrue(os.path.exists(f"{self.tmp}/profiles/{response['X-Profile']}"))
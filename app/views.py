@@ -1,4 +1,8 @@
-from datetime import datetime, timedelta, date
+import hmac
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta, date, timezone
 
 # Third-party imports
 import pandas as pd
@@ -7,23 +11,56 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 # Django imports
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
+from django.utils.cache import add_never_cache_headers
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_headers
 
 # Local application imports
 from .models import DataCommonsData, DataCommonsDataForm, get_indicators  
 from .models_finance import FinanceModel, FinanceDataForm  
 from .models_gd import GDIMF
+from .popularity import Popularity
+from . import exports
+from . import montecarlo
+from . import streaming
+from .simulation import MonteCarloSimulator
+from .overlays import Overlays
+from .news import NewsIndex
+from .quota import AlphaVantageScheduler
+from .figures import figure_payload, series_etag
+from .downsample import point_budget, downsample_series, downsample_frame
+from .metrics import Metrics
+from .bar_store import BarStore
+
+logger = logging.getLogger(__name__)
+
+
+def _render(request, template_name, context=None):
+    with Metrics.span('render'):
+        return render(request, template_name, context)
+
 
 def main_page(request):
 
-    return render(request, 'main_page.html')
+    return _render(request, 'main_page.html')
 
 
 def datacommons_data(request):
     
     error_message = None  
     graph = None          
+    export_query = None
+    zoom_query = None
+    news = []
+
+    if request.method == 'GET' and request.GET.get('format') == 'figure':
+        return _datacommons_figure(request)
 
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
@@ -33,9 +70,10 @@ def datacommons_data(request):
 
         if action == 'get_indicators':
             category = request.POST.get('indicator_category', '') 
+            frequency = request.POST.get('frequency', '')
 
             try:
-                indicators = get_indicators(country_code, category)
+                indicators = get_indicators(country_code, category, frequency)
                 return JsonResponse({
                     'success': True,
                     'indicators': indicators
@@ -63,10 +101,12 @@ def datacommons_data(request):
             #end_date = form.cleaned_data['end_date']
             graph_type = form.cleaned_data['graph_type']             
             
+            Popularity.record('dc', country_code, indicator_code, frequency)
+
             try:
                 data = DataCommonsData.get_data_commons_data(country_code, indicator_code, frequency)
                 
-                if data is None:
+                if data is None or data.empty:
                     raise ValueError("No data found for the specified parameters.")
                 
                 else:
@@ -75,17 +115,18 @@ def datacommons_data(request):
                         df = pd.DataFrame(data)
                     else:
                         df = data
-                    print(df.head()) 
-                    print(df.columns.tolist())
 
                     title = indicator_name
 
                     if graph_type == 'line':
-                        fig = px.line(
-                            df, x='date', y='value',
-                            title=title, 
-                            labels={'date': 'Date', 'value': indicator_name}
-                        )
+                        fig = _datacommons_line(downsample_frame(df, 'date', 'value', point_budget()), indicator_name)
+                        fig.update_layout(title=title)
+                        zoom_query = {
+                            'country_code': country_code,
+                            'indicator_code': indicator_code,
+                            'frequency': frequency,
+                            'label': indicator_name,
+                        }
                     elif graph_type == 'bar':
                         fig = px.bar(
                             df, x='date', y='value',
@@ -93,8 +134,10 @@ def datacommons_data(request):
                             labels={'value': indicator_name, 'date': 'Year'}
                         )
                     elif graph_type == 'pie':
+                        # Pie slices are labelled with the date as Data Commons writes it
+                        labels = df['date'].dt.strftime('%Y' if frequency == 'A' else '%Y-%m')
                         fig = px.pie(
-                            df, values='value', names='date',
+                            df.assign(date=labels), values='value', names='date',
                             title=title
                         )
 
@@ -105,20 +148,24 @@ def datacommons_data(request):
                         hovermode = 'x unified'
                     )
 
-                    graph = fig.to_html(
-                        full_html=False,
-                        include_plotlyjs='cdn', 
-                        config={
-                            'displaylogo': False,
-                            'modeBarButtonsToAdd': [
-                                'downloadImage'                       
-                            ],
-                            'toImageButtonOptions': {
-                                'format': 'png',
-                                'filename': f"{indicator_name}_{country_code}",
-                                'scale': 2
-                            }
-                        })
+                    export_query = urlencode({
+                        'country_code': country_code,
+                        'indicator_code': indicator_code,
+                        'frequency': frequency,
+                    })
+                    news = NewsIndex.for_series(country_code, indicator_code)
+
+                    graph = figure_payload(fig, config={
+                        'displaylogo': False,
+                        'modeBarButtonsToAdd': [
+                            'downloadImage'                       
+                        ],
+                        'toImageButtonOptions': {
+                            'format': 'png',
+                            'filename': f"{indicator_name}_{country_code}",
+                            'scale': 2
+                        }
+                    })
 
 
             except ValueError as e:
@@ -126,7 +173,65 @@ def datacommons_data(request):
     else:
         form = DataCommonsDataForm()
     
-    return render(request, 'datacommons_data.html', {'form': form, 'error_message': error_message, 'graph': graph})
+    return _render(request, 'datacommons_data.html', {
+        'form': form, 'error_message': error_message, 'graph': graph, 'export_query': export_query,
+        'zoom_query': zoom_query, 'news': news,
+    })
+
+
+def _datacommons_line(df, label):
+
+    return px.line(
+        df, x='date', y='value',
+        labels={'date': 'Date', 'value': label}
+    )
+
+
+def _datacommons_figure(request):
+    """
+    Trace data of a Data Commons line chart
+    (?format=figure&country_code=&indicator_code=&frequency=&label=), downsampled
+    to a point budget from ?width=. When the user zooms, the client asks again with
+    ?start= and ?end= and gets the zoomed window at full resolution or at the same
+    budget, whichever is smaller. The chart keeps the layout it was rendered with,
+    so none is sent. Revalidated with an ETag like the market figures.
+    """
+    country_code = request.GET.get('country_code', '')
+    indicator_code = request.GET.get('indicator_code', '')
+    frequency = request.GET.get('frequency', 'A')
+    budget = point_budget(request.GET.get('width'))
+
+    data = DataCommonsData.get_data_commons_data(country_code, indicator_code, frequency)
+    if data is None or data.empty:
+        return JsonResponse({'error': 'No data found for the specified parameters.'}, status=404)
+
+    try:
+        dates = pd.to_datetime(data['date'])
+        window = pd.Series(True, index=data.index)
+        if request.GET.get('start'):
+            window &= dates >= pd.to_datetime(request.GET['start'])
+        if request.GET.get('end'):
+            window &= dates <= pd.to_datetime(request.GET['end'])
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid zoom range.'}, status=400)
+
+    df = data[window]
+    if df.empty:
+        return JsonResponse({'error': 'No observations in the zoomed range.'}, status=404)
+
+    etag = series_etag(
+        country_code, indicator_code, frequency, request.GET.get('start'), request.GET.get('end'),
+        df['date'].iloc[-1], df['value'].iloc[-1], len(df), budget, request.GET.get('label'),
+    )
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        fig = _datacommons_line(downsample_frame(df, 'date', 'value', budget), request.GET.get('label') or indicator_code)
+        response = JsonResponse({'figure': figure_payload(fig, include_layout=False)})
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 def markets_data(request):
 
@@ -134,214 +239,614 @@ def markets_data(request):
         form = FinanceDataForm(request.POST)
 
         if form.is_valid():
-            ticker = form.cleaned_data['ticker']
-            start_date = form.cleaned_data['start_date'] or (datetime.now().date() - timedelta(days=365))
-            end_date = form.cleaned_data['end_date'] or datetime.now().date()
-
-            request.session['ticker'] = ticker
-            request.session['start_date'] = start_date.strftime('%Y-%m-%d') if hasattr(start_date, 'strftime') else start_date
-            request.session['end_date'] = end_date.strftime('%Y-%m-%d') if hasattr(end_date, 'strftime') else end_date
-
-            return redirect('markets_results')
+            return redirect(_results_url(form))
     else:
         form = FinanceDataForm()
-        return render(request, 'markets_search.html', {'form': form})
+    return _render(request, 'markets_search.html', {'form': form})
 
 
-def markets_results(request):
+def _results_url(form):
+    """
+    Canonical results URL of a valid FinanceDataForm: upper case ticker and both
+    dates in ISO format, so every search for the same data shares one URL (and one
+    cache entry).
+    """
+    end_date = form.cleaned_data['end_date'] or datetime.now().date()
+    start_date = form.cleaned_data['start_date'] or (end_date - timedelta(days=365))
+    query = urlencode({
+        'ticker': form.cleaned_data['ticker'].strip().upper(),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+    })
+    return f"{reverse('markets_results')}?{query}"
+
 
+def _period_start(period, end_date):
+    """
+    Start date of a chart period button. Returns the start date and the period to
+    mark active, which is only set when an unknown period falls back to 1M.
+    """
+    #if period == '1d':
+    #    return end_date - timedelta(days=1), None
+    if period == '1m':
+        return end_date - timedelta(days=30), None
+    elif period == 'ytd':
+        return date(end_date.year, 1, 1), None
+    elif period == '1y':
+        return end_date - timedelta(days=365), None
+    elif period == 'all':
+        return date(1900, 1, 1), None
+    return end_date - timedelta(days=30), '1m'
+
+
+async def _fetch_market_page(ticker, start_date, end_date):
+    """
+    Fetches the price history and the company info of a ticker concurrently, so the
+    page waits for the slower of the two upstream calls instead of their sum. The
+    blocking fetches run on the event loop's worker threads.
+    """
+    Popularity.record('ticker', ticker.upper())
+    return await asyncio.gather(
+        sync_to_async(FinanceModel.get_market_data, thread_sensitive=False)(ticker, start_date, end_date),
+        sync_to_async(FinanceModel.get_basic_info, thread_sensitive=False)(ticker),
+    )
+
+
+def _info_box(basic_info):
+
+    if basic_info is None:
+        return None
+
+    return {
+        'Name': basic_info.get('longName', 'N/A'),
+        'Sector': basic_info.get('sector', 'N/A'),
+        'Industry': basic_info.get('industry', 'N/A'),
+        'Market_Cap': basic_info.get('marketCap', 'N/A'),
+        'Beta': basic_info.get('beta', 'N/A'),
+        '52_Week_High': basic_info.get('fiftyTwoWeekHigh', 'N/A'),
+        '52_Week_Low': basic_info.get('fiftyTwoWeekLow', 'N/A'),
+        'Current_Price': basic_info.get('currentPrice', 'N/A'),
+        'PE_Ratio': basic_info.get('forwardPE', 'N/A'),
+        'Dividend_Yield': basic_info.get('dividendYield', 'N/A')
+    }
+
+
+@cache_page(settings.MARKETS_PAGE_CACHE_TTL)
+async def markets_results(request):
+    """
+    Results of a search. The ticker and dates come from the query string
+    (?ticker=&start_date=&end_date=), so the page depends on its URL only and is
+    cached per URL on the server and by the browser.
+    """
     graph = None
     error_message = None
     info_box = None
+    ticker = None
 
-    ticker = request.session.get('ticker')
-    start_date_str = request.session.get('start_date')
-    end_date_str = request.session.get('end_date')
+    form = FinanceDataForm(request.GET)
+    if not form.is_valid():
+        return await sync_to_async(_render)(request, 'markets_search.html', {'form': form})
+
+    url = _results_url(form)
+    if url != request.get_full_path():
+        return redirect(url)
+
+    ticker = form.cleaned_data['ticker']
+    start_date_str = form.cleaned_data['start_date'].isoformat()
+    end_date_str = form.cleaned_data['end_date'].isoformat()
 
     if ticker and start_date_str and end_date_str:
-        data = FinanceModel.get_market_data(ticker, start_date_str, end_date_str)
+        data, basic_info = await _fetch_market_page(ticker, start_date_str, end_date_str)
+
         if data is not None:
-            
-            print(f"Data shape: {data.shape}, Columns: {data.columns}")
-            print(f"Is MultiIndex: {isinstance(data.columns, pd.MultiIndex)}")
-            print("Data columns:", data.columns)
-            
+
             if isinstance(data.columns, pd.MultiIndex):
 
                 close_prices = data['Close'][ticker]
                 title = ticker
 
                 if close_prices is not None:
-                    fig = px.line(
-                        x=close_prices.index, 
-                        y=close_prices.values,
-                        title=title,
-                        labels={'x': 'Date', 'y': 'Close Price'}
-                    )
-                    fig.update_layout(
-                        template='plotly_white',
-                        xaxis_tickformat='%Y-%m-%d',
-                        yaxis_tickformat='.2f',
-                        hovermode='x unified'
-                    )
-                    graph = fig.to_html(
-                        full_html=False,
-                        include_plotlyjs='cdn', 
-                        config={
-                            'displaylogo': False,
-                            'modeBarButtonsToAdd': [
-                                'downloadImage'                       
-                            ]
-                        })
+                    fig = _price_figure(downsample_series(close_prices, point_budget()), title)
+                    graph = figure_payload(fig)
             
-            basic_info = FinanceModel.get_basic_info(ticker)
-
-            if basic_info is not None:
-                info_box = {
-                    'Name': basic_info.get('longName', 'N/A'),
-                    'Sector': basic_info.get('sector', 'N/A'),
-                    'Industry': basic_info.get('industry', 'N/A'),
-                    'Market_Cap': basic_info.get('marketCap', 'N/A'),
-                    'Beta': basic_info.get('beta', 'N/A'),
-                    '52_Week_High': basic_info.get('fiftyTwoWeekHigh', 'N/A'),
-                    '52_Week_Low': basic_info.get('fiftyTwoWeekLow', 'N/A'),
-                    'Current_Price': basic_info.get('currentPrice', 'N/A'),
-                    'PE_Ratio': basic_info.get('forwardPE', 'N/A'),
-                    'Dividend_Yield': basic_info.get('dividendYield', 'N/A')
-                }
-                print(info_box)
-        
+            info_box = _info_box(basic_info)
+        else:
+            error_message = f"No data found for {ticker} in the specified date range."
 
     form = FinanceDataForm()
+    news = await sync_to_async(NewsIndex.for_ticker, thread_sensitive=False)(ticker) if ticker else []
 
-    return render(request, 'markets_search.html', {
+    response = await sync_to_async(_render)(request, 'markets_search.html', {
         'form': form, 
         'error_message': error_message, 
         'graph': graph, 
         'info_box': info_box,
+        'news': news,
         'ticker': ticker,
-        'active_period': 'custom'
+        'active_period': 'custom',
+        'period_range': {'start_date': start_date_str, 'end_date': end_date_str},
+        'export_query': urlencode({'tickers': ticker, 'start_date': start_date_str, 'end_date': end_date_str})
     })
+    if error_message:
+        add_never_cache_headers(response)
+    return response
+
+@cache_page(settings.MARKETS_PAGE_CACHE_TTL)
+@vary_on_headers('X-Requested-With')
+async def markets_period(request, ticker, period):
+    """
+    Price history of a ticker for a period button. Like the results page it only
+    depends on its URL, so pages are cached per URL. Figure requests
+    (?format=figure) are revalidated with their ETag instead.
+
+    Indicator overlays are added with ?overlays=sma:50,bollinger:20,rsi (see
+    Overlays.parse).
+    """
+
+    if request.GET.get('format') == 'figure':
+        return await _markets_period_figure(request, ticker, period)
 
-def markets_period(request, ticker, period):
     graph = None
     error_message = None
     info_box = None
     active_period = None
 
+    try:
+        overlays = Overlays.parse(request.GET.get('overlays', ''))
+    except ValueError as e:
+        overlays = []
+        error_message = str(e)
+
     try: 
         end_date = datetime.now().date()
-        
-        #if period == '1d':
-        #    start_date = end_date - timedelta(days=1)
-        if period == '1m':
-            start_date = end_date - timedelta(days=30)
-        elif period == 'ytd':
-            start_date = date(end_date.year, 1, 1)
-        elif period == '1y':
-            start_date = end_date - timedelta(days=365)
-        elif period == 'all':
-            start_date = date(1900, 1, 1)
-        else:
-            start_date = end_date - timedelta(days=30)
-            active_period = '1m'
+        start_date, active_period = _period_start(period, end_date)
 
-        request.session['ticker'] = ticker
-        request.session['start_date'] = start_date.strftime('%Y-%m-%d')
-        request.session['end_date'] = end_date.strftime('%Y-%m-%d')
-
-        data = FinanceModel.get_market_data(ticker, start_date, end_date)                
+        data, basic_info = await _fetch_market_page(ticker, start_date, end_date)
 
         if data is not None:
 
             if isinstance(data.columns, pd.MultiIndex):
                 close_prices = data['Close'][ticker]
                 title = f"{ticker} - {period.upper()} Price History"
-
-                fig = px.line(
-                    x=close_prices.index,
-                    y=close_prices.values,
-                    title=title,
-                    labels={'x': 'Date', 'y': 'Close Price'}
-                )
-                fig.update_layout(
-                    template='plotly_white',
-                    xaxis_tickformat='%Y-%m-%d',
-                    yaxis_tickformat='.2f',
-                    hovermode='x unified'
-                )
-                graph = fig.to_html(
-                    full_html=False,
-                    include_plotlyjs='cdn', 
-                    config={
-                        'displaylogo': False,
-                        'modeBarButtonsToAdd': ['downloadImage']
-                    }
-                )
+                close_prices = downsample_series(close_prices, point_budget())
+                fig = _price_figure(close_prices, title)
+                if overlays:
+                    await sync_to_async(_add_overlays, thread_sensitive=False)(fig, ticker, overlays, close_prices.index)
+                graph = figure_payload(fig)
         else:
             error_message = f"No data found for {ticker} in the specified date range."
         
-        basic_info = FinanceModel.get_basic_info(ticker)
-
-        if basic_info is not None:
-            info_box = {
-                'Name': basic_info.get('longName', 'N/A'),
-                'Sector': basic_info.get('sector', 'N/A'),
-                'Industry': basic_info.get('industry', 'N/A'),
-                'Market_Cap': basic_info.get('marketCap', 'N/A'),
-                'Beta': basic_info.get('beta', 'N/A'),
-                '52_Week_High': basic_info.get('fiftyTwoWeekHigh', 'N/A'),
-                '52_Week_Low': basic_info.get('fiftyTwoWeekLow', 'N/A'),
-                'Current_Price': basic_info.get('currentPrice', 'N/A'),
-                'PE_Ratio': basic_info.get('forwardPE', 'N/A'),
-                'Dividend_Yield': basic_info.get('dividendYield', 'N/A')
-            }
+        info_box = _info_box(basic_info)
         
     except Exception as e:
         error_message = f"Error processing data: {str(e)}"
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing %s %s", ticker, period)
     
     # Create a form for searching again
     form = FinanceDataForm()
     if ticker:
         form.initial['ticker'] = ticker
 
+    # Reading the news store can mean loading it from disk
+    news = await sync_to_async(NewsIndex.for_ticker, thread_sensitive=False)(ticker)
+
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        return JsonResponse({
+        response = JsonResponse({
             'graph': graph,
             'period': period,
             'info_box': info_box,
+            'news': [{**a, 'published': a['published'].isoformat()} for a in news],
             'error': error_message
         })
-    
-    return render(request, 'markets_search.html', {
-        'form': form,
+    else:
+        response = await sync_to_async(_render)(request, 'markets_search.html', {
+            'form': form,
+            'graph': graph,
+            'info_box': info_box,
+            'news': news,
+            'ticker': ticker,
+            'error_message': error_message,
+            'active_period': active_period or period,
+            'export_query': urlencode({
+                'tickers': ticker,
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+            })
+        })
+
+    if error_message:
+        # Failed lookups (e.g. quota used up) are not cached
+        add_never_cache_headers(response)
+    return response
+
+
+def _add_overlays(fig, ticker, overlays, index):
+    """
+    Adds indicator overlays to a price or candle figure at the dates of `index`.
+    Overlays that are not on the price scale get a second y axis. Candles are
+    labelled with the last day of their period, so the overlay value of the last
+    trading day up to it is used.
+    """
+    frame, price_scale = Overlays.frame(ticker, overlays, index[0] - pd.Timedelta(days=7), index[-1])
+    if frame is None or frame.empty:
+        return
+
+    frame = frame.reindex(index, method='ffill')
+    for label in frame.columns:
+        fig.add_trace(go.Scatter(
+            x=frame.index,
+            y=frame[label].to_numpy(),
+            name=label,
+            mode='lines',
+            line={'width': 1},
+            yaxis='y' if label in price_scale else 'y2',
+        ))
+
+    if len(price_scale) < len(frame.columns):
+        fig.update_layout(yaxis2={'overlaying': 'y', 'side': 'right', 'showgrid': False})
+    fig.update_layout(showlegend=True)
+
+
+def _price_figure(close_prices, title):
+
+    fig = px.line(
+        x=close_prices.index,
+        y=close_prices.values,
+        title=title,
+        labels={'x': 'Date', 'y': 'Close Price'}
+    )
+    fig.update_layout(
+        template='plotly_white',
+        xaxis_tickformat='%Y-%m-%d',
+        yaxis_tickformat='.2f',
+        hovermode='x unified'
+    )
+    return fig
+
+
+CANDLE_LEVEL_NAMES = {
+    'D': 'Daily',
+    'W': 'Weekly',
+    'M': 'Monthly',
+    'Q': 'Quarterly',
+}
+
+
+def _candle_figure(candles, title):
+
+    fig = go.Figure(go.Candlestick(
+        x=candles.index,
+        open=candles['Open'],
+        high=candles['High'],
+        low=candles['Low'],
+        close=candles['Close'],
+        name='Price'
+    ))
+    fig.update_layout(
+        title=title,
+        template='plotly_white',
+        xaxis_tickformat='%Y-%m-%d',
+        yaxis_tickformat='.2f',
+        xaxis_rangeslider_visible=False,
+        hovermode='x unified'
+    )
+    return fig
+
+
+async def _markets_period_figure(request, ticker, period):
+    """
+    Figure JSON for a period button click. The ETag is derived from the last bar of
+    the series, so repeated clicks revalidate with a 304 until a new bar arrives.
+    Pass ?layout=0 once the client has the layout and config of the chart.
+
+    The line is downsampled to a point budget from ?width= (chart width in pixels).
+    When the user zooms, the client asks again with ?start= and ?end= and gets the
+    zoomed window at full resolution or at the same budget, whichever is smaller.
+    The 'custom' period of a search results page takes its range from
+    ?start_date= and ?end_date=.
+
+    With ?chart=candle the response is a candlestick chart built from the coarsest
+    OHLC level that still gives enough candles for the window.
+
+    ?overlays= adds indicator overlays to either chart.
+    """
+    end_date = datetime.now().date()
+    include_layout = request.GET.get('layout', '1') != '0'
+    chart = request.GET.get('chart', 'line')
+    budget = point_budget(request.GET.get('width'))
+    Popularity.record('ticker', ticker.upper())
+
+    try:
+        if period == 'custom':
+            # The range of a search results page, sent along by the page itself
+            end_date = pd.to_datetime(request.GET.get('end_date') or end_date).date()
+            start_date = pd.to_datetime(request.GET.get('start_date') or (end_date - timedelta(days=365))).date()
+        else:
+            start_date, _ = _period_start(period, end_date)
+        if request.GET.get('start'):
+            start_date = max(start_date, pd.to_datetime(request.GET['start']).date())
+        if request.GET.get('end'):
+            end_date = min(end_date, pd.to_datetime(request.GET['end']).date())
+    except (ValueError, TypeError):
+        return JsonResponse({'period': period, 'error': 'Invalid zoom range.'}, status=400)
+
+    try:
+        overlays = Overlays.parse(request.GET.get('overlays', ''))
+    except ValueError as e:
+        return JsonResponse({'period': period, 'error': str(e)}, status=400)
+
+    if chart == 'candle':
+        data, level = await sync_to_async(FinanceModel.get_candles, thread_sensitive=False)(ticker, start_date, end_date)
+    else:
+        data = await sync_to_async(FinanceModel.get_market_data, thread_sensitive=False)(ticker, start_date, end_date)
+        level = 'D'
+
+    if data is None or data.empty:
+        return JsonResponse({
+            'period': period,
+            'error': f"No data found for {ticker} in the specified date range."
+        }, status=404)
+
+    close_prices = data['Close'][ticker] if chart != 'candle' else data['Close']
+    etag = series_etag(
+        ticker, period, chart, level, start_date, end_date, close_prices.index[-1].date(),
+        close_prices.iloc[-1], len(close_prices), budget, include_layout, overlays
+    )
+
+    name = ticker if period == 'custom' else f"{ticker} - {period.upper()}"
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    elif chart == 'candle':
+        title = f"{name} {CANDLE_LEVEL_NAMES[level]} Candles"
+        fig = _candle_figure(data, title)
+        if overlays:
+            await sync_to_async(_add_overlays, thread_sensitive=False)(fig, ticker, overlays, data.index)
+        figure = figure_payload(fig, include_layout=include_layout)
+        response = JsonResponse({'period': period, 'title': title, 'level': level, 'figure': figure})
+    else:
+        title = f"{name} Price History"
+        close_prices = downsample_series(close_prices, budget)
+        fig = _price_figure(close_prices, title)
+        if overlays:
+            await sync_to_async(_add_overlays, thread_sensitive=False)(fig, ticker, overlays, close_prices.index)
+        figure = figure_payload(fig, include_layout=include_layout)
+        response = JsonResponse({'period': period, 'title': title, 'figure': figure})
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def markets_compare(request, period):
+    """
+    Compares many tickers in one chart. Tickers are given as ?tickers=AAPL,MSFT,...
+    and every series is normalized to 100 at its first bar in the period.
+    """
+    graph = None
+    error_message = None
+    export_query = None
+
+    tickers = _parse_tickers(request.GET.get('tickers', ''))
+
+    if len(tickers) > settings.COMPARE_MAX_TICKERS:
+        error_message = f"Please select at most {settings.COMPARE_MAX_TICKERS} tickers."
+
+    elif tickers:
+        end_date = datetime.now().date()
+        start_date, _ = _period_start(period, end_date)
+        for ticker in tickers:
+            Popularity.record('ticker', ticker)
+
+        results = await asyncio.gather(*(
+            sync_to_async(FinanceModel.get_market_data, thread_sensitive=False)(ticker, start_date, end_date)
+            for ticker in tickers
+        ))
+
+        closes = {}
+        missing = []
+        for ticker, data in zip(tickers, results):
+            if data is None or data.empty:
+                missing.append(ticker)
+            else:
+                closes[ticker] = data['Close'][ticker]
+
+        if missing:
+            error_message = f"No data found for {', '.join(missing)}."
+
+        if closes:
+            normalized = FinanceModel.align_normalized(closes)
+
+            fig = px.line(
+                normalized,
+                title=f"{period.upper()} Performance (base = 100)",
+                labels={'date': 'Date', 'value': 'Indexed Close', 'variable': 'Ticker'}
+            )
+            fig.update_layout(
+                template='plotly_white',
+                xaxis_tickformat='%Y-%m-%d',
+                yaxis_tickformat='.2f',
+                hovermode='x unified'
+            )
+            graph = figure_payload(fig)
+            export_query = urlencode({
+                'tickers': ','.join(closes),
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+            })
+
+    return await sync_to_async(_render)(request, 'markets_compare.html', {
         'graph': graph,
-        'info_box': info_box,
-        'ticker': ticker,
         'error_message': error_message,
-        'active_period': active_period
+        'tickers': ','.join(tickers),
+        'active_period': period,
+        'export_query': export_query
     })
 
 
+def _parse_tickers(value):
+    """
+    Upper case tickers of a comma separated list, without blanks and duplicates.
+    """
+    tickers = []
+    for ticker in value.upper().split(','):
+        ticker = ticker.strip()
+        if ticker and ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+
 def gd_popular_countries_data(request):
     """
     View for displaying popular countries data from the IMF.
     """
-    table = GDIMF.popular_countries_data()
-    if table is not None:
-        
-        table = table.sort_values(by='GDP (Billions USD)', ascending=False)
+    snapshot = GDIMF.snapshot()
+    if snapshot is not None:
+        return _render(request, 'general_data.html', {
+            'tables': snapshot['tables'],
+            'year': snapshot['year'],
+            'fetched_at': datetime.fromtimestamp(snapshot['fetched_at'], tz=timezone.utc)
+        })
+    else:
+        return _render(request, 'general_data.html', {'error': 'No data available.'})
 
-        table_html = table.to_html(
-            classes='table table-striped table-hover',
-            index=False,
-            border=0, 
-            justify='center', 
-            escape=False
-        )
+def _export_error(fmt):
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'error': f"Unknown export format {fmt}."}, status=404)
+    return JsonResponse({'error': f"{fmt.upper()} export is not available on this server."}, status=501)
 
-        return render(request, 'general_data.html', {'table_html': table_html})
-    else:
-        return render(request, 'general_data.html', {'error': 'No data available.'})
\ No newline at end of file
+
+def export_markets(request, fmt):
+    """
+    Daily bars of one or more tickers (?tickers=AAPL,MSFT) between ?start_date= and
+    ?end_date= (whole history by default), one row per ticker and day. Tickers are
+    read from the bar store one at a time while the response streams; tickers that
+    were never stored are left out rather than fetched.
+    """
+    if not exports.available(fmt):
+        return _export_error(fmt)
+
+    tickers = _parse_tickers(request.GET.get('tickers', ''))
+    if not tickers or len(tickers) > settings.COMPARE_MAX_TICKERS:
+        return JsonResponse({'error': f"Give 1 to {settings.COMPARE_MAX_TICKERS} tickers."}, status=400)
+
+    start_date = request.GET.get('start_date') or '1900-01-01'
+    end_date = request.GET.get('end_date') or datetime.now().date().isoformat()
+
+    try:
+        pd.Timestamp(start_date), pd.Timestamp(end_date)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date range.'}, status=400)
+
+    stored = [t for t in tickers if BarStore.count(t, start_date, end_date)]
+    if not stored:
+        return JsonResponse({'error': 'No stored data found for the tickers in the specified date range.'}, status=404)
+
+    def chunks():
+        for ticker in stored:
+            bars = BarStore.slice(ticker, start_date, end_date).reset_index()
+            bars.insert(1, 'ticker', ticker)
+            yield from exports.chunked(bars)
+
+    return exports.export_response(request, chunks(), fmt, '_'.join(stored[:5]))
+
+
+def export_datacommons(request, fmt):
+    """
+    A Data Commons series (?country_code=&indicator_code=&frequency=) as date and value rows.
+    """
+    if not exports.available(fmt):
+        return _export_error(fmt)
+
+    country_code = request.GET.get('country_code', '')
+    indicator_code = request.GET.get('indicator_code', '')
+    frequency = request.GET.get('frequency', 'A')
+
+    data = DataCommonsData.get_data_commons_data(country_code, indicator_code, frequency)
+    if data is None or data.empty:
+        return JsonResponse({'error': 'No data found for the specified parameters.'}, status=404)
+
+    filename = f"{country_code}_{indicator_code}_{frequency}".replace('/', '_')
+    return exports.export_response(request, exports.chunked(data), fmt, filename)
+
+
+def export_general_data(request, fmt):
+    """
+    The IMF tables of the General Data page, one column per indicator.
+    """
+    if not exports.available(fmt):
+        return _export_error(fmt)
+
+    snapshot = GDIMF.snapshot()
+    if snapshot is None:
+        return JsonResponse({'error': 'No data available.'}, status=404)
+
+    table = None
+    for t in snapshot['tables']:
+        table = t['table'] if table is None else table.merge(t['table'], on='Country', how='outer')
+
+    return exports.export_response(request, exports.chunked(table), fmt, f"imf_{snapshot['year']}")
+
+
+def portfolio_simulation(request):
+    """
+    Monte Carlo value ranges of a buy-and-hold portfolio, streamed as newline
+    delimited JSON: one line with the percentile bands after every finished chunk
+    of paths. Query: ?tickers=AAPL,MSFT&weights=0.6,0.4&horizon=252&paths=10000
+    &seed=0&method=bootstrap|normal.
+    """
+    tickers = _parse_tickers(request.GET.get('tickers', ''))
+
+    try:
+        weights = [float(w) for w in request.GET['weights'].split(',')] if request.GET.get('weights') else None
+        horizon = int(request.GET.get('horizon', 252))
+        paths = int(request.GET.get('paths', 10000))
+        seed = int(request.GET.get('seed', 0))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid simulation parameters.'}, status=400)
+
+    method = request.GET.get('method', montecarlo.BOOTSTRAP)
+
+    if not tickers or len(tickers) > settings.COMPARE_MAX_TICKERS:
+        return JsonResponse({'error': f"Give 1 to {settings.COMPARE_MAX_TICKERS} tickers."}, status=400)
+    if weights is not None and (len(weights) != len(tickers) or any(w < 0 for w in weights) or sum(weights) <= 0):
+        return JsonResponse({'error': 'Give one non-negative weight per ticker.'}, status=400)
+    if not 1 <= horizon <= settings.SIMULATION_MAX_HORIZON or not 1 <= paths <= settings.SIMULATION_MAX_PATHS:
+        return JsonResponse({'error': 'Horizon or number of paths out of range.'}, status=400)
+    if method not in (montecarlo.BOOTSTRAP, montecarlo.NORMAL):
+        return JsonResponse({'error': f"Unknown method {method}."}, status=400)
+
+    updates = MonteCarloSimulator.stream(
+        tickers, weights, horizon, paths, seed, method,
+        request.GET.get('start_date'), request.GET.get('end_date'),
+    )
+    lines = (json.dumps(update) + '\n' for update in updates)
+    return StreamingHttpResponse(streaming.content(request, lines), content_type='application/x-ndjson')
+
+
+def metrics(request):
+    """
+    Prometheus metrics of all workers: request, stage and upstream latency
+    histograms, cache hits and misses per key family, single_flight coalescing
+    and the shared Alpha Vantage budget. Needs `Authorization: Bearer
+    <METRICS_TOKEN>`; without a token set it is only served with DEBUG on.
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponse(status=403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {settings.METRICS_TOKEN}".encode()):
+        return HttpResponse(status=401)
+
+    quota = AlphaVantageScheduler.status()
+    gauges = {
+        'macronomics_alpha_vantage_tokens': ('Tokens left in the shared Alpha Vantage bucket.', {(): quota['tokens']}),
+        'macronomics_alpha_vantage_calls_today': ('Alpha Vantage calls used today (UTC).', {(): quota['day_used']}),
+        'macronomics_alpha_vantage_calls_per_day': ('Daily Alpha Vantage call budget.', {(): quota['calls_per_day']}),
+        'macronomics_alpha_vantage_waiting': (
+            'Callers of the scraped worker waiting for an Alpha Vantage token.',
+            {(('priority', priority),): count for priority, count in quota['waiting'].items()},
+        ),
+    }
+
+    response = HttpResponse(Metrics.exposition(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+    add_never_cache_headers(response)
+    return response
@@ -46,11 +46,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.middleware.TimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "app.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -68,6 +70,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.context_processors.plotly',
+                'app.context_processors.export_formats',
             ],
         },
     },
@@ -87,6 +91,25 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared by all worker processes, so cache locks and counters are seen by every worker.
+# Set REDIS_URL in production; the file cache is used for local development.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get('CACHE_DIR', str(BASE_DIR / 'data' / 'cache')),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get('REDIS_URL'),
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,3 +154,161 @@ STATICFILES_DIRS = [BASE_DIR / 'app' / 'static']
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 ALPHA_VANTAGE_API_KEY = os.environ.get('ALPHA_VANTAGE_API_KEY')
+
+# Local daily bar store shared by all worker processes (see app/bar_store.py)
+BAR_STORE_DIR = os.environ.get('BAR_STORE_DIR', str(BASE_DIR / 'data' / 'bars'))
+BAR_STORE_TTL = 86400
+
+# Alpha Vantage quota shared by all workers (see app/quota.py)
+ALPHA_VANTAGE_CALLS_PER_MINUTE = int(os.environ.get('ALPHA_VANTAGE_CALLS_PER_MINUTE', 5))
+ALPHA_VANTAGE_CALLS_PER_DAY = int(os.environ.get('ALPHA_VANTAGE_CALLS_PER_DAY', 25))
+ALPHA_VANTAGE_INTERACTIVE_RESERVE = 1
+ALPHA_VANTAGE_INTERACTIVE_DAILY_RESERVE = 5
+
+# Seconds the markets pages are cached per URL, on the server and in the browser
+MARKETS_PAGE_CACHE_TTL = 300
+
+# Most tickers accepted by the markets comparison page
+COMPARE_MAX_TICKERS = 50
+
+# Portfolio analytics (see PortfolioAnalytics): seconds results are cached per
+# portfolio and window, and the confidence level of the value at risk
+PORTFOLIO_CACHE_TTL = 3600
+PORTFOLIO_VAR_LEVEL = 0.95
+
+# Monte Carlo simulator (see MonteCarloSimulator): worker processes, simulated
+# asset-days per chunk, percentile bands reported and seconds results are cached
+SIMULATION_WORKERS = int(os.environ.get('SIMULATION_WORKERS', os.cpu_count() or 2))
+SIMULATION_CHUNK_CELLS = 5_000_000
+SIMULATION_PERCENTILES = [5, 25, 50, 75, 95]
+SIMULATION_CACHE_TTL = 3600
+SIMULATION_MAX_PATHS = 200_000
+SIMULATION_MAX_HORIZON = 5 * 252
+
+# Data exports: rows converted per chunk and bytes per block of a streamed file
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+# Point budget of downsampled line charts (see app/downsample.py)
+CHART_POINT_BUDGET = 1500
+CHART_MIN_POINTS = 200
+CHART_MAX_POINTS = 4000
+
+# Indicator overlays of the market charts (see Overlays): most overlays per chart,
+# longest window and seconds a computed overlay is kept for extending
+OVERLAY_MAX = 6
+OVERLAY_MAX_WINDOW = 500
+OVERLAY_CACHE_TTL = 7 * 24 * 3600
+
+# Fewest candles a candlestick chart is drawn with before a finer level is used
+CANDLE_MIN_BARS = 100
+
+# Data Commons series cache (see DataCommonsData.get_data_commons_data): seconds a
+# series is fresh by frequency, and how long a stale one is served while refreshing
+DATA_COMMONS_TTL = {
+    'A': 7 * 86400,
+    'Q': 2 * 86400,
+    'M': 86400,
+    'D': 6 * 3600,
+}
+DATA_COMMONS_STALE_TTL = 30 * 86400
+
+# Places per get_stat_all call when fetching a whole category panel, and seconds
+# an empty or failed panel fetch is remembered before it is tried again
+DATA_COMMONS_BULK_BATCH = 50
+DATA_COMMONS_PANEL_RETRY = 300
+
+# IMF General Data snapshot (see GDIMF): file, seconds before it is refreshed on
+# access, and the year shown in the tables
+IMF_SNAPSHOT_PATH = os.environ.get('IMF_SNAPSHOT_PATH', str(BASE_DIR / 'data' / 'imf_general_data.pkl'))
+IMF_REFRESH_INTERVAL = 86400
+IMF_YEAR = int(os.environ.get('IMF_YEAR', 2024))
+
+# IMF DataMapper client (see IMFDataMapper): request timeout, retries with
+# exponential backoff, pooled connections and the longest URL sent
+IMF_TIMEOUT = 10
+IMF_RETRIES = 3
+IMF_BACKOFF = 0.5
+IMF_POOL_SIZE = 4
+IMF_MAX_URL_LENGTH = 2000
+
+# Request popularity counters (see Popularity) and the warm_caches command: how
+# often counters are merged into the cache, how many of the most requested tickers
+# and series are warmed, how long before expiry, with how many threads, and the
+# factor the counts decay by after every round
+POPULARITY_FLUSH_INTERVAL = 30
+WARM_TOP_N = 20
+WARM_AHEAD = 3600
+WARM_WORKERS = 4
+WARM_DECAY = 0.9
+
+# Watchlist digests (see DigestEngine): parallel series fetches, e-mails per SMTP
+# batch and how many days of market data are checked for new bars
+DIGEST_WORKERS = 4
+DIGEST_BATCH_SIZE = 100
+DIGEST_LOOKBACK_DAYS = 30
+
+# Alpha Vantage news store (see NewsIndex), filled with `manage.py ingest_news`:
+# file, articles per call, calls per run, hours fetched into an empty store, most
+# articles kept and headlines shown per page
+NEWS_INDEX_PATH = os.environ.get('NEWS_INDEX_PATH', str(BASE_DIR / 'data' / 'news_index.pkl'))
+NEWS_PAGE_SIZE = 1000
+NEWS_MAX_CALLS = 3
+NEWS_LOOKBACK_HOURS = 72
+NEWS_MAX_ARTICLES = 20000
+NEWS_HEADLINES = 5
+
+# Outgoing mail. The defaults point at a local SMTP stand-in, e.g.
+# `python -m aiosmtpd -n -l localhost:1025`
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 1025))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'digest@macronomics.local')
+
+# Data Commons availability index, built with `manage.py build_availability`
+AVAILABILITY_INDEX_PATH = os.environ.get('AVAILABILITY_INDEX_PATH', str(BASE_DIR / 'data' / 'availability.npz'))
+
+# Request metrics (see Metrics), served in the Prometheus format at /metrics:
+# histogram buckets in seconds, how often the counters of a process are merged
+# into the cache, and the bearer token scrapers must send (without one the
+# endpoint is only served with DEBUG on)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_FLUSH_INTERVAL = 15
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# On-demand profiling (see ProfilingMiddleware): whether staff may profile
+# requests of these views with `X-Profile: 1` or `?profile=1`, the sampling
+# interval in seconds, where the flame graph stacks go and how many are kept
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_VIEWS = ('macrodata_search', 'markets_period', 'general_data')
+PROFILING_INTERVAL = 0.001
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'data' / 'profiles'))
+PROFILING_MAX_FILES = 50
+
+# Logging: level of the app's loggers and the share of records below WARNING
+# that are written (see SampledFilter)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampled': {'()': 'app.metrics.SampledFilter'},
+    },
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['sampled'],
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'app': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
@@ -25,5 +25,11 @@ urlpatterns = [
     path('markets_search/', views.markets_data, name='markets_search'),
     path('markets_results/', views.markets_results, name='markets_results'),
     path('markets_period/<str:ticker>/<str:period>/', views.markets_period, name='markets_period'),
+    path('markets_compare/<str:period>/', views.markets_compare, name='markets_compare'),
     path('general_data/', views.gd_popular_countries_data, name='general_data'),
+    path('metrics', views.metrics, name='metrics'),
+    path('portfolio/simulation/', views.portfolio_simulation, name='portfolio_simulation'),
+    path('export/markets.<str:fmt>', views.export_markets, name='export_markets'),
+    path('export/datacommons.<str:fmt>', views.export_datacommons, name='export_datacommons'),
+    path('export/general_data.<str:fmt>', views.export_general_data, name='export_general_data'),
 ]